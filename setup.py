@@ -40,8 +40,12 @@ setup(
     keywords=['TamedAI', 'IDP', 'Perceptor', 'LLM'],
     install_requires=[
         'annotated-types==0.5.0',
+        'anyio==4.0.0',
         'certifi==2023.7.22',
         'charset-normalizer==3.2.0',
+        'h11==0.14.0',
+        'httpcore==0.18.0',
+        'httpx==0.25.0',
         'idna==3.4',
         'pdf2image==1.16.3',
         'Pillow==10.0.1',
@@ -49,11 +53,15 @@ setup(
         'pydantic_core==2.6.3',
         'requests==2.31.0',
         'six==1.16.0',
+        'sniffio==1.3.0',
         'sseclient-py==1.8.0',
         'tenacity==8.2.3',
         'typing_extensions==4.8.0',
         'urllib3==2.0.5'
     ],
+    extras_require={
+        'fast-json': ['orjson==3.9.7']
+    },
     classifiers=[
         "Programming Language :: Python :: 3.9",
         "Operating System :: OS Independent"
@@ -12,28 +12,72 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import asyncio
+import dataclasses
 import logging
 import time
-from typing import Union
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Union, Optional, AsyncIterator, Hashable
 
 from perceptor_client_lib.external_models import PerceptorRequest, \
-    InstructionWithResult, DocumentImageResult
+    InstructionWithResult, DocumentImageResult, RequestPriority
 from perceptor_client_lib.internal_models import InstructionContextData, PerceptorRepositoryRequest, \
-    InstructionMethod, InstructionError, ClassifyEntry
+    InstructionMethod, InstructionError, ClassifyEntry, InstructionPartialResult, _InstructionResult, \
+    _InstructionStreamItem
 from perceptor_client_lib.perceptor_repository import _PerceptorRepository
-from perceptor_client_lib.task_limiter import TaskLimiter
+
+_DEADLINE_EXCEEDED_ERROR_TEXT = "deadline exceeded"
+
+
+@dataclass(frozen=True)
+class _SchedulingContext:
+    """
+    Runs repositories without native async support, None for the default executor of the event loop
+    """
+    executor: Optional[Executor] = None
+    """
+    Point in time (time.monotonic) by which the call has to be finished, None for no deadline
+    """
+    deadline: Optional[float] = None
+    """
+    Order in which the instructions are sent while waiting for a free slot
+    """
+    priority: RequestPriority = RequestPriority.NORMAL
+    """
+    Instructions of the same tenant take turns with other tenants, None makes every call a turn of its own
+    """
+    tenant: Optional[str] = None
+    """
+    Max. number of contexts taken from a stream but not processed yet, None for no limit
+    """
+    max_pending_contexts: Optional[int] = None
+
+    def for_call(self, deadline: Optional[float], priority: RequestPriority,
+                 tenant: Optional[str]) -> '_SchedulingContext':
+        """
+        Returns a copy with the call specific values, the client keeps one instance for its other values.
+        """
+        return dataclasses.replace(self, deadline=deadline, priority=priority, tenant=tenant)
+
+    def get_remaining_time(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+
+_DEFAULT_SCHEDULING = _SchedulingContext()
 
 
 class _ContentSession:
 
     def __init__(self, repository: _PerceptorRepository, context_data: InstructionContextData,
-                 task_limiter: TaskLimiter,
-                 thread_delay_factor: float):
+                 scheduling: _SchedulingContext = _DEFAULT_SCHEDULING,
+                 flow: Hashable = None):
         self._repository: _PerceptorRepository = repository
+        self._scheduling: _SchedulingContext = scheduling
+        self._flow: Hashable = flow
         self._logger = logging.getLogger(self.__class__.__name__)
         self._context_data: InstructionContextData = context_data
-        self._thread_delay_factor: float = thread_delay_factor
-        self._task_limiter = task_limiter
 
     async def process_instructions_request(self, request: PerceptorRequest,
                                            method: InstructionMethod,
@@ -44,57 +88,119 @@ class _ContentSession:
         if len(instructions) == 0:
             return []
 
-        pool_size = min(len(instructions), self._task_limiter.get_max_number_of_threads())
-
-        async def send_single_instruction(instruction_index: int, instruction: str) -> InstructionWithResult:
-            task_delay = self._thread_delay_factor * (instruction_index % pool_size)
-            time.sleep(task_delay)
+        # shared by all instructions of the session, so the context is serialized only once
+        req: PerceptorRepositoryRequest = self._create_repository_request(request, method)
 
-            response = self._process_instruction(request, method, instruction,
-                                                 classify_entries)
-            return response
+        async def send_limited(instruction: str) -> InstructionWithResult:
+            # also limits the time spent waiting for a free slot,
+            # cancels the request (and pending retries) once the deadline is exceeded
+            try:
+                return await asyncio.wait_for(self._process_instruction(req, instruction, classify_entries),
+                                              timeout=self._scheduling.get_remaining_time())
+            except asyncio.TimeoutError:
+                return InstructionWithResult.error(instruction, _DEADLINE_EXCEEDED_ERROR_TEXT)
 
         if isinstance(instructions, str):
-            return await send_single_instruction(0, instructions)
+            return await send_limited(instructions)
 
-        instructions_list: list = list(enumerate(instructions))
-
-        task_list = map(lambda t: self._task_limiter.exec_task(send_single_instruction(t[0], t[1])), instructions_list)
+        task_list = map(send_limited, instructions)
 
         results = await asyncio.gather(*task_list)
         # noinspection PyTypeChecker
         return results
 
-    def _process_instruction(self, request: PerceptorRequest, method: InstructionMethod,
-                             instruction: str,
-                             classify_entries: list[ClassifyEntry]) -> InstructionWithResult:
+    def _create_repository_request(self, request: PerceptorRequest,
+                                   method: InstructionMethod) -> PerceptorRepositoryRequest:
+        mapped_params = request.params.copy()
+        mapped_params["returnScores"] = str(request.return_scores)
+        return PerceptorRepositoryRequest(
+            params=mapped_params,
+            flavor=request.flavor,
+            context_data=self._context_data,
+            method=method,
+            deadline=self._scheduling.deadline,
+            priority=self._scheduling.priority,
+            flow=self._flow
+        )
+
+    @staticmethod
+    def _map_instruction_result(instruction: str, result: _InstructionResult) -> InstructionWithResult:
+        if isinstance(result, str):
+            return InstructionWithResult.success(instruction, result)
+
+        err_resp: InstructionError = result
+        return InstructionWithResult.error(instruction, err_resp.error_text)
+
+    async def _process_instruction(self, req: PerceptorRepositoryRequest,
+                                   instruction: str,
+                                   classify_entries: list[ClassifyEntry]) -> InstructionWithResult:
         self._logger.debug("processing instruction: %s", dict(instruction=instruction,
-                                                              req=request,
+                                                              flavor=req.flavor,
+                                                              params=req.params,
                                                               classes=classify_entries))
 
-        def create_repository_request() -> PerceptorRepositoryRequest:
-            mapped_params = request.params.copy()
-            mapped_params["returnScores"] = str(request.return_scores)
-            return PerceptorRepositoryRequest(
-                params=mapped_params,
-                flavor=request.flavor,
-                context_data=self._context_data,
-                method=method
-            )
-
-        req: PerceptorRepositoryRequest = create_repository_request()
-
         try:
-            result = self._repository.send_instruction(req, instruction, classify_entries)
+            result = await self._send_instruction(req, instruction, classify_entries)
+            return self._map_instruction_result(instruction, result)
+        except Exception as exc:
+            self._logger.error(exc)
+            return InstructionWithResult.error(instruction, str(exc))
 
-            if isinstance(result, str):
-                return InstructionWithResult.success(instruction, result)
+    async def stream_instruction_request(self, request: PerceptorRequest,
+                                         method: InstructionMethod,
+                                         instruction: str,
+                                         classify_entries: list[ClassifyEntry]) \
+            -> AsyncIterator[Union[str, InstructionWithResult]]:
+        self._logger.debug("streaming instruction: %s", dict(instruction=instruction,
+                                                             req=request,
+                                                             classes=classify_entries))
 
-            err_resp: InstructionError = result
-            return InstructionWithResult.error(instruction, err_resp.error_text)
+        req: PerceptorRepositoryRequest = self._create_repository_request(request, method)
+
+        items = self._stream_instruction(req, instruction, classify_entries)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(items.__anext__(), timeout=self._scheduling.get_remaining_time())
+                except StopAsyncIteration:
+                    return
+                if isinstance(item, InstructionPartialResult):
+                    yield item.text
+                else:
+                    yield self._map_instruction_result(instruction, item)
+        except asyncio.TimeoutError:
+            yield InstructionWithResult.error(instruction, _DEADLINE_EXCEEDED_ERROR_TEXT)
         except Exception as exc:
             self._logger.error(exc)
-            return InstructionWithResult.error(instruction, str(exc))
+            yield InstructionWithResult.error(instruction, str(exc))
+        finally:
+            await items.aclose()
+
+    async def _send_instruction(self, req: PerceptorRepositoryRequest,
+                                instruction: str,
+                                classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        if self._repository.supports_async():
+            return await self._repository.send_instruction_async(req, instruction, classify_entries)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._scheduling.executor, self._repository.send_instruction,
+                                          req, instruction, classify_entries)
+
+    async def _stream_instruction(self, req: PerceptorRepositoryRequest,
+                                  instruction: str,
+                                  classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        if self._repository.supports_async():
+            async for item in self._repository.stream_instruction(req, instruction, classify_entries):
+                yield item
+        else:
+            yield await self._send_instruction(req, instruction, classify_entries)
+
+
+def _get_flow(tenant: Optional[str]) -> Hashable:
+    # instructions of the same tenant, otherwise of the same call, take turns with other flows in the task limiter
+    if tenant is not None:
+        return tenant
+    return object()
 
 
 def _map_classify_entries(string_list: list[str]):
@@ -107,14 +213,15 @@ async def process_contents(repository: _PerceptorRepository,
                            method: InstructionMethod,
                            instructions: Union[str, list[str]],
                            classify_entries: list[str],
-                           task_limiter: TaskLimiter,
-                           thread_delay_factor: float
+                           scheduling: _SchedulingContext = _DEFAULT_SCHEDULING
                            ) -> Union[InstructionWithResult, list[InstructionWithResult], list[DocumentImageResult]]:
     if method == InstructionMethod.CLASSIFY and len(classify_entries) < 2:
         raise ValueError("number of classes must be > 1")
 
+    flow = _get_flow(scheduling.tenant)
+
     if isinstance(data_context, InstructionContextData):
-        session = _ContentSession(repository, data_context, task_limiter, thread_delay_factor)
+        session = _ContentSession(repository, data_context, scheduling, flow)
         return await session.process_instructions_request(request, method, instructions,
                                                           _map_classify_entries(classify_entries))
 
@@ -126,21 +233,98 @@ async def process_contents(repository: _PerceptorRepository,
 
     multiple_contexts: list[InstructionContextData] = data_context
 
-    async def process_data_context(context_info: (int, InstructionContextData)):
-        page_index, ctx = context_info
-        context_data: InstructionContextData = ctx
-        single_session = _ContentSession(repository, context_data, task_limiter, thread_delay_factor)
-
-        request_instruction_result = await single_session.process_instructions_request(
-            request, method, instructions,
-            _map_classify_entries(classify_entries))
-
-        return DocumentImageResult(page_number=page_index,
-                                   instruction_results=request_instruction_result)
-
-    task_list = map(lambda t: process_data_context(t),
+    task_list = map(lambda t: _process_page(repository, t[0], t[1], request, method, instructions, classify_entries,
+                                            scheduling, flow),
                     enumerate(multiple_contexts))
 
     result = await asyncio.gather(*task_list)
     # noinspection PyTypeChecker
     return result
+
+
+async def _process_page(repository: _PerceptorRepository,
+                        page_index: int,
+                        context_data: InstructionContextData,
+                        request: PerceptorRequest,
+                        method: InstructionMethod,
+                        instructions: Union[str, list[str]],
+                        classify_entries: list[str],
+                        scheduling: _SchedulingContext,
+                        flow: Hashable) -> DocumentImageResult:
+    single_session = _ContentSession(repository, context_data, scheduling, flow)
+
+    request_instruction_result = await single_session.process_instructions_request(
+        request, method, instructions,
+        _map_classify_entries(classify_entries))
+
+    return DocumentImageResult(page_number=page_index,
+                               instruction_results=request_instruction_result,
+                               context_type=context_data.context_type)
+
+
+async def process_content_stream(repository: _PerceptorRepository,
+                                 data_contexts: AsyncIterator[tuple[int, InstructionContextData]],
+                                 request: PerceptorRequest,
+                                 method: InstructionMethod,
+                                 instructions: Union[str, list[str]],
+                                 classify_entries: list[str],
+                                 scheduling: _SchedulingContext = _DEFAULT_SCHEDULING
+                                 ) -> list[DocumentImageResult]:
+    """
+    Processes (page index, context) items as soon as they are produced, e.g. while the next pages are rendered.
+    Returns the results in the order of the items. No more items are taken once the deadline is exceeded,
+    so items not produced by then are missing from the results. Takes no more than
+    scheduling.max_pending_contexts items not processed yet.
+    """
+    if method == InstructionMethod.CLASSIFY and len(classify_entries) < 2:
+        raise ValueError("number of classes must be > 1")
+
+    flow = _get_flow(scheduling.tenant)
+    pending = None if scheduling.max_pending_contexts is None else asyncio.Semaphore(scheduling.max_pending_contexts)
+
+    async def process_pending_page(page_index: int, context_data: InstructionContextData) -> DocumentImageResult:
+        try:
+            return await _process_page(repository, page_index, context_data, request, method, instructions,
+                                       classify_entries, scheduling, flow)
+        finally:
+            if pending is not None:
+                pending.release()
+
+    tasks: list[asyncio.Task] = []
+    try:
+        while True:
+            if pending is not None:
+                await pending.acquire()
+            remaining_time = scheduling.get_remaining_time()
+            if remaining_time is not None and remaining_time <= 0:
+                break
+            try:
+                page_index, context_data = await asyncio.wait_for(data_contexts.__anext__(), timeout=remaining_time)
+            except (StopAsyncIteration, asyncio.TimeoutError):
+                break
+            tasks.append(asyncio.ensure_future(process_pending_page(page_index, context_data)))
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+        if hasattr(data_contexts, "aclose"):
+            await data_contexts.aclose()
+
+
+async def stream_contents(repository: _PerceptorRepository,
+                          data_context: InstructionContextData,
+                          request: PerceptorRequest,
+                          method: InstructionMethod,
+                          instruction: str,
+                          classify_entries: list[str],
+                          scheduling: _SchedulingContext = _DEFAULT_SCHEDULING
+                          ) -> AsyncIterator[Union[str, InstructionWithResult]]:
+    if method == InstructionMethod.CLASSIFY and len(classify_entries) < 2:
+        raise ValueError("number of classes must be > 1")
+
+    flow = _get_flow(scheduling.tenant)
+
+    session = _ContentSession(repository, data_context, scheduling, flow)
+    async for item in session.stream_instruction_request(request, method, instruction,
+                                                         _map_classify_entries(classify_entries)):
+        yield item
@@ -13,6 +13,7 @@
 #  limitations under the License.
 
 from dataclasses import dataclass, field
+from enum import Enum
 from typing import Union, Optional
 
 from pydantic import BaseModel
@@ -36,6 +37,15 @@ class PerceptorRequest(BaseModel):
         return PerceptorRequest(flavor=f)
 
 
+class RequestPriority(Enum):
+    """
+    Order in which queued instructions get a free slot, e.g. HIGH for interactive and LOW for bulk processing
+    """
+    HIGH = 1
+    NORMAL = 2
+    LOW = 3
+
+
 class InstructionWithResult(BaseModel):
     """
     Original instruction text
@@ -76,6 +86,108 @@ class DocumentImageResult(BaseModel):
     Instructions and corresponding results
     """
     instruction_results: Union[list[InstructionWithResult], InstructionWithResult]
+    """
+    How the page was sent: "image", or "text" if the text layer of a pdf page was sent instead of an image
+    """
+    context_type: str = "image"
+
+
+class ConnectionPoolStatistics(BaseModel):
+    """
+    Number of http requests sent
+    """
+    requests: int = 0
+    """
+    Number of connections opened
+    """
+    new_connections: int = 0
+    """
+    Number of requests sent over an already opened (keep-alive) connection
+    """
+    reused_connections: int = 0
+
+
+class HedgingStatistics(BaseModel):
+    """
+    Number of requests sent (not counting duplicates)
+    """
+    requests: int = 0
+    """
+    Number of requests for which a duplicate was sent
+    """
+    hedged_requests: int = 0
+    """
+    Number of requests answered by the duplicate first
+    """
+    hedges_won: int = 0
+
+
+class CacheStatistics(BaseModel):
+    """
+    Number of responses served from the cache
+    """
+    hits: int = 0
+    """
+    Number of requests sent because the response was not cached
+    """
+    misses: int = 0
+    """
+    Number of cached responses
+    """
+    entries: int = 0
+    """
+    Size (in bytes) of the cached responses
+    """
+    size_bytes: int = 0
+
+
+class CoalescingStatistics(BaseModel):
+    """
+    Number of requests passed to the client
+    """
+    requests: int = 0
+    """
+    Number of requests which were not sent, but shared the response of an identical request in flight
+    """
+    coalesced_requests: int = 0
+
+
+class QueueWaitStatistics(BaseModel):
+    """
+    Number of instructions started
+    """
+    started_tasks: int = 0
+    """
+    Number of instructions waiting for a free slot
+    """
+    queue_depth: int = 0
+    """
+    Average time (in seconds) spent waiting for a free slot
+    """
+    average_wait_time: float = 0
+    """
+    Longest time (in seconds) spent waiting for a free slot
+    """
+    max_wait_time: float = 0
+
+
+class ConcurrencyStatistics(BaseModel):
+    """
+    Max. number of instructions processed concurrently (adjusted in adaptive mode)
+    """
+    current_limit: int
+    """
+    Number of instructions being processed
+    """
+    active_tasks: int = 0
+    """
+    Number of instructions waiting for a free slot
+    """
+    queue_depth: int = 0
+    """
+    Time spent waiting for a free slot, per priority
+    """
+    wait_statistics: dict[RequestPriority, QueueWaitStatistics] = {}
 
 
 @dataclass
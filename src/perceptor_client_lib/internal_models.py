@@ -13,10 +13,12 @@
 #  limitations under the License.
 
 from enum import Enum
-from typing import Union
+from typing import Union, Optional, Hashable
 from dataclasses import dataclass
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+
+from perceptor_client_lib.external_models import RequestPriority
 
 
 class InstructionMethod(Enum):
@@ -50,6 +52,26 @@ class PerceptorRepositoryRequest(BaseModel):
     params: dict
     context_data: InstructionContextData
     method: InstructionMethod = InstructionMethod.QUESTION
+    """
+    Point in time (time.monotonic) by which the instruction has to be finished, None for no deadline
+    """
+    deadline: Optional[float] = None
+    """
+    Order in which the instruction is sent while waiting for a free slot
+    """
+    priority: RequestPriority = RequestPriority.NORMAL
+    """
+    Instructions of the same flow (tenant or call) take turns with other flows while waiting for a free slot
+    """
+    flow: Hashable = None
+    """
+    Serialized instruction independent part of the request body, filled by the repository on first use
+    """
+    _body_template: Optional[bytes] = PrivateAttr(default=None)
+    """
+    Hash of the instruction independent part of the request, filled by the response cache on first use
+    """
+    _cache_key_prefix: Optional[str] = PrivateAttr(default=None)
 
 
 class InstructionError(BaseModel):
@@ -61,6 +83,19 @@ class InstructionError(BaseModel):
     True if the error is worth retrying
     """
     is_retryable: bool = True
+    """
+    Time (in seconds) the server asked to wait before sending further requests (Retry-After, rate limit headers)
+    """
+    retry_after: Optional[float] = None
+
+
+@dataclass
+class InstructionPartialResult:
+    """
+    Intermediate text sent by the server before the instruction is finished.
+    """
+    text: str
 
 
 _InstructionResult = Union[str, InstructionError]
+_InstructionStreamItem = Union[InstructionPartialResult, str, InstructionError]
@@ -0,0 +1,72 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JsonCodec:
+    """
+    Serializes request bodies and parses structured responses.
+    """
+
+    def dumps(self, to_dump: Any) -> bytes:
+        raise Exception("not implemented, must override")
+
+    def loads(self, to_parse: Union[str, bytes]) -> Any:
+        """
+        Raises json.JSONDecodeError for invalid input.
+        """
+        raise Exception("not implemented, must override")
+
+
+class StdlibJsonCodec(JsonCodec):
+    def dumps(self, to_dump: Any) -> bytes:
+        return json.dumps(to_dump, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+    def loads(self, to_parse: Union[str, bytes]) -> Any:
+        return json.loads(to_parse)
+
+
+class OrjsonCodec(JsonCodec):
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed, install perceptor_client_lib[fast-json]")
+
+    def dumps(self, to_dump: Any) -> bytes:
+        return orjson.dumps(to_dump)
+
+    def loads(self, to_parse: Union[str, bytes]) -> Any:
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return orjson.loads(to_parse)
+
+
+_json_codec: JsonCodec = StdlibJsonCodec() if orjson is None else OrjsonCodec()
+
+
+def get_json_codec() -> JsonCodec:
+    return _json_codec
+
+
+def set_json_codec(codec: JsonCodec) -> None:
+    """
+    Replaces the codec used by the client, by default orjson is used if installed, otherwise the json module.
+    """
+    global _json_codec
+    _json_codec = codec
@@ -12,11 +12,75 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
 import io
 import os
-from typing import Union, Optional
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Union, Optional, AsyncIterator, Callable, Iterable
 
-from pdf2image import convert_from_path, convert_from_bytes
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pydantic import BaseModel
+
+from perceptor_client_lib.image_parsing import _parse_image_from_bytes
+from perceptor_client_lib.internal_models import InstructionMethod, InstructionContextData, TextContextData
+
+
+class ImageFormat(Enum):
+    PNG = "png"
+    JPEG = "jpeg"
+
+
+class RenderProfile(BaseModel):
+    """
+    Resolution pdf pages are rendered with
+    """
+    dpi: int = 200
+    """
+    Renders pages in grayscale instead of color
+    """
+    grayscale: bool = False
+    """
+    Format the rendered pages are sent in, JPEG is lossy, but much smaller than PNG
+    """
+    image_format: ImageFormat = ImageFormat.PNG
+    """
+    Quality (1-100) of JPEG images, ignored for PNG
+    """
+    quality: int = 85
+
+
+RENDER_PROFILE_PRESETS: dict[InstructionMethod, RenderProfile] = {
+    InstructionMethod.QUESTION: RenderProfile(dpi=200, image_format=ImageFormat.JPEG, quality=90),
+    # the layout is enough to tell the type of a document
+    InstructionMethod.CLASSIFY: RenderProfile(dpi=100, grayscale=True, image_format=ImageFormat.JPEG, quality=75),
+    # small digits in table cells need a higher resolution and lossless images
+    InstructionMethod.TABLE: RenderProfile(dpi=300, image_format=ImageFormat.PNG),
+}
+
+
+class TextLayerPolicy(BaseModel):
+    """
+    Min. number of non-whitespace characters in the text layer of a page for the page to be sent as text,
+    pages with less text (e.g. scans) or whose text cannot be extracted are rendered and sent as image
+    """
+    min_characters: int = 200
+    """
+    Keeps the physical layout of the text (e.g. table columns) instead of the reading order
+    """
+    preserve_layout: bool = True
+
+
+"""
+Zero based indices of pages (negative indices count from the last page), ranges of pages
+or a callable returning whether a page index is selected. Indices out of range raise a ValueError,
+ranges (also a single range passed instead of a list) are clipped to the pages of the document
+"""
+PageSelection = Union[Iterable[Union[int, range]], Callable[[int], bool]]
 
 
 def _get_poppler_path() -> Optional[str]:
@@ -26,27 +90,159 @@ def _get_poppler_path() -> Optional[str]:
     return resolved_path
 
 
-async def get_images_from_document_pages(file: Union[str, io.BufferedReader, bytes]) -> list[bytes]:
-    poppler_path = _get_poppler_path()
-
-    def get_bytes_from_image(im):
-        img_byte_arr = io.BytesIO()
+def _get_bytes_from_image(im, render_profile: RenderProfile) -> bytes:
+    img_byte_arr = io.BytesIO()
+    if render_profile.image_format == ImageFormat.PNG:
         im.save(img_byte_arr, format='PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        return img_byte_arr
+    else:
+        im.save(img_byte_arr, format=render_profile.image_format.name, quality=render_profile.quality)
+    return img_byte_arr.getvalue()
+
+
+def _write_document(file: Union[io.BufferedReader, bytes], path: str) -> None:
+    file_bytes = file.read() if isinstance(file, io.BufferedReader) else file
+    with open(path, "wb") as f:
+        f.write(file_bytes)
+
+
+@asynccontextmanager
+async def _get_document_path(file: Union[str, io.BufferedReader, bytes]) -> AsyncIterator[str]:
+    """
+    Poppler renders files only, documents in memory are written to a temporary file once for all pages.
+    The file is read and written in the default executor (the render executor may be a process pool,
+    which cannot be passed an open file), so large documents do not stall the event loop.
+    """
+    if isinstance(file, str):
+        yield file
+        return
 
-    def get_images():
-        if isinstance(file, io.BufferedReader):
-            file_bytes = file.read()
-            return convert_from_bytes(file_bytes, poppler_path=poppler_path)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "document.pdf")
+        await asyncio.get_running_loop().run_in_executor(None, _write_document, file, path)
+        yield path
 
-        if isinstance(file, bytes):
-            return convert_from_bytes(file, poppler_path=poppler_path)
 
-        return convert_from_path(file, poppler_path=poppler_path)
+def _get_number_of_pages(path: str, poppler_path: Optional[str]) -> int:
+    return pdfinfo_from_path(path, poppler_path=poppler_path)["Pages"]
 
-    images = get_images()
 
-    mapped = list(map(get_bytes_from_image, images))
+def _render_pages(path: str, first_page_index: int, last_page_index: int, poppler_path: Optional[str],
+                  render_profile: RenderProfile) -> list[bytes]:
+    images = convert_from_path(path, first_page=first_page_index + 1, last_page=last_page_index + 1,
+                               poppler_path=poppler_path, dpi=render_profile.dpi, grayscale=render_profile.grayscale)
+    return [_get_bytes_from_image(im, render_profile) for im in images]
 
-    return mapped
+
+def _render_page(path: str, page_index: int, poppler_path: Optional[str], render_profile: RenderProfile) -> bytes:
+    return _render_pages(path, page_index, page_index, poppler_path, render_profile)[0]
+
+
+def _extract_page_text(path: str, page_index: int, poppler_path: Optional[str], preserve_layout: bool) -> str:
+    pdftotext = "pdftotext" if poppler_path is None else os.path.join(poppler_path, "pdftotext")
+    page_number = str(page_index + 1)
+    args = [pdftotext, "-f", page_number, "-l", page_number, "-enc", "UTF-8"]
+    if preserve_layout:
+        args.append("-layout")
+    completed = subprocess.run(args + [path, "-"], capture_output=True, check=True)
+    return completed.stdout.decode("utf-8")
+
+
+def _is_text_layer_usable(text: str, text_layer_policy: TextLayerPolicy) -> bool:
+    return sum(1 for c in text if not c.isspace()) >= text_layer_policy.min_characters
+
+
+def _get_page_content(path: str, page_index: int, poppler_path: Optional[str], render_profile: RenderProfile,
+                      text_layer_policy: Optional[TextLayerPolicy]) -> InstructionContextData:
+    # runs in the executor, including the base64 encoding of the image, which would stall the event loop
+    if text_layer_policy is not None:
+        try:
+            text = _extract_page_text(path, page_index, poppler_path, text_layer_policy.preserve_layout)
+        except (subprocess.CalledProcessError, OSError):
+            # pdftotext is missing or cannot read the page, the page is rendered instead
+            text = None
+        if text is not None and _is_text_layer_usable(text, text_layer_policy):
+            return TextContextData(text)
+    return _parse_image_from_bytes(_render_page(path, page_index, poppler_path, render_profile),
+                                   render_profile.image_format.value)
+
+
+async def get_images_from_document_pages(file: Union[str, io.BufferedReader, bytes],
+                                         executor: Optional[Executor] = None,
+                                         render_profile: Optional[RenderProfile] = None) -> list[bytes]:
+    """
+    Renders all pages to images (PNG by default), one executor job per page,
+    so the pages are rendered in parallel by the workers of the executor.
+    """
+    render_profile = RenderProfile() if render_profile is None else render_profile
+    poppler_path = _get_poppler_path()
+    loop = asyncio.get_running_loop()
+    async with _get_document_path(file) as path:
+        number_of_pages = await loop.run_in_executor(executor, _get_number_of_pages, path, poppler_path)
+        rendering = [loop.run_in_executor(executor, _render_page, path, page_index, poppler_path, render_profile)
+                     for page_index in range(number_of_pages)]
+        # the temporary file must not be removed while pages are still rendered
+        rendered = await asyncio.gather(*rendering, return_exceptions=True)
+    for image in rendered:
+        if isinstance(image, BaseException):
+            raise image
+    return rendered
+
+
+def _select_pages(pages: Optional[PageSelection], number_of_pages: int) -> list[int]:
+    if pages is None:
+        return list(range(number_of_pages))
+    if callable(pages):
+        return [i for i in range(number_of_pages) if pages(i)]
+    if isinstance(pages, range):
+        # a single range is selected like a list holding it
+        pages = [pages]
+
+    selected: set[int] = set()
+    for page in pages:
+        if isinstance(page, range):
+            # like slicing, pages beyond the end of the document are ignored
+            selected.update(i for i in page if 0 <= i < number_of_pages)
+            continue
+        if not -number_of_pages <= page < number_of_pages:
+            raise ValueError(f"page index {page} out of range, the document has {number_of_pages} pages")
+        selected.add(page % number_of_pages)
+    return sorted(selected)
+
+
+async def iterate_images_from_document_pages(file: Union[str, io.BufferedReader, bytes],
+                                             look_ahead: int = 2,
+                                             executor: Optional[Executor] = None,
+                                             render_profile: Optional[RenderProfile] = None,
+                                             pages: Optional[PageSelection] = None,
+                                             text_layer_policy: Optional[TextLayerPolicy] = None) \
+        -> AsyncIterator[tuple[int, InstructionContextData]]:
+    """
+    Renders the pages one by one in the executor and yields them in order as (zero based page index, image context),
+    so the first pages can be processed while the next ones are rendered.
+    :param look_ahead: max. number of pages rendered ahead of the page yielded last,
+        up to look_ahead + 1 pages are rendered in parallel
+    :param pages: pages to render, default is all pages
+    :param text_layer_policy: if specified, the text of pages with a sufficient text layer is yielded as text context
+        instead of an image, without rendering the page
+    """
+    if look_ahead < 1:
+        raise ValueError("look_ahead must be > 0")
+    render_profile = RenderProfile() if render_profile is None else render_profile
+    poppler_path = _get_poppler_path()
+    loop = asyncio.get_running_loop()
+    async with _get_document_path(file) as path:
+        number_of_pages = await loop.run_in_executor(executor, _get_number_of_pages, path, poppler_path)
+        page_indices = _select_pages(pages, number_of_pages)
+        rendering: deque[asyncio.Future] = deque()
+        next_to_render = 0
+        try:
+            for page_index in page_indices:
+                while next_to_render < len(page_indices) and len(rendering) <= look_ahead:
+                    rendering.append(loop.run_in_executor(executor, _get_page_content, path,
+                                                          page_indices[next_to_render], poppler_path, render_profile,
+                                                          text_layer_policy))
+                    next_to_render += 1
+                yield page_index, await rendering.popleft()
+        finally:
+            # the temporary file must not be removed while pages are still rendered
+            await asyncio.gather(*rendering, return_exceptions=True)
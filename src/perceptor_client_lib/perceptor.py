@@ -12,21 +12,39 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import asyncio
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
 from io import BufferedReader
-from typing import Optional
+from typing import Optional, AsyncIterator, Union
 from os import environ
 
 import perceptor_client_lib.perceptor_repository
-from perceptor_client_lib.content_session import process_contents
-from perceptor_client_lib.external_models import PerceptorRequest, InstructionWithResult, DocumentImageResult
+from perceptor_client_lib.content_session import process_contents, stream_contents, process_content_stream, \
+    _SchedulingContext
+from perceptor_client_lib.external_models import PerceptorRequest, InstructionWithResult, DocumentImageResult, \
+    ConnectionPoolStatistics, ConcurrencyStatistics, RequestPriority, HedgingStatistics, CacheStatistics, \
+    CoalescingStatistics
 from perceptor_client_lib.image_parsing import convert_image_to_contextdata, parse_multiple_images
-from perceptor_client_lib.internal_models import *
-from perceptor_client_lib.pdf_parsing import get_images_from_document_pages
+from perceptor_client_lib.internal_models import InstructionMethod, TextContextData
+from perceptor_client_lib.pdf_parsing import iterate_images_from_document_pages, RenderProfile, PageSelection, \
+    TextLayerPolicy
 from perceptor_client_lib.perceptor_repository import _PerceptorRepositoryHttpClient, \
     PerceptorRepositoryHttpClientSettings
+from perceptor_client_lib.perceptor_repository_cachedecorator import _PerceptorRepositoryCacheDecorator, \
+    ResponseCacheSettings, _create_cache_storage
+from perceptor_client_lib.perceptor_repository_circuitbreakerdecorator import \
+    _PerceptorRepositoryCircuitBreakerDecorator, CircuitBreakerSettings, CircuitState
+from perceptor_client_lib.perceptor_repository_concurrencydecorator import \
+    _PerceptorRepositoryConcurrencyDecorator, _PerceptorRepositoryLoadFeedbackDecorator
+from perceptor_client_lib.perceptor_repository_coalescingdecorator import _PerceptorRepositoryCoalescingDecorator
+from perceptor_client_lib.perceptor_repository_hedgingdecorator import _PerceptorRepositoryHedgingDecorator, \
+    HedgingSettings
+from perceptor_client_lib.perceptor_repository_ratelimitdecorator import _PerceptorRepositoryRateLimitDecorator
 from perceptor_client_lib.perceptor_repository_retrydecorator import _PerceptorRepositoryRetryDecorator
-from perceptor_client_lib.task_limiter import TaskLimiter
+from perceptor_client_lib.rate_limiter import RateLimiter
+from perceptor_client_lib.retry_budget import RetryBudget
+from perceptor_client_lib.task_limiter import TaskLimiter, _DEFAULT_STARVATION_TIMEOUT
 
 _ENV_VAR_BASE_URL = "TAI_PERCEPTOR_BASE_URL"
 _ENV_VAR_API_KEY = "TAI_PERCEPTOR_API_KEY"
@@ -38,6 +56,12 @@ def _get_value_or_env_fallback(val: Optional[str], env_key: str):
     return val
 
 
+def _get_deadline(timeout: Optional[float]) -> Optional[float]:
+    if timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
 def _assert_required_parameters(api_key: str, api_url: str):
     def _get_error_message(val: str, name: str):
         if val is None or len(val.strip()) == 0:
@@ -62,42 +86,259 @@ class Client:
                  wait_timeout: int = 60,
                  max_level_of_parallelization: int = 3,
                  max_retries: int = 3,
-                 thread_delay_factor: float = 0.005):
+                 thread_delay_factor: Optional[float] = None,
+                 connect_timeout: float = 10,
+                 read_timeout: Optional[float] = None,
+                 requests_per_second: Optional[float] = None,
+                 burst_size: int = 1,
+                 adaptive_concurrency: bool = False,
+                 min_level_of_parallelization: int = 1,
+                 starvation_timeout: float = _DEFAULT_STARVATION_TIMEOUT,
+                 tenant_weights: Optional[dict[str, int]] = None,
+                 method_parallelization: Optional[dict[InstructionMethod, int]] = None,
+                 method_requests_per_second: Optional[dict[InstructionMethod, float]] = None,
+                 retry_budget_ratio: Optional[float] = 0.1,
+                 circuit_breaker: Optional[CircuitBreakerSettings] = None,
+                 hedging: Optional[HedgingSettings] = None,
+                 response_cache: Optional[ResponseCacheSettings] = None,
+                 coalesce_requests: bool = False,
+                 render_look_ahead: int = 2,
+                 render_workers: int = 2,
+                 render_in_processes: bool = False,
+                 render_profiles: Optional[dict[InstructionMethod, RenderProfile]] = None):
         """
         Creates Client instance
         :param api_key: api key to use.
         :param request_url: request url.
         :param wait_timeout: timeout for request (in seconds), default is 60s
+        :param max_level_of_parallelization: max. number of instructions processed concurrently,
+            also the size of the (keep-alive) connection pool
         :param max_retries: number of retries for failed retryable requests
-        :param thread_delay_factor: delay (in seconds) between parallel request
+        :param thread_delay_factor: deprecated and ignored, use requests_per_second instead
+        :param connect_timeout: timeout (in seconds) for establishing a connection, default is 10s
+        :param read_timeout: max. time (in seconds) without receiving data from the server,
+            default is wait_timeout + 10s
+        :param requests_per_second: max. number of requests sent per second (shared by all calls, including retries
+            and hedged requests), default is no limit
+        :param burst_size: number of requests which may be sent at once before requests_per_second applies
+        :param adaptive_concurrency: adjusts the number of instructions processed concurrently between
+            min_level_of_parallelization and max_level_of_parallelization, based on latency and overload errors
+        :param min_level_of_parallelization: lower bound for adaptive_concurrency, also the initial limit
+        :param starvation_timeout: time (in seconds) after which waiting instructions are processed next
+            regardless of their priority, default is 10s
+        :param tenant_weights: number of instructions started per turn for the given tenants, default is 1
+        :param method_parallelization: separate limits of concurrently processed instructions for the given
+            methods (e.g. InstructionMethod.TABLE), other methods share max_level_of_parallelization
+        :param method_requests_per_second: rate limits for the given methods, applied in addition to
+            requests_per_second
+        :param retry_budget_ratio: max. ratio of retries to requests (over the last 10s, shared by all calls),
+            None allows every failed request to be retried max_retries times
+        :param circuit_breaker: fails instructions fast (with a retryable error) while most requests fail,
+            default is no circuit breaker
+        :param hedging: sends a duplicate of requests slower than most recent requests, the first response wins,
+            default is no hedging
+        :param response_cache: keeps responses in memory (or in a SQLite file) and returns them for the same
+            context, instruction and parameters without sending a request, default is no cache
+        :param coalesce_requests: identical instructions processed at the same time share one request
+        :param render_look_ahead: number of pdf pages rendered ahead of the pages being sent
+        :param render_workers: number of workers rendering pdf pages in parallel, at most render_look_ahead + 1
+            (the number of pages of a document rendered at the same time)
+        :param render_in_processes: renders pdf pages in worker processes instead of threads,
+            e.g. if image encoding keeps other threads of the application from running
+        :param render_profiles: resolution, color mode and image format pdf pages are rendered with per method,
+            e.g. RENDER_PROFILE_PRESETS, default is 200 dpi color PNG
         """
 
         api_key_val = _get_value_or_env_fallback(api_key, _ENV_VAR_API_KEY)
         request_url_val = _get_value_or_env_fallback(request_url, _ENV_VAR_BASE_URL)
         _assert_required_parameters(api_key_val, request_url_val)
+        # before any resources (e.g. the SQLite cache) are acquired
+        if render_look_ahead < 1:
+            raise ValueError("render_look_ahead must be > 0")
+        if not 1 <= render_workers <= render_look_ahead + 1:
+            raise ValueError("render_workers must be > 0 and <= render_look_ahead + 1")
+        method_parallelization = {} if method_parallelization is None else method_parallelization
+        method_requests_per_second = {} if method_requests_per_second is None else method_requests_per_second
+        # instructions of all pools may be processed at the same time
+        max_concurrent_requests = max_level_of_parallelization + sum(method_parallelization.values())
+
+        self._task_limiter = TaskLimiter(max_level_of_parallelization,
+                                         adaptive=adaptive_concurrency,
+                                         min_number_of_threads=min_level_of_parallelization,
+                                         starvation_timeout=starvation_timeout,
+                                         flow_weights=tenant_weights)
+        self._method_task_limiters: dict[InstructionMethod, TaskLimiter] = {
+            method: TaskLimiter(limit,
+                                adaptive=adaptive_concurrency,
+                                min_number_of_threads=min(min_level_of_parallelization, limit),
+                                starvation_timeout=starvation_timeout,
+                                flow_weights=tenant_weights)
+            for method, limit in method_parallelization.items()}
+        if thread_delay_factor is not None:
+            warnings.warn("thread_delay_factor is ignored, use requests_per_second instead", DeprecationWarning)
+        self._rate_limiter: Optional[RateLimiter] = None if requests_per_second is None \
+            else RateLimiter(requests_per_second, burst_size)
+        self._method_rate_limiters: dict[InstructionMethod, RateLimiter] = {
+            method: RateLimiter(rate, burst_size) for method, rate in method_requests_per_second.items()}
+        # runs repositories without native async support, see _PerceptorRepositoryConcurrencyDecorator
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_requests,
+                                            thread_name_prefix=self.__class__.__name__)
 
         http_client = _PerceptorRepositoryHttpClient(
             PerceptorRepositoryHttpClientSettings(
                 api_key=api_key_val,
                 request_url=request_url_val,
-                wait_timeout=wait_timeout
+                wait_timeout=wait_timeout,
+                max_connections=max_concurrent_requests,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout
             ))
-        decorated_client = _PerceptorRepositoryRetryDecorator(http_client, max_retries=max_retries)
+        self._http_client: _PerceptorRepositoryHttpClient = http_client
+        decorated_client: perceptor_client_lib.perceptor_repository._PerceptorRepository = http_client
+        decorated_client = _PerceptorRepositoryLoadFeedbackDecorator(decorated_client, self._task_limiter,
+                                                                     self._method_task_limiters)
+        # below retries and hedging, so every request sent takes a token
+        if self._rate_limiter is not None or len(self._method_rate_limiters) > 0:
+            decorated_client = _PerceptorRepositoryRateLimitDecorator(decorated_client, self._rate_limiter,
+                                                                      self._method_rate_limiters)
+        self._hedging: Optional[_PerceptorRepositoryHedgingDecorator] = None
+        if hedging is not None:
+            decorated_client = _PerceptorRepositoryHedgingDecorator(decorated_client, hedging)
+            self._hedging = decorated_client
+        retry_budget = None if retry_budget_ratio is None else RetryBudget(retry_budget_ratio)
+        decorated_client = _PerceptorRepositoryRetryDecorator(decorated_client, max_retries=max_retries,
+                                                              retry_budget=retry_budget)
+        # below cache and coalescing, so only instructions actually sent take a slot (held during retries)
+        decorated_client = _PerceptorRepositoryConcurrencyDecorator(decorated_client, self._task_limiter,
+                                                                    self._method_task_limiters, self._executor)
+        # outside of the retry decorator, so instructions fail without any attempt while the circuit is open
+        self._circuit_breaker: Optional[_PerceptorRepositoryCircuitBreakerDecorator] = None
+        if circuit_breaker is not None:
+            decorated_client = _PerceptorRepositoryCircuitBreakerDecorator(decorated_client, circuit_breaker)
+            self._circuit_breaker = decorated_client
+        self._coalescing: Optional[_PerceptorRepositoryCoalescingDecorator] = None
+        if coalesce_requests:
+            decorated_client = _PerceptorRepositoryCoalescingDecorator(decorated_client)
+            self._coalescing = decorated_client
+        # outermost, so cached responses are returned even while the circuit is open
+        self._response_cache: Optional[_PerceptorRepositoryCacheDecorator] = None
+        if response_cache is not None:
+            decorated_client = _PerceptorRepositoryCacheDecorator(decorated_client,
+                                                                  _create_cache_storage(response_cache),
+                                                                  response_cache.cache_only)
+            self._response_cache = decorated_client
         # noinspection PyProtectedMember
         self._repository: perceptor_client_lib.perceptor_repository._PerceptorRepository = decorated_client
-        self._max_level_of_parallelization = max_level_of_parallelization
-        self._thread_delay_factor: float = thread_delay_factor
+        self._render_look_ahead: int = render_look_ahead
+        # keeps all request slots busy while pdf pages are rendered, without rendering the whole document
+        # ahead of slow requests
+        self._scheduling = _SchedulingContext(executor=self._executor,
+                                              max_pending_contexts=max_level_of_parallelization + render_look_ahead)
+        self._render_profiles: dict[InstructionMethod, RenderProfile] = \
+            {} if render_profiles is None else render_profiles
+        # poppler runs in a subprocess and image encoding mostly releases the GIL, so threads are usually enough
+        self._render_executor: Executor = ProcessPoolExecutor(max_workers=render_workers) if render_in_processes \
+            else ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix=f"{self.__class__.__name__}Render")
 
-        self._task_limiter = TaskLimiter(max_level_of_parallelization)
+    def close(self) -> None:
+        """
+        Releases resources held by the client (pooled connections, worker threads),
+        the client must not be used afterwards.
+        """
+        self._repository.close()
+        self._executor.shutdown(wait=True)
+        self._render_executor.shutdown(wait=True)
+
+    async def aclose(self) -> None:
+        """
+        Same as close, but also gracefully closes connections opened on the running event loop.
+        """
+        await self._repository.aclose()
+        self._executor.shutdown(wait=True)
+        self._render_executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    def get_connection_pool_statistics(self) -> ConnectionPoolStatistics:
+        """
+        Returns the number of http requests sent and how many of them opened a new connection.
+        """
+        return self._http_client.get_connection_pool_statistics()
+
+    def get_cache_statistics(self) -> CacheStatistics:
+        """
+        Returns the number of cache hits/misses and the size of the response cache.
+        """
+        if self._response_cache is None:
+            return CacheStatistics()
+        return self._response_cache.get_statistics()
+
+    def get_coalescing_statistics(self) -> CoalescingStatistics:
+        """
+        Returns how many requests shared the response of an identical request in flight.
+        """
+        if self._coalescing is None:
+            return CoalescingStatistics()
+        return self._coalescing.get_statistics()
+
+    def get_hedging_statistics(self) -> HedgingStatistics:
+        """
+        Returns how many requests were hedged and how many of them were answered by the duplicate first.
+        """
+        if self._hedging is None:
+            return HedgingStatistics()
+        return self._hedging.get_statistics()
+
+    def get_circuit_state(self) -> Optional[CircuitState]:
+        """
+        Returns the state of the circuit breaker, None if the client has no circuit breaker.
+        """
+        if self._circuit_breaker is None:
+            return None
+        return self._circuit_breaker.get_state()
+
+    def get_concurrency_statistics(self, method: Optional[InstructionMethod] = None) -> ConcurrencyStatistics:
+        """
+        Returns the current concurrency limit, how many instructions are being processed or waiting
+        and the time spent waiting per priority.
+        :param method: returns the statistics of the pool used for the method, default is the shared pool
+        """
+        task_limiter = self._method_task_limiters.get(method, self._task_limiter)
+        return ConcurrencyStatistics(current_limit=task_limiter.get_current_limit(),
+                                     active_tasks=task_limiter.get_number_of_active_tasks(),
+                                     queue_depth=task_limiter.get_queue_depth(),
+                                     wait_statistics=task_limiter.get_wait_statistics())
+
+    def _get_scheduling(self, timeout: Optional[float], priority: RequestPriority,
+                        tenant: Optional[str]) -> _SchedulingContext:
+        return self._scheduling.for_call(_get_deadline(timeout), priority, tenant)
 
     async def ask_text(self, text_to_process: str,
-                       instructions: list[str], request_parameters: PerceptorRequest) \
+                       instructions: list[str], request_parameters: PerceptorRequest,
+                       timeout: Optional[float] = None,
+                       priority: RequestPriority = RequestPriority.NORMAL,
+                       tenant: Optional[str] = None) \
             -> list[InstructionWithResult]:
         """
         Sends instruction(s) for the specified text
         :param text_to_process: text to be processed.
         :param instructions: instruction(s) to perform on text.
         :param request_parameters: request parameters.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: list of tuples containing instruction and InstructionResult.
                 InstructionResult can be either text or instance of InstructionError.
         """
@@ -107,21 +348,57 @@ class Client:
                                       InstructionMethod.QUESTION,
                                       instructions,
                                       [],
-                                      self._task_limiter,
-                                      self._thread_delay_factor
+                                      self._get_scheduling(timeout, priority, tenant)
                                       )
 
+    async def stream_text(self, text_to_process: str,
+                          instruction: str,
+                          request_parameters: PerceptorRequest,
+                          timeout: Optional[float] = None,
+                          priority: RequestPriority = RequestPriority.NORMAL,
+                          tenant: Optional[str] = None) -> AsyncIterator[Union[str, InstructionWithResult]]:
+        """
+        Sends instruction for the specified text and yields the response while it is being generated.
+        :param text_to_process: text to be processed.
+        :param instruction: instruction to perform on text.
+        :param request_parameters: request parameters.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
+        :return: async iterator of partial response texts, the last item is the InstructionWithResult.
+                Stopping the iteration early cancels the request.
+        """
+        async for item in stream_contents(self._repository,
+                                          TextContextData(text_to_process),
+                                          request_parameters,
+                                          InstructionMethod.QUESTION,
+                                          instruction,
+                                          [],
+                                          self._get_scheduling(timeout, priority, tenant)
+                                          ):
+            yield item
+
     async def classify_text(self,
                             text_to_process: str,
                             instruction: str,
                             classes: list[str],
-                            request_parameters: PerceptorRequest) -> InstructionWithResult:
+                            request_parameters: PerceptorRequest,
+                            timeout: Optional[float] = None,
+                            priority: RequestPriority = RequestPriority.NORMAL,
+                            tenant: Optional[str] = None) -> InstructionWithResult:
         """
         Sends classify instruction for the specified text
         :param text_to_process: text to be processed.
         :param instruction: instruction to perform on text.
         :param classes: list of classes ("document", "invoice" etc.)
         :param request_parameters: request parameters.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: tuple containing original instruction and InstructionResult.
         """
         return await process_contents(self._repository,
@@ -130,20 +407,27 @@ class Client:
                                       InstructionMethod.CLASSIFY,
                                       instruction,
                                       classes,
-                                      self._task_limiter,
-                                      self._thread_delay_factor
+                                      self._get_scheduling(timeout, priority, tenant)
                                       )
 
     async def ask_image(self, image: Union[str, bytes, BufferedReader],
                         instructions: list[str],
                         request_parameters: PerceptorRequest,
-                        file_type: Optional[str] = None) -> list[InstructionWithResult]:
+                        file_type: Optional[str] = None,
+                        timeout: Optional[float] = None,
+                        priority: RequestPriority = RequestPriority.NORMAL,
+                        tenant: Optional[str] = None) -> list[InstructionWithResult]:
         """
         Sends instruction(s) for the specified image
         :param image: image to be processed. Either a path to file, opened file handle, or bytearray.
         :param instructions: instruction(s) to perform on the image.
         :param request_parameters: request parameters.
         :param file_type: mandatory if image specified as handle or bytearray, must be either 'png' or 'jpg'.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: list of tuples containing instruction and InstructionResult.
                 InstructionResult can be either text or instance of InstructionError.
         """
@@ -154,15 +438,48 @@ class Client:
                                       InstructionMethod.QUESTION,
                                       instructions,
                                       [],
-                                      self._task_limiter,
-                                      self._thread_delay_factor
+                                      self._get_scheduling(timeout, priority, tenant)
                                       )
 
+    async def stream_image(self, image: Union[str, bytes, BufferedReader],
+                           instruction: str,
+                           request_parameters: PerceptorRequest,
+                           file_type: Optional[str] = None,
+                           timeout: Optional[float] = None,
+                           priority: RequestPriority = RequestPriority.NORMAL,
+                           tenant: Optional[str] = None) -> AsyncIterator[Union[str, InstructionWithResult]]:
+        """
+        Sends instruction for the specified image and yields the response while it is being generated.
+        :param image: image to be processed. Either a path to file, opened file handle, or bytearray.
+        :param instruction: instruction to perform on the image.
+        :param request_parameters: request parameters.
+        :param file_type: mandatory if image specified as handle or bytearray, must be either 'png' or 'jpg'.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
+        :return: async iterator of partial response texts, the last item is the InstructionWithResult.
+                Stopping the iteration early cancels the request.
+        """
+        async for item in stream_contents(self._repository,
+                                          convert_image_to_contextdata(image, file_type=file_type),
+                                          request_parameters,
+                                          InstructionMethod.QUESTION,
+                                          instruction,
+                                          [],
+                                          self._get_scheduling(timeout, priority, tenant)
+                                          ):
+            yield item
+
     async def classify_image(self, image: Union[str, bytes, BufferedReader],
                              instruction: str,
                              classes: list[str],
                              request_parameters: PerceptorRequest,
-                             file_type: Optional[str] = None) -> InstructionWithResult:
+                             file_type: Optional[str] = None,
+                             timeout: Optional[float] = None,
+                             priority: RequestPriority = RequestPriority.NORMAL,
+                             tenant: Optional[str] = None) -> InstructionWithResult:
         """
         Sends classify instruction for the specified image
         :param image: image to be processed. Either a path to file, opened file handle, or bytearray.
@@ -170,6 +487,11 @@ class Client:
         :param classes: list of classes ("document", "invoice" etc.)
         :param request_parameters: request parameters.
         :param file_type: mandatory if image specified as handle or bytearray, must be either 'png' or 'jpg'.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: tuple containing original instruction and InstructionResult.
         """
         return await process_contents(self._repository,
@@ -178,14 +500,16 @@ class Client:
                                       InstructionMethod.CLASSIFY,
                                       instruction,
                                       classes,
-                                      self._task_limiter,
-                                      self._thread_delay_factor
+                                      self._get_scheduling(timeout, priority, tenant)
                                       )
 
     async def ask_table_from_image(self, image: Union[str, bytes, BufferedReader],
                                    instruction: str,
                                    request_parameters: PerceptorRequest,
-                                   file_type: Optional[str] = None
+                                   file_type: Optional[str] = None,
+                                   timeout: Optional[float] = None,
+                                   priority: RequestPriority = RequestPriority.NORMAL,
+                                   tenant: Optional[str] = None
                                    ) -> InstructionWithResult:
         """
         Sends a table instruction for the specified image.
@@ -193,6 +517,11 @@ class Client:
         :param instruction: instruction to perform, for example 'GENERATE TABLE Article, Amount, Value GUIDED BY Value'
         :param request_parameters: request parameters.
         :param file_type: mandatory if image specified as handle or bytearray, must be either 'png' or 'jpg'.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: tuple containing original instruction and InstructionResult.
         """
         image_content_data = convert_image_to_contextdata(image, file_type=file_type)
@@ -202,31 +531,58 @@ class Client:
                                       InstructionMethod.TABLE,
                                       instruction,
                                       [],
-                                      self._task_limiter,
-                                      self._thread_delay_factor
+                                      self._get_scheduling(timeout, priority, tenant)
                                       )
 
     async def ask_document(self, pdf_doc: Union[str, bytes, BufferedReader],
                            instructions: list[str],
-                           request_parameters: PerceptorRequest) \
+                           request_parameters: PerceptorRequest,
+                           timeout: Optional[float] = None,
+                           priority: RequestPriority = RequestPriority.NORMAL,
+                           tenant: Optional[str] = None,
+                           render_profile: Optional[RenderProfile] = None,
+                           pages: Optional[PageSelection] = None,
+                           text_layer_policy: Optional[TextLayerPolicy] = None) \
             -> list[DocumentImageResult]:
         """
         Sends instruction(s) for the specified pdf document.
         :param pdf_doc: document to be processed. Either a path to file, opened file handle, or bytearray
         :param instructions: instruction(s) to perform on the document.
         :param request_parameters: request parameters.
-        :return: list (corresponding to document pages), with list of tuples containing
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded",
+            pages not rendered in time are left out of the result.
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
+        :param render_profile: resolution, color mode and image format the pages are rendered with,
+            overrides the client's render_profiles
+        :param pages: pages to process: zero based indices (negative indices count from the last page),
+            ranges (clipped to the document) or a callable returning whether a page index is selected.
+            Default is all pages
+        :param text_layer_policy: if specified, pages with enough text in their text layer (digitally created
+            documents) are sent as text instead of being rendered, see DocumentImageResult.context_type
+        :return: list (corresponding to the selected document pages), with list of tuples containing
             instruction and InstructionResult.
         """
 
         return await self._extract_and_process_images_from_document(pdf_doc, instructions, [],
                                                                     InstructionMethod.QUESTION,
-                                                                    request_parameters)
+                                                                    request_parameters,
+                                                                    self._get_scheduling(timeout, priority, tenant),
+                                                                    render_profile,
+                                                                    pages,
+                                                                    text_layer_policy)
 
     async def classify_document(self, pdf_doc: Union[str, bytes, BufferedReader],
                                 instruction: str,
                                 classes: list[str],
-                                request_parameters: PerceptorRequest) \
+                                request_parameters: PerceptorRequest,
+                                timeout: Optional[float] = None,
+                                priority: RequestPriority = RequestPriority.NORMAL,
+                                tenant: Optional[str] = None,
+                                render_profile: Optional[RenderProfile] = None,
+                                pages: Optional[PageSelection] = None) \
             -> list[DocumentImageResult]:
         """
         Sends classify instruction for the specified pdf document.
@@ -234,16 +590,34 @@ class Client:
         :param instruction: instruction to perform on the image.
         :param classes: list of classes ("document", "invoice" etc.)
         :param request_parameters: request parameters.
-        :return: list (corresponding to document pages), with list of tuples containing
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded",
+            pages not rendered in time are left out of the result.
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
+        :param render_profile: resolution, color mode and image format the pages are rendered with,
+            overrides the client's render_profiles
+        :param pages: pages to process: zero based indices (negative indices count from the last page),
+            ranges (clipped to the document) or a callable returning whether a page index is selected.
+            Default is all pages
+        :return: list (corresponding to the selected document pages), with list of tuples containing
             instruction and InstructionResult.
         """
         return await self._extract_and_process_images_from_document(pdf_doc, instruction, classes,
                                                                     InstructionMethod.CLASSIFY,
-                                                                    request_parameters)
+                                                                    request_parameters,
+                                                                    self._get_scheduling(timeout, priority, tenant),
+                                                                    render_profile,
+                                                                    pages,
+                                                                    None)
 
     async def ask_document_images(self, image_list: Union[list[str], list[(bytes, str)], list[(BufferedReader, str)]],
                                   instructions: list[str],
-                                  request_parameters: PerceptorRequest
+                                  request_parameters: PerceptorRequest,
+                                  timeout: Optional[float] = None,
+                                  priority: RequestPriority = RequestPriority.NORMAL,
+                                  tenant: Optional[str] = None
                                   ) -> list[DocumentImageResult]:
         """
         Sends instruction(s) for the specified document's images.
@@ -251,6 +625,11 @@ class Client:
          or list of tuples (bytes, file extension) or list of tuples (BufferedReader, file extension).
         :param instructions: instruction(s) to perform on the document.
         :param request_parameters: request parameters.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: list (corresponding to document pages), with list of tuples containing
             instruction and InstructionResult.
         """
@@ -258,13 +637,17 @@ class Client:
                                                instructions,
                                                [],
                                                InstructionMethod.QUESTION,
-                                               request_parameters)
+                                               request_parameters,
+                                               self._get_scheduling(timeout, priority, tenant))
 
     async def classify_document_images(self,
                                        image_list: Union[list[str], list[(bytes, str)], list[(BufferedReader, str)]],
                                        instruction: str,
                                        classes: list[str],
-                                       request_parameters: PerceptorRequest
+                                       request_parameters: PerceptorRequest,
+                                       timeout: Optional[float] = None,
+                                       priority: RequestPriority = RequestPriority.NORMAL,
+                                       tenant: Optional[str] = None
                                        ) -> list[DocumentImageResult]:
         """
         Sends classify instruction for the specified images.
@@ -273,6 +656,11 @@ class Client:
         :param instruction: instruction to perform on the document.
         :param classes: list of classes ("document", "invoice" etc.)
         :param request_parameters: request parameters.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: list (corresponding to images), with list of tuples containing
             instruction and InstructionResult.
         """
@@ -280,27 +668,51 @@ class Client:
                                                instruction,
                                                classes,
                                                InstructionMethod.CLASSIFY,
-                                               request_parameters)
+                                               request_parameters,
+                                               self._get_scheduling(timeout, priority, tenant))
 
     async def ask_table_from_document(self, pdf_doc: Union[str, bytes, BufferedReader],
                                       instruction: str,
-                                      request_parameters: PerceptorRequest) -> list[DocumentImageResult]:
+                                      request_parameters: PerceptorRequest,
+                                      timeout: Optional[float] = None,
+                                      priority: RequestPriority = RequestPriority.NORMAL,
+                                      tenant: Optional[str] = None,
+                                      render_profile: Optional[RenderProfile] = None,
+                                      pages: Optional[PageSelection] = None) -> list[DocumentImageResult]:
         """
         Sends a table instruction for the specified document.
         :param pdf_doc: document to be processed. Either a path to file, opened file handle, or bytearr
         :param instruction: instruction to perform, for example 'GENERATE TABLE Article, Amount, Value GUIDED BY Value'
         :param request_parameters: request parameters.
-        :return: list (corresponding to document pages), wish tuples containing original
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded",
+            pages not rendered in time are left out of the result.
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
+        :param render_profile: resolution, color mode and image format the pages are rendered with,
+            overrides the client's render_profiles
+        :param pages: pages to process: zero based indices (negative indices count from the last page),
+            ranges (clipped to the document) or a callable returning whether a page index is selected.
+            Default is all pages
+        :return: list (corresponding to the selected document pages), wish tuples containing original
             instruction and InstructionResult. InstructionResult can be either text or instance of InstructionError.
         """
         return await self._extract_and_process_images_from_document(pdf_doc, instruction, [], InstructionMethod.TABLE,
-                                                                    request_parameters)
+                                                                    request_parameters,
+                                                                    self._get_scheduling(timeout, priority, tenant),
+                                                                    render_profile,
+                                                                    pages,
+                                                                    None)
 
     async def ask_table_from_document_images(self,
                                              image_list: Union[
                                                  list[str], list[(bytes, str)], list[(BufferedReader, str)]],
                                              instruction: str,
-                                             request_parameters: PerceptorRequest
+                                             request_parameters: PerceptorRequest,
+                                             timeout: Optional[float] = None,
+                                             priority: RequestPriority = RequestPriority.NORMAL,
+                                             tenant: Optional[str] = None
                                              ) -> list[DocumentImageResult]:
         """
         Sends a table instruction for the specified document's images.
@@ -308,6 +720,11 @@ class Client:
          or list of tuples (bytes, file extension) or list of tuples (BufferedReader, file extension).
         :param instruction: instruction to perform, for example 'GENERATE TABLE Article, Amount, Value GUIDED BY Value'
         :param request_parameters: refined request parameters.
+        :param timeout: overall deadline (in seconds) for the call, the server's wait timeout is limited
+            to the remaining time. Instructions not finished in time fail with "deadline exceeded".
+        :param priority: order in which queued instructions are processed, e.g. HIGH for interactive requests
+        :param tenant: instructions of different tenants (or of different calls, if not specified) are processed
+            in turns, weighted by tenant_weights
         :return: list (corresponding to document pages), wish tuples containing original
             instruction and InstructionResult. InstructionResult can be either text or instance of InstructionError.
         """
@@ -315,28 +732,39 @@ class Client:
                                                instruction,
                                                [],
                                                InstructionMethod.TABLE,
-                                               request_parameters)
+                                               request_parameters,
+                                               self._get_scheduling(timeout, priority, tenant))
 
     async def _extract_and_process_images_from_document(self, pdf_doc: Union[str, bytes, BufferedReader],
                                                         instruction: Union[str, list[str]],
                                                         classes: list[str],
                                                         method: InstructionMethod,
-                                                        request_parameters) \
+                                                        request_parameters,
+                                                        scheduling: _SchedulingContext,
+                                                        render_profile: Optional[RenderProfile],
+                                                        pages: Optional[PageSelection],
+                                                        text_layer_policy: Optional[TextLayerPolicy]) \
             -> Union[list[InstructionWithResult], list[DocumentImageResult]]:
-        images = await asyncio.create_task(get_images_from_document_pages(pdf_doc))
+        if render_profile is None:
+            render_profile = self._render_profiles.get(method, RenderProfile())
 
-        mapped_images = list(map(lambda i: (i, "png"), images))
-        return await self._ask_document_images(mapped_images,
-                                               instruction,
-                                               classes,
-                                               method,
-                                               request_parameters)
+        # pages are sent while the next pages are still rendered
+        rendered_pages = iterate_images_from_document_pages(pdf_doc, self._render_look_ahead, self._render_executor,
+                                                            render_profile, pages, text_layer_policy)
+        return await process_content_stream(self._repository,
+                                            rendered_pages,
+                                            request_parameters,
+                                            method,
+                                            instruction,
+                                            classes,
+                                            scheduling)
 
     async def _ask_document_images(self, image_list: Union[list[str], list[(bytes, str)], list[(BufferedReader, str)]],
                                    instructions: Union[str, list[str]],
                                    classes: list[str],
                                    method: InstructionMethod,
                                    request_parameters: PerceptorRequest,
+                                   scheduling: _SchedulingContext
                                    ) -> list[DocumentImageResult]:
         mapped_images = parse_multiple_images(image_list)
         return await process_contents(self._repository,
@@ -345,6 +773,5 @@ class Client:
                                       method,
                                       instructions,
                                       classes,
-                                      self._task_limiter,
-                                      self._thread_delay_factor
+                                      scheduling
                                       )
@@ -12,23 +12,92 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import json
+import asyncio
+import math
+import time
+from email.utils import parsedate_to_datetime
 from json import JSONDecodeError
-from typing import Union
+from typing import Union, AsyncIterator, Optional, Mapping
 
+import httpx
 import requests
 import sseclient
 from pydantic import BaseModel
 from requests import Response
+from requests.adapters import HTTPAdapter
 
+from perceptor_client_lib.external_models import ConnectionPoolStatistics
 from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionMethod, _InstructionResult, \
-    InstructionError, ClassifyEntry
+    InstructionError, ClassifyEntry, InstructionPartialResult, _InstructionStreamItem
+from perceptor_client_lib.json_codec import get_json_codec
+
+
+_RESPONSE_RELEASE_TIMEOUT: float = 1.0
+_READ_TIMEOUT_MARGIN: float = 10
+_MAX_RETRY_AFTER: float = 60
+# values above are unix timestamps instead of a number of seconds
+_MIN_RATE_LIMIT_RESET_TIMESTAMP: float = 1e9
+_BACKPRESSURE_STATUS_CODES = (429, 503)
+
+
+def _dump_json(to_dump: dict) -> bytes:
+    return get_json_codec().dumps(to_dump)
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    # either a number of seconds or a http date
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_rate_limit_reset(value: str) -> Optional[float]:
+    try:
+        reset = float(value)
+    except ValueError:
+        return None
+    if reset > _MIN_RATE_LIMIT_RESET_TIMESTAMP:
+        return reset - time.time()
+    return reset
+
+
+def _get_retry_after(status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Returns the time (in seconds) the server asked to wait, from Retry-After or (if the rate limit is used up)
+    RateLimit-Reset/X-RateLimit-Reset headers.
+    """
+    retry_after = None
+    if "Retry-After" in headers:
+        retry_after = _parse_retry_after(headers["Retry-After"])
+
+    remaining = headers.get("RateLimit-Remaining", headers.get("X-RateLimit-Remaining"))
+    reset = headers.get("RateLimit-Reset", headers.get("X-RateLimit-Reset"))
+    if retry_after is None and reset is not None and (status_code == 429 or remaining == "0"):
+        retry_after = _parse_rate_limit_reset(reset)
+
+    if retry_after is None:
+        return None
+    return min(max(retry_after, 0), _MAX_RETRY_AFTER)
 
 
 class PerceptorRepositoryHttpClientSettings(BaseModel):
     api_key: str
     request_url: str
     wait_timeout: int
+    max_connections: int = 3
+    connect_timeout: float = 10
+    read_timeout: Optional[float] = None
+
+    def get_read_timeout(self) -> float:
+        # the server may stay silent for up to wait_timeout seconds before answering
+        if self.read_timeout is None:
+            return self.wait_timeout + _READ_TIMEOUT_MARGIN
+        return self.read_timeout
 
 
 class _PerceptorRepository:
@@ -37,6 +106,53 @@ class _PerceptorRepository:
                          classify_entries: list[ClassifyEntry]) -> _InstructionResult:
         raise Exception("not implemented, must override")
 
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest,
+                                     instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        return self.send_instruction(request, instruction, classify_entries)
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest,
+                                 instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        """
+        Yields InstructionPartialResult for every intermediate event, the last item is the instruction result.
+        """
+        yield await self.send_instruction_async(request, instruction, classify_entries)
+
+    def supports_async(self) -> bool:
+        """
+        True if send_instruction_async does not block the event loop,
+        otherwise send_instruction should be called from a worker thread.
+        """
+        return type(self).send_instruction_async is not _PerceptorRepository.send_instruction_async
+
+    def close(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        self.close()
+
+
+async def _read_events_async(byte_stream: AsyncIterator[bytes]) -> AsyncIterator[sseclient.Event]:
+    """
+    Async counterpart of sseclient's chunk stitching, the parsing of single events is left to sseclient.
+    """
+
+    def parse_events(event_chunk: bytes):
+        return sseclient.SSEClient([event_chunk]).events()
+
+    data = b''
+    async for chunk in byte_stream:
+        for line in chunk.splitlines(True):
+            data += line
+            if data.endswith((b'\r\r', b'\n\n', b'\r\n\r\n')):
+                for event in parse_events(data):
+                    yield event
+                data = b''
+    if data:
+        for event in parse_events(data):
+            yield event
+
 
 class _PerceptorRepositoryHttpClient(_PerceptorRepository):
 
@@ -44,62 +160,163 @@ class _PerceptorRepositoryHttpClient(_PerceptorRepository):
         self._settings: PerceptorRepositoryHttpClientSettings = settings
         self._headers: dict[str, str] = {
             'Accept': 'text/event-stream',
+            'Content-Type': 'application/json',
             'Authorization': 'Bearer ' + self._settings.api_key
         }
+        self._session: requests.Session = self._create_session()
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._async_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_http_client_closer: Optional[asyncio.Task] = None
+        self._number_of_requests: int = 0
+        self._number_of_async_connections: int = 0
+        self._release_tasks: set[asyncio.Task] = set()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self._settings.max_connections)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _create_async_http_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(timeout=httpx.Timeout(connect=self._settings.connect_timeout,
+                                                       read=self._settings.get_read_timeout(),
+                                                       write=self._settings.get_read_timeout(),
+                                                       pool=None),
+                                 limits=httpx.Limits(max_connections=self._settings.max_connections,
+                                                     max_keepalive_connections=self._settings.max_connections))
+
+    def _get_async_http_client(self) -> httpx.AsyncClient:
+        # pooled connections are bound to the event loop they were opened on
+        loop = asyncio.get_running_loop()
+        if self._async_http_client is None or self._async_http_client_loop is not loop:
+            self._close_async_http_client()
+            self._async_http_client = self._create_async_http_client()
+            self._async_http_client_loop = loop
+            self._async_http_client_closer = loop.create_task(self._close_on_loop_shutdown(self._async_http_client))
+        return self._async_http_client
+
+    @staticmethod
+    async def _close_on_loop_shutdown(http_client: httpx.AsyncClient) -> None:
+        """
+        Closes the client once cancelled, which asyncio.run does with all remaining tasks
+        before it closes the loop, so the pooled connections do not outlive their loop.
+        """
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await http_client.aclose()
+
+    def _close_async_http_client(self) -> None:
+        closer, loop = self._async_http_client_closer, self._async_http_client_loop
+        self._async_http_client = None
+        self._async_http_client_loop = None
+        self._async_http_client_closer = None
+        if closer is None or closer.done() or loop.is_closed():
+            return
+
+        if loop.is_running():
+            loop.call_soon_threadsafe(closer.cancel)
+            return
+
+        closer.cancel()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            loop.run_until_complete(asyncio.gather(closer, return_exceptions=True))
+
+    async def _trace_async_connection(self, event_name: str, _info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self._number_of_async_connections += 1
+
+    def get_connection_pool_statistics(self) -> ConnectionPoolStatistics:
+        sync_connections = 0
+        for adapter in set(self._session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            sync_connections += sum(pools[key].num_connections for key in pools.keys())
+
+        new_connections = sync_connections + self._number_of_async_connections
+        return ConnectionPoolStatistics(requests=self._number_of_requests,
+                                        new_connections=new_connections,
+                                        reused_connections=max(self._number_of_requests - new_connections, 0))
+
+    def close(self) -> None:
+        self._session.close()
+        self._close_async_http_client()
+
+    async def aclose(self) -> None:
+        closer = self._async_http_client_closer
+        if closer is not None and self._async_http_client_loop is asyncio.get_running_loop():
+            await asyncio.gather(*self._release_tasks)
+            closer.cancel()
+            await asyncio.gather(closer, return_exceptions=True)
+        self.close()
 
     @staticmethod
     def _fiter_events(event: sseclient.Event) -> bool:
         return event.event == 'finished'
 
+    @staticmethod
+    def _get_body_template(request: PerceptorRepositoryRequest) -> bytes:
+        # the (possibly multi-megabyte) context is escaped once per request object,
+        # the closing brace is left out so the instruction dependent part can be appended
+        # noinspection PyProtectedMember
+        if request._body_template is None:
+            template = {
+                "flavor": request.flavor,
+                "contextType": request.context_data.context_type,
+                "context": request.context_data.content,
+                "params": request.params
+            }
+            request._body_template = _dump_json(template)[:-1]
+        # noinspection PyProtectedMember
+        return request._body_template
+
     def _create_body(self,
                      request: PerceptorRepositoryRequest,
                      instruction: str,
-                     classes: Union[list[ClassifyEntry], None]) -> dict:
+                     classes: Union[list[ClassifyEntry], None]) -> bytes:
         result = {
-            "flavor": request.flavor,
-            "contextType": request.context_data.context_type,
-            "context": request.context_data.content,
-            "params": request.params,
-            "waitTimeout": self._settings.wait_timeout,
+            "waitTimeout": self._get_wait_timeout(request),
             "instruction": instruction
         }
 
         if classes is not None:
             result["classes"] = list(map(lambda x: x.value, classes))
-        return result
+        return b",".join([self._get_body_template(request), _dump_json(result)[1:]])
+
+    def _get_wait_timeout(self, request: PerceptorRepositoryRequest) -> int:
+        if request.deadline is None:
+            return self._settings.wait_timeout
+        remaining_seconds = math.floor(request.deadline - time.monotonic())
+        return max(min(self._settings.wait_timeout, remaining_seconds), 1)
 
     def _map_successful_response(self, request_response: Response) -> str:
-        with request_response:
-            if len(request_response.content) == 0:
-                event_list = []
-            else:
-                client = sseclient.SSEClient(request_response)
-                client_events = client.events()
-                event_list = list(filter(self._fiter_events, client_events))
+        # stops reading the stream on the first "finished" event, the response is closed by the caller
+        client = sseclient.SSEClient(request_response.iter_content(chunk_size=None))
+        finished_event = next(filter(self._fiter_events, client.events()), None)
 
-        if len(event_list) > 0:
-            return event_list[0].data
+        if finished_event is not None:
+            return finished_event.data
 
         return ""
 
     @staticmethod
-    def _parse_bad_response_text(request_response: Response) -> InstructionError:
+    def _parse_bad_response_text(request_response: Union[Response, httpx.Response]) -> InstructionError:
         try:
-            parsed_json = json.loads(request_response.text)
+            parsed_json = get_json_codec().loads(request_response.content)
             return InstructionError(error_text=parsed_json['detail'], is_retryable=False)
         except JSONDecodeError:
             return InstructionError(error_text=request_response.text, is_retryable=False)
 
-    def send_instruction(self, request: PerceptorRepositoryRequest,
-                         instruction: str,
-                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
-        def get_body():
-            if request.method == InstructionMethod.CLASSIFY:
-                return self._create_body(request, instruction, classify_entries)
-            return self._create_body(request, instruction, classes=None)
-
-        body = get_body()
+    def _get_body(self, request: PerceptorRepositoryRequest,
+                  instruction: str,
+                  classify_entries: list[ClassifyEntry]) -> bytes:
+        if request.method == InstructionMethod.CLASSIFY:
+            return self._create_body(request, instruction, classify_entries)
+        return self._create_body(request, instruction, classes=None)
 
+    def _get_request_url(self, request: PerceptorRepositoryRequest) -> str:
         def resolve_method():
             if request.method == InstructionMethod.TABLE:
                 return 'generate_table'
@@ -107,27 +324,124 @@ class _PerceptorRepositoryHttpClient(_PerceptorRepository):
                 return 'classify'
             return 'generate'
 
-        request_url = f"{self._settings.request_url}{resolve_method()}"
+        return f"{self._settings.request_url}{resolve_method()}"
+
+    def _map_unsuccessful_response(self, request_response: Union[Response, httpx.Response]) -> InstructionError:
+        if request_response.status_code == 403:
+            return InstructionError(error_text="invalid api_key", is_retryable=False)
+
+        if request_response.status_code == 400:
+            return self._parse_bad_response_text(request_response)
 
+        if request_response.status_code == 404:
+            return InstructionError(error_text="not found", is_retryable=False)
+
+        retry_after = None
+        if request_response.status_code in _BACKPRESSURE_STATUS_CODES:
+            retry_after = _get_retry_after(request_response.status_code, request_response.headers)
+        return InstructionError(error_text=str(request_response.content), is_retryable=True, retry_after=retry_after)
+
+    def send_instruction(self, request: PerceptorRepositoryRequest,
+                         instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        body = self._get_body(request, instruction, classify_entries)
+        request_url = self._get_request_url(request)
+
+        self._number_of_requests += 1
         try:
-            request_response: Response = requests.post(request_url,
-                                                       stream=True,
-                                                       headers=self._headers,
-                                                       json=body)
+            request_response: Response = self._session.post(request_url,
+                                                            stream=True,
+                                                            headers=self._headers,
+                                                            data=body,
+                                                            timeout=(self._settings.connect_timeout,
+                                                                     self._settings.get_read_timeout()))
         except Exception as exc:
             return InstructionError(error_text=str(exc), is_retryable=True)
 
         with request_response:
-            if request_response.status_code == 200:
-                return self._map_successful_response(request_response)
+            try:
+                if request_response.status_code == 200:
+                    return self._map_successful_response(request_response)
+
+                return self._map_unsuccessful_response(request_response)
+            except requests.RequestException as exc:
+                return InstructionError(error_text=str(exc), is_retryable=True)
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest,
+                                     instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        result: _InstructionResult = ""
+        async for item in self.stream_instruction(request, instruction, classify_entries):
+            if not isinstance(item, InstructionPartialResult):
+                result = item
+        return result
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest,
+                                 instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        body = self._get_body(request, instruction, classify_entries)
+        request_url = self._get_request_url(request)
+
+        http_client = self._get_async_http_client()
+        self._number_of_requests += 1
+        try:
+            request_response: httpx.Response = await http_client.send(
+                http_client.build_request("POST", request_url,
+                                          headers=self._headers,
+                                          content=body,
+                                          extensions={"trace": self._trace_async_connection}),
+                stream=True)
+        except httpx.HTTPError as exc:
+            yield InstructionError(error_text=str(exc), is_retryable=True)
+            return
+
+        released = False
+        try:
+            if request_response.status_code != 200:
+                await request_response.aread()
+                yield self._map_unsuccessful_response(request_response)
+                return
+
+            # stops reading the stream on the first "finished" event, byte_stream itself is left open
+            byte_stream = request_response.aiter_bytes()
+            events = _read_events_async(byte_stream)
+            try:
+                async for event in events:
+                    if self._fiter_events(event):
+                        self._release_response_in_background(request_response, byte_stream)
+                        released = True
+                        yield event.data
+                        return
+                    yield InstructionPartialResult(text=event.data)
+            finally:
+                await events.aclose()
+
+            yield ""
+        except httpx.HTTPError as exc:
+            yield InstructionError(error_text=str(exc), is_retryable=True)
+        finally:
+            if not released:
+                await request_response.aclose()
 
-            if request_response.status_code == 403:
-                return InstructionError(error_text="invalid api_key", is_retryable=False)
+    def _release_response_in_background(self, request_response: httpx.Response,
+                                        byte_stream: AsyncIterator[bytes]) -> None:
+        """
+        Reads the rest of the stream (usually just its end) without delaying the result, so that
+        the connection goes back to the pool. Streams not ending in time are closed with their connection.
+        """
 
-            if request_response.status_code == 400:
-                return self._parse_bad_response_text(request_response)
+        async def drain():
+            async for _ in byte_stream:
+                pass
 
-            if request_response.status_code == 404:
-                return InstructionError(error_text="not found", is_retryable=False)
+        async def drain_and_close():
+            try:
+                await asyncio.wait_for(drain(), timeout=_RESPONSE_RELEASE_TIMEOUT)
+            except (asyncio.TimeoutError, httpx.HTTPError):
+                pass
+            finally:
+                await request_response.aclose()
 
-            return InstructionError(error_text=str(request_response.content), is_retryable=True)
+        task = asyncio.create_task(drain_and_close())
+        self._release_tasks.add(task)
+        task.add_done_callback(self._release_tasks.discard)
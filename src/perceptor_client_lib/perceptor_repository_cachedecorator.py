@@ -0,0 +1,332 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional, Union
+
+from pydantic import BaseModel
+
+from perceptor_client_lib.external_models import CacheStatistics
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, ClassifyEntry, \
+    _InstructionStreamItem, InstructionError
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+
+
+def _dump_key_part(to_dump: dict) -> bytes:
+    # independent of the configured json codec and of the order of params
+    return json.dumps(to_dump, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def _get_cache_key(request: PerceptorRepositoryRequest, instruction: str,
+                   classify_entries: list[ClassifyEntry]) -> str:
+    """
+    Returns a hash of everything the response depends on: context, flavor, params, method, instruction and classes.
+    """
+    if request._cache_key_prefix is None:
+        context_hash = hashlib.sha256()
+        context_hash.update(_dump_key_part(dict(contextType=request.context_data.context_type,
+                                                flavor=request.flavor,
+                                                params=request.params,
+                                                method=request.method.name)))
+        context_hash.update(request.context_data.content.encode("utf-8"))
+        request._cache_key_prefix = context_hash.hexdigest()
+
+    key = hashlib.sha256(request._cache_key_prefix.encode("ascii"))
+    key.update(_dump_key_part(dict(instruction=instruction, classes=[c.value for c in classify_entries])))
+    return key.hexdigest()
+
+
+class ResponseCacheSettings(BaseModel):
+    """
+    Max. number of cached responses
+    """
+    max_entries: int = 1000
+    """
+    Max. total size (in bytes) of the cached responses
+    """
+    max_bytes: int = 64 * 1024 * 1024
+    """
+    Time (in seconds) a response is cached, None for no expiry
+    """
+    ttl: Optional[float] = 3600
+    """
+    Path of a SQLite database file the responses are stored in, it can be shared by several processes.
+    None keeps the responses in memory
+    """
+    path: Optional[str] = None
+    """
+    Returns an error instead of sending a request if a response is not cached (for deterministic reprocessing)
+    """
+    cache_only: bool = False
+
+
+@dataclass
+class _CacheEntry:
+    value: str
+    size: int
+    expires_at: Optional[float]
+
+
+class _MemoryCacheStorage:
+    """
+    LRU cache with expiry, used from the event loop and from worker threads.
+    """
+    is_blocking = False
+
+    def __init__(self, settings: ResponseCacheSettings):
+        self._settings: ResponseCacheSettings = settings
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def set(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self._settings.max_bytes:
+            return
+        expires_at = None if self._settings.ttl is None else time.monotonic() + self._settings.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(value, size, expires_at)
+            self._size += size
+            while len(self._entries) > self._settings.max_entries or self._size > self._settings.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        self._size -= self._entries.pop(key).size
+
+    def get_number_of_entries(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get_size(self) -> int:
+        with self._lock:
+            return self._size
+
+    def close(self) -> None:
+        pass
+
+
+class _SqliteCacheStorage:
+    """
+    LRU cache with expiry in a SQLite database. Several processes may use the same file concurrently,
+    so expiry and access times are wall-clock times.
+    """
+    # file I/O and waiting for the locks of other processes, async callers run it in a worker thread
+    is_blocking = True
+
+    def __init__(self, path: str, settings: ResponseCacheSettings):
+        self._settings: ResponseCacheSettings = settings
+        # one connection, used from the event loop and from worker threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                     "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                                     "expires_at REAL, accessed_at REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT value, expires_at FROM responses WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._connection.execute("DELETE FROM responses WHERE key = ? AND expires_at <= ?", (key, now))
+                return None
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        size = len(key) + len(value.encode("utf-8"))
+        if size > self._settings.max_bytes:
+            return
+        now = time.time()
+        expires_at = None if self._settings.ttl is None else now + self._settings.ttl
+        with self._lock:
+            # the write lock is taken upfront, so concurrent processes do not evict based on stale totals
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                                         (key, value, size, expires_at, now))
+                self._connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+                self._evict()
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        number_of_entries, size = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if number_of_entries <= self._settings.max_entries and size <= self._settings.max_bytes:
+            return
+        to_remove = []
+        for key, entry_size in self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if number_of_entries <= self._settings.max_entries and size <= self._settings.max_bytes:
+                break
+            to_remove.append((key,))
+            number_of_entries -= 1
+            size -= entry_size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", to_remove)
+
+    def get_number_of_entries(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get_size(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_CacheStorage = Union[_MemoryCacheStorage, _SqliteCacheStorage]
+_NOT_CACHED_ERROR_TEXT = "response is not cached (cache-only mode)"
+
+
+def _create_cache_storage(settings: ResponseCacheSettings) -> _CacheStorage:
+    if settings.path is None:
+        return _MemoryCacheStorage(settings)
+    return _SqliteCacheStorage(settings.path, settings)
+
+
+class _PerceptorRepositoryCacheDecorator(_PerceptorRepository):
+    """
+    Returns cached responses of successful requests without sending them again.
+    In cache-only mode requests are never sent, a response which is not cached is returned as error.
+    """
+
+    def __init__(self, decoree: _PerceptorRepository, storage: _CacheStorage, cache_only: bool = False):
+        self._decoree: _PerceptorRepository = decoree
+        self._storage: _CacheStorage = storage
+        self._cache_only: bool = cache_only
+        self._lock = threading.Lock()
+        self._hits: int = 0
+        self._misses: int = 0
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._storage.close()
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._run_storage_call(self._storage.close)
+        await self._decoree.aclose()
+
+    def get_statistics(self) -> CacheStatistics:
+        return CacheStatistics(hits=self._hits, misses=self._misses,
+                               entries=self._storage.get_number_of_entries(),
+                               size_bytes=self._storage.get_size())
+
+    def _get_cached(self, key: str) -> Optional[str]:
+        cached = self._storage.get(key)
+        with self._lock:
+            if cached is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return cached
+
+    @staticmethod
+    def _create_not_cached_error() -> InstructionError:
+        return InstructionError(error_text=_NOT_CACHED_ERROR_TEXT, is_retryable=False)
+
+    @staticmethod
+    def _is_cacheable(result: _InstructionResult) -> bool:
+        # errors are not cached, neither is the empty result of a stream that ended without a "finished" event
+        return isinstance(result, str) and len(result) > 0
+
+    def _store(self, key: str, result: _InstructionResult) -> None:
+        if self._is_cacheable(result):
+            self._storage.set(key, result)
+
+    async def _run_storage_call(self, function, *args):
+        if self._storage.is_blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def _get_cached_async(self, key: str) -> Optional[str]:
+        return await self._run_storage_call(self._get_cached, key)
+
+    async def _store_async(self, key: str, result: _InstructionResult) -> None:
+        if self._is_cacheable(result):
+            await self._run_storage_call(self._store, key, result)
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        key = _get_cache_key(request, instruction, classify_entries)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+        if self._cache_only:
+            return self._create_not_cached_error()
+
+        result = self._decoree.send_instruction(request, instruction, classify_entries)
+        self._store(key, result)
+        return result
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        key = _get_cache_key(request, instruction, classify_entries)
+        cached = await self._get_cached_async(key)
+        if cached is not None:
+            return cached
+        if self._cache_only:
+            return self._create_not_cached_error()
+
+        result = await self._decoree.send_instruction_async(request, instruction, classify_entries)
+        await self._store_async(key, result)
+        return result
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        key = _get_cache_key(request, instruction, classify_entries)
+        cached = await self._get_cached_async(key)
+        if cached is not None:
+            yield cached
+            return
+        if self._cache_only:
+            yield self._create_not_cached_error()
+            return
+
+        async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+            await self._store_async(key, item)
+            yield item
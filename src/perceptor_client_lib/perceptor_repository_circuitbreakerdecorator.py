@@ -0,0 +1,193 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import AsyncIterator, Optional
+
+from pydantic import BaseModel
+
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, InstructionError, \
+    ClassifyEntry, InstructionPartialResult, _InstructionStreamItem
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+
+_CIRCUIT_OPEN_ERROR_TEXT = "circuit breaker is open"
+
+
+class CircuitState(Enum):
+    CLOSED = 1
+    OPEN = 2
+    HALF_OPEN = 3
+
+
+class CircuitBreakerSettings(BaseModel):
+    """
+    Ratio of failed requests (retryable errors) within the window which opens the circuit
+    """
+    failure_rate_threshold: float = 0.5
+    """
+    Number of most recent requests the failure rate is calculated for
+    """
+    window_size: int = 20
+    """
+    Min. number of requests in the window before the circuit may open
+    """
+    minimum_number_of_calls: int = 10
+    """
+    Time (in seconds) the circuit stays open before probe requests are let through
+    """
+    open_duration: float = 30
+    """
+    Number of probe requests in the half-open state, the circuit closes if all of them succeed
+    """
+    half_open_max_calls: int = 1
+
+
+class _PerceptorRepositoryCircuitBreakerDecorator(_PerceptorRepository):
+    def __init__(self, decoree: _PerceptorRepository, settings: Optional[CircuitBreakerSettings] = None):
+        self._decoree: _PerceptorRepository = decoree
+        self._settings: CircuitBreakerSettings = CircuitBreakerSettings() if settings is None else settings
+        self._logger = logging.getLogger(self.__class__.__name__)
+        # sync requests are sent from worker threads
+        self._lock = threading.Lock()
+        self._state: CircuitState = CircuitState.CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=self._settings.window_size)
+        self._opened_at: float = 0
+        self._half_open_calls: int = 0
+        self._half_open_successes: int = 0
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
+
+    def get_state(self) -> CircuitState:
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self) -> None:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self._settings.open_duration:
+            self._state = CircuitState.HALF_OPEN
+            self._half_open_calls = 0
+            self._half_open_successes = 0
+
+    def _open(self) -> None:
+        self._logger.warning("opening circuit")
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            self._update_state()
+            if self._state == CircuitState.OPEN:
+                return False
+            if self._state == CircuitState.HALF_OPEN:
+                if self._half_open_calls >= self._settings.half_open_max_calls:
+                    return False
+                self._half_open_calls += 1
+            return True
+
+    def _release_cancelled_call(self) -> None:
+        # a cancelled request tells nothing about the backend, but must not keep the probe slot
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._half_open_calls = max(0, self._half_open_calls - 1)
+
+    def _record_result(self, result: Optional[_InstructionResult]) -> None:
+        # non-retryable errors (bad request, invalid api key) are no sign of an unhealthy backend
+        is_failure = result is None or (isinstance(result, InstructionError) and result.is_retryable)
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                if is_failure:
+                    self._open()
+                    return
+                self._half_open_successes += 1
+                if self._half_open_successes >= self._settings.half_open_max_calls:
+                    self._logger.info("closing circuit")
+                    self._state = CircuitState.CLOSED
+                return
+
+            if self._state != CircuitState.CLOSED:
+                return
+            self._outcomes.append(is_failure)
+            number_of_calls = len(self._outcomes)
+            if number_of_calls >= self._settings.minimum_number_of_calls and \
+                    sum(self._outcomes) / number_of_calls >= self._settings.failure_rate_threshold:
+                self._open()
+
+    @staticmethod
+    def _create_circuit_open_error() -> InstructionError:
+        return InstructionError(error_text=_CIRCUIT_OPEN_ERROR_TEXT, is_retryable=True)
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        if not self._try_acquire():
+            return self._create_circuit_open_error()
+
+        try:
+            result = self._decoree.send_instruction(request, instruction, classify_entries)
+        except Exception:
+            self._record_result(None)
+            raise
+        self._record_result(result)
+        return result
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        if not self._try_acquire():
+            return self._create_circuit_open_error()
+
+        try:
+            result = await self._decoree.send_instruction_async(request, instruction, classify_entries)
+        except asyncio.CancelledError:
+            self._release_cancelled_call()
+            raise
+        except Exception:
+            self._record_result(None)
+            raise
+        self._record_result(result)
+        return result
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        if not self._try_acquire():
+            yield self._create_circuit_open_error()
+            return
+
+        result = None
+        try:
+            async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+                if not isinstance(item, InstructionPartialResult):
+                    result = item
+                yield item
+        except (asyncio.CancelledError, GeneratorExit):
+            if result is None:
+                self._release_cancelled_call()
+            else:
+                self._record_result(result)
+            raise
+        except Exception:
+            self._record_result(None)
+            raise
+        self._record_result(result)
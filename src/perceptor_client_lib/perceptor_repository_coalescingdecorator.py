@@ -0,0 +1,120 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from perceptor_client_lib.external_models import CoalescingStatistics
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, ClassifyEntry, \
+    _InstructionStreamItem
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+from perceptor_client_lib.perceptor_repository_cachedecorator import _get_cache_key
+
+
+@dataclass
+class _InFlightTask:
+    task: asyncio.Task
+    waiters: int = 1
+
+
+class _PerceptorRepositoryCoalescingDecorator(_PerceptorRepository):
+    """
+    Identical requests (same context, instruction and parameters) sent while one of them is in flight share
+    its response instead of being sent again. The deadline of the request sent first applies to all of them.
+    """
+
+    def __init__(self, decoree: _PerceptorRepository):
+        self._decoree: _PerceptorRepository = decoree
+        # sync requests are sent from worker threads
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+        self._in_flight_async: dict[str, _InFlightTask] = {}
+        self._statistics = CoalescingStatistics()
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
+
+    def get_statistics(self) -> CoalescingStatistics:
+        with self._lock:
+            return self._statistics.model_copy()
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        key = _get_cache_key(request, instruction, classify_entries)
+        with self._lock:
+            self._statistics.requests += 1
+            in_flight = self._in_flight.get(key)
+            is_coalesced = in_flight is not None
+            if is_coalesced:
+                self._statistics.coalesced_requests += 1
+            else:
+                in_flight = self._in_flight[key] = Future()
+        if is_coalesced:
+            return in_flight.result()
+
+        try:
+            result = self._decoree.send_instruction(request, instruction, classify_entries)
+        except BaseException as e:
+            in_flight.set_exception(e)
+            raise
+        else:
+            in_flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        key = _get_cache_key(request, instruction, classify_entries)
+        with self._lock:
+            self._statistics.requests += 1
+            in_flight = self._in_flight_async.get(key)
+            if in_flight is not None:
+                self._statistics.coalesced_requests += 1
+                in_flight.waiters += 1
+            else:
+                in_flight = self._in_flight_async[key] = _InFlightTask(asyncio.ensure_future(
+                    self._decoree.send_instruction_async(request, instruction, classify_entries)))
+                in_flight.task.add_done_callback(lambda _: self._remove_in_flight_async(key, in_flight))
+
+        try:
+            # a cancelled caller must not cancel the request for the others
+            return await asyncio.shield(in_flight.task)
+        except asyncio.CancelledError:
+            in_flight.waiters -= 1
+            if in_flight.waiters == 0:
+                self._remove_in_flight_async(key, in_flight)
+                in_flight.task.cancel()
+            raise
+
+    def _remove_in_flight_async(self, key: str, in_flight: _InFlightTask) -> None:
+        with self._lock:
+            if self._in_flight_async.get(key) is in_flight:
+                del self._in_flight_async[key]
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        # partial results are yielded to a single caller, streams are not coalesced
+        async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+            yield item
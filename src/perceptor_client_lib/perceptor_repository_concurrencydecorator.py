@@ -0,0 +1,130 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import asyncio
+import time
+from concurrent.futures import Executor
+from typing import AsyncIterator, Optional
+
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, InstructionError, \
+    ClassifyEntry, InstructionMethod, InstructionPartialResult, _InstructionStreamItem
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+from perceptor_client_lib.task_limiter import TaskLimiter
+
+
+class _PerceptorRepositoryConcurrencyDecorator(_PerceptorRepository):
+    """
+    Holds a slot of the task limiter (of the request's method, if it has its own) while a request is sent,
+    including its retries. Requests answered above this decorator (cache hits, coalesced requests)
+    do not take a slot. Only async requests are limited, blocking decorees are run in the executor.
+    The outcome of every request sent is fed into the limit by _PerceptorRepositoryLoadFeedbackDecorator.
+    """
+
+    def __init__(self, decoree: _PerceptorRepository, task_limiter: TaskLimiter,
+                 method_task_limiters: Optional[dict[InstructionMethod, TaskLimiter]] = None,
+                 executor: Optional[Executor] = None):
+        self._decoree: _PerceptorRepository = decoree
+        self._task_limiter: TaskLimiter = task_limiter
+        self._method_task_limiters: dict[InstructionMethod, TaskLimiter] = \
+            {} if method_task_limiters is None else method_task_limiters
+        self._executor: Optional[Executor] = executor
+
+    def supports_async(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
+
+    def _get_task_limiter(self, method: InstructionMethod) -> TaskLimiter:
+        return self._method_task_limiters.get(method, self._task_limiter)
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        # the task limiter is bound to the event loop, sync requests are limited by the caller's threads
+        return self._decoree.send_instruction(request, instruction, classify_entries)
+
+    async def _send(self, request: PerceptorRepositoryRequest, instruction: str,
+                    classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        if self._decoree.supports_async():
+            return await self._decoree.send_instruction_async(request, instruction, classify_entries)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._decoree.send_instruction,
+                                          request, instruction, classify_entries)
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        async with self._get_task_limiter(request.method).limit(request.priority, request.flow):
+            return await self._send(request, instruction, classify_entries)
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        async with self._get_task_limiter(request.method).limit(request.priority, request.flow):
+            if not self._decoree.supports_async():
+                yield await self._send(request, instruction, classify_entries)
+                return
+
+            async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+                yield item
+
+
+class _PerceptorRepositoryLoadFeedbackDecorator(_PerceptorRepository):
+    """
+    Feeds latency and overload errors of every request sent into the adaptive limit of the task limiter
+    (of the request's method, if it has its own). Placed directly above the http client, so every retry
+    and hedged request counts, but not the time spent waiting for a slot or a rate limiter token.
+    """
+
+    def __init__(self, decoree: _PerceptorRepository, task_limiter: TaskLimiter,
+                 method_task_limiters: Optional[dict[InstructionMethod, TaskLimiter]] = None):
+        self._decoree: _PerceptorRepository = decoree
+        self._task_limiter: TaskLimiter = task_limiter
+        self._method_task_limiters: dict[InstructionMethod, TaskLimiter] = \
+            {} if method_task_limiters is None else method_task_limiters
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
+
+    def _record_result(self, method: InstructionMethod, started: float, result: _InstructionResult) -> None:
+        # retryable errors are caused by rate limiting, server errors or timeouts
+        is_overloaded = isinstance(result, InstructionError) and result.is_retryable
+        self._method_task_limiters.get(method, self._task_limiter).record_result(started, is_overloaded)
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        # sync requests are sent from worker threads, the task limiter must only be used on the event loop
+        return self._decoree.send_instruction(request, instruction, classify_entries)
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        started = time.monotonic()
+        result = await self._decoree.send_instruction_async(request, instruction, classify_entries)
+        self._record_result(request.method, started, result)
+        return result
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        started = time.monotonic()
+        async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+            if not isinstance(item, InstructionPartialResult):
+                self._record_result(request.method, started, item)
+            yield item
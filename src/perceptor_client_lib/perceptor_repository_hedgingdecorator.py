@@ -0,0 +1,142 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from pydantic import BaseModel
+
+from perceptor_client_lib.external_models import HedgingStatistics
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, InstructionError, \
+    ClassifyEntry, _InstructionStreamItem
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+from perceptor_client_lib.retry_budget import RetryBudget
+
+
+class HedgingSettings(BaseModel):
+    """
+    Percentile of recent latencies after which a duplicate request is sent
+    """
+    percentile: float = 0.95
+    """
+    Number of most recent latencies the percentile is calculated for
+    """
+    window_size: int = 100
+    """
+    Min. number of latencies recorded before requests are hedged
+    """
+    min_samples: int = 20
+    """
+    Max. ratio of duplicate requests to requests (over the last budget_window seconds)
+    """
+    max_hedge_ratio: float = 0.1
+    """
+    Time window (in seconds) of the hedge budget
+    """
+    budget_window: float = 10
+
+
+class _PerceptorRepositoryHedgingDecorator(_PerceptorRepository):
+    """
+    Sends a duplicate request if a request takes longer than most recent requests, the first successful
+    response wins and the other request is cancelled. Only async requests are hedged.
+    """
+
+    def __init__(self, decoree: _PerceptorRepository, settings: Optional[HedgingSettings] = None):
+        self._decoree: _PerceptorRepository = decoree
+        self._settings: HedgingSettings = HedgingSettings() if settings is None else settings
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._latencies: deque[float] = deque(maxlen=self._settings.window_size)
+        # same sliding window ratio as for retries, without a min. number of hedges
+        self._budget = RetryBudget(self._settings.max_hedge_ratio, self._settings.budget_window, min_retries=0)
+        self._statistics = HedgingStatistics()
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
+
+    def get_statistics(self) -> HedgingStatistics:
+        return self._statistics.model_copy()
+
+    def _get_hedge_delay(self) -> Optional[float]:
+        if len(self._latencies) < self._settings.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(self._settings.percentile * (len(latencies) - 1))]
+
+    @staticmethod
+    def _is_success(result: _InstructionResult) -> bool:
+        return not isinstance(result, InstructionError)
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        return self._decoree.send_instruction(request, instruction, classify_entries)
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        # partial results of two requests cannot be merged, streams are not hedged
+        async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+            yield item
+
+    async def _send_timed(self, request: PerceptorRepositoryRequest, instruction: str,
+                          classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        started = time.monotonic()
+        result = await self._decoree.send_instruction_async(request, instruction, classify_entries)
+        if self._is_success(result):
+            self._latencies.append(time.monotonic() - started)
+        return result
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self._budget.record_request()
+        self._statistics.requests += 1
+        hedge_delay = self._get_hedge_delay()
+        primary = asyncio.ensure_future(self._send_timed(request, instruction, classify_entries))
+        pending = {primary}
+        try:
+            if hedge_delay is None:
+                return await primary
+
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if len(done) > 0:
+                return primary.result()
+            if not self._budget.try_acquire_retry():
+                return await primary
+
+            self._logger.debug("hedging request after %.3fs", hedge_delay)
+            self._statistics.hedged_requests += 1
+            hedge = asyncio.ensure_future(self._send_timed(request, instruction, classify_entries))
+            pending.add(hedge)
+            result: _InstructionResult = ""
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # prefers a success, an error is only returned once both requests failed
+                for finished in done:
+                    result = finished.result()
+                    if self._is_success(result):
+                        if finished is hedge:
+                            self._statistics.hedges_won += 1
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
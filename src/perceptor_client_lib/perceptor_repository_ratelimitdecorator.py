@@ -0,0 +1,77 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import asyncio
+from typing import AsyncIterator, Optional
+
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, ClassifyEntry, \
+    InstructionMethod, _InstructionStreamItem
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+from perceptor_client_lib.rate_limiter import RateLimiter
+
+
+class _PerceptorRepositoryRateLimitDecorator(_PerceptorRepository):
+    """
+    Takes a token of the client-wide rate limiter and of the request's method (if it has its own) for every
+    request sent. Placed below the retry and hedging decorators, so retries and hedged duplicates are paced as well.
+    """
+
+    def __init__(self, decoree: _PerceptorRepository, rate_limiter: Optional[RateLimiter] = None,
+                 method_rate_limiters: Optional[dict[InstructionMethod, RateLimiter]] = None):
+        self._decoree: _PerceptorRepository = decoree
+        self._rate_limiter: Optional[RateLimiter] = rate_limiter
+        self._method_rate_limiters: dict[InstructionMethod, RateLimiter] = \
+            {} if method_rate_limiters is None else method_rate_limiters
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
+
+    def _get_rate_limiters(self, method: InstructionMethod) -> list[RateLimiter]:
+        # the client-wide limit applies in addition to the limit of the method
+        return [rate_limiter for rate_limiter in (self._rate_limiter, self._method_rate_limiters.get(method))
+                if rate_limiter is not None]
+
+    async def _wait_for_rate_limit(self, method: InstructionMethod) -> None:
+        acquired: list[RateLimiter] = []
+        try:
+            for rate_limiter in self._get_rate_limiters(method):
+                await rate_limiter.acquire()
+                acquired.append(rate_limiter)
+        except asyncio.CancelledError:
+            # the request is not sent, so the tokens already taken are not used either
+            for rate_limiter in acquired:
+                rate_limiter.release()
+            raise
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        for rate_limiter in self._get_rate_limiters(request.method):
+            rate_limiter.acquire_sync()
+        return self._decoree.send_instruction(request, instruction, classify_entries)
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        await self._wait_for_rate_limit(request.method)
+        return await self._decoree.send_instruction_async(request, instruction, classify_entries)
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        await self._wait_for_rate_limit(request.method)
+        async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+            yield item
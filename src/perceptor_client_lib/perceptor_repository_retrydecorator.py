@@ -12,45 +12,145 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Optional
+
 from tenacity import *
 import logging
 import tenacity
 
 from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, InstructionError, \
-    ClassifyEntry
+    ClassifyEntry, InstructionPartialResult, _InstructionStreamItem
 from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+from perceptor_client_lib.rate_limiter import Backoff
+from perceptor_client_lib.retry_budget import RetryBudget
+
+_WAIT_MULTIPLIER: float = 0.02
+_WAIT_MAX: float = 1
+
+
+def _get_retry_after(result: _InstructionResult) -> float:
+    if isinstance(result, InstructionError) and result.retry_after is not None:
+        return result.retry_after
+    return 0
+
+
+def _get_wait_time(attempt_number: int, result: _InstructionResult) -> float:
+    # exponential backoff with full jitter (same as tenacity.wait_random_exponential),
+    # but at least as long as requested by the server
+    jitter = random.uniform(0, min(_WAIT_MULTIPLIER * 2 ** (attempt_number - 1), _WAIT_MAX))
+    return max(jitter, _get_retry_after(result))
 
 
 class _PerceptorRepositoryRetryDecorator(_PerceptorRepository):
-    def __init__(self, decoree: _PerceptorRepository, max_retries: int = 3):
+    def __init__(self, decoree: _PerceptorRepository, max_retries: int = 3,
+                 retry_budget: Optional[RetryBudget] = None,
+                 backoff: Optional[Backoff] = None):
         self._decoree: _PerceptorRepository = decoree
         self._number_of_retries: int = max_retries
+        self._retry_budget: Optional[RetryBudget] = retry_budget
+        # shared by all instructions, so a Retry-After received by one of them holds back the others as well
+        self._backoff: Backoff = Backoff() if backoff is None else backoff
+
+    def supports_async(self) -> bool:
+        return self._decoree.supports_async()
+
+    def close(self) -> None:
+        self._decoree.close()
+
+    async def aclose(self) -> None:
+        await self._decoree.aclose()
 
     def log_attempt_number(self, retry_state: RetryCallState):
         logger = logging.getLogger(self.__class__.__name__)
         logger.warning("retrying (%s) request...", retry_state.attempt_number)
 
-    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
-                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
-        def to_call():
-            return self._decoree.send_instruction(request, instruction, classify_entries)
+    @staticmethod
+    def _should_retry(r):
+        if isinstance(r, InstructionError):
+            err: InstructionError = r
+            return err.is_retryable
+        return False
 
-        def should_retry(r):
-            if isinstance(r, InstructionError):
-                err: InstructionError = r
-                return err.is_retryable
+    def _may_retry(self, request: PerceptorRepositoryRequest, result, attempt_number: int) -> bool:
+        if not self._should_retry(result) or attempt_number >= self._number_of_retries:
+            return False
+        if request.deadline is not None and time.monotonic() + _get_retry_after(result) >= request.deadline:
             return False
+        if self._retry_budget is not None and not self._retry_budget.try_acquire_retry():
+            logging.getLogger(self.__class__.__name__).warning("retry budget exhausted, not retrying request")
+            return False
+        return True
+
+    def _register_backpressure(self, result: _InstructionResult) -> None:
+        retry_after = _get_retry_after(result)
+        if retry_after > 0:
+            self._backoff.pause(retry_after)
+
+    def _record_request(self) -> None:
+        if self._retry_budget is not None:
+            self._retry_budget.record_request()
 
-        def return_last_value(retry_state):
-            return retry_state.outcome.result()
+    @staticmethod
+    def _return_last_value(retry_state):
+        return retry_state.outcome.result()
 
-        retry_wrap_fn = tenacity.retry(
+    def _wrap_with_retry(self, to_call, request: PerceptorRepositoryRequest):
+        return tenacity.retry(
             stop=stop_after_attempt(self._number_of_retries),
             reraise=True,
-            retry=tenacity.retry_if_result(should_retry),
-            retry_error_callback=return_last_value,
-            wait=tenacity.wait_exponential(multiplier=0.02, max=1),
+            retry=lambda retry_state: self._may_retry(request, retry_state.outcome.result(),
+                                                      retry_state.attempt_number),
+            retry_error_callback=self._return_last_value,
+            wait=lambda retry_state: _get_wait_time(retry_state.attempt_number, retry_state.outcome.result()),
             before_sleep=self.log_attempt_number
         )(to_call)
 
-        return retry_wrap_fn()
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        def to_call():
+            # runs on a worker thread, see _ContentSession
+            self._backoff.wait_sync()
+            result = self._decoree.send_instruction(request, instruction, classify_entries)
+            self._register_backpressure(result)
+            return result
+
+        self._record_request()
+        return self._wrap_with_retry(to_call, request)()
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        # tenacity detects the coroutine function and waits with asyncio.sleep
+        async def to_call():
+            await self._backoff.wait()
+            result = await self._decoree.send_instruction_async(request, instruction, classify_entries)
+            self._register_backpressure(result)
+            return result
+
+        self._record_request()
+        return await self._wrap_with_retry(to_call, request)()
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        # once partial results have been passed on, the instruction cannot be retried transparently
+        self._record_request()
+        for attempt_number in range(1, self._number_of_retries + 1):
+            partial_result_passed = False
+            result: _InstructionResult = ""
+            await self._backoff.wait()
+            async for item in self._decoree.stream_instruction(request, instruction, classify_entries):
+                if isinstance(item, InstructionPartialResult):
+                    partial_result_passed = True
+                    yield item
+                else:
+                    result = item
+
+            self._register_backpressure(result)
+            if partial_result_passed or not self._may_retry(request, result, attempt_number):
+                yield result
+                return
+
+            logging.getLogger(self.__class__.__name__).warning("retrying (%s) request...", attempt_number)
+            await asyncio.sleep(_get_wait_time(attempt_number, result))
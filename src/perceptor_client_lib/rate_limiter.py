@@ -0,0 +1,112 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of requests per second, waiting callers are served in order.
+    Not bound to an event loop, it can be used from several event loops and from worker threads.
+    """
+
+    def __init__(self, requests_per_second: float, burst_size: int = 1):
+        if requests_per_second <= 0:
+            raise ValueError("requests_per_second must be > 0")
+        if burst_size < 1:
+            raise ValueError("burst_size must be > 0")
+        self._requests_per_second: float = requests_per_second
+        self._burst_size: int = burst_size
+        self._tokens: float = burst_size
+        self._last_refill: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._burst_size, self._tokens + (now - self._last_refill) * self._requests_per_second)
+        self._last_refill = now
+
+    def _reserve(self) -> float:
+        """
+        Takes a token and returns the time (in seconds) until it is available. Tokens of waiting callers
+        are taken in advance (the bucket goes negative), so later callers wait longer.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self._requests_per_second)
+
+    def release(self) -> None:
+        """
+        Returns a token taken by acquire, if the request is not sent after all.
+        """
+        with self._lock:
+            self._tokens += 1
+
+    async def acquire(self) -> None:
+        """
+        Waits (without blocking the event loop) until the request may be sent.
+        """
+        wait_time = self._reserve()
+        if wait_time <= 0:
+            return
+        try:
+            await asyncio.sleep(wait_time)
+        except asyncio.CancelledError:
+            self.release()
+            raise
+
+    def acquire_sync(self) -> None:
+        """
+        Blocks the calling thread until the request may be sent.
+        """
+        wait_time = self._reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def get_requests_per_second(self) -> float:
+        return self._requests_per_second
+
+    def get_burst_size(self) -> int:
+        return self._burst_size
+
+
+class Backoff:
+    """
+    Holds back all requests of a client while the server asked to back off (Retry-After, rate limit headers).
+    Used from the event loop and from worker threads.
+    """
+
+    def __init__(self):
+        self._resume_at: float = 0
+
+    def pause(self, seconds: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def get_remaining_time(self) -> float:
+        return max(0.0, self._resume_at - time.monotonic())
+
+    async def wait(self) -> None:
+        # the pause may be extended while waiting
+        remaining_time = self.get_remaining_time()
+        while remaining_time > 0:
+            await asyncio.sleep(remaining_time)
+            remaining_time = self.get_remaining_time()
+
+    def wait_sync(self) -> None:
+        remaining_time = self.get_remaining_time()
+        while remaining_time > 0:
+            time.sleep(remaining_time)
+            remaining_time = self.get_remaining_time()
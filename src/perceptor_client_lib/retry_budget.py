@@ -0,0 +1,63 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import threading
+import time
+from collections import deque
+
+
+class RetryBudget:
+    """
+    Limits retries to a ratio of the requests sent within a sliding time window,
+    so a degraded backend is not flooded with retries. min_retries are always allowed per window.
+    Used from the event loop and from worker threads.
+    """
+
+    def __init__(self, ratio: float = 0.1, window: float = 10, min_retries: int = 10):
+        if ratio < 0:
+            raise ValueError("ratio must be >= 0")
+        if window <= 0:
+            raise ValueError("window must be > 0")
+        self._ratio: float = ratio
+        self._window: float = window
+        self._min_retries: int = min_retries
+        self._requests: deque[float] = deque()
+        self._retries: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _remove_expired(self, now: float) -> None:
+        expired = now - self._window
+        for timestamps in (self._requests, self._retries):
+            while len(timestamps) > 0 and timestamps[0] <= expired:
+                timestamps.popleft()
+
+    def record_request(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._remove_expired(now)
+            self._requests.append(now)
+
+    def try_acquire_retry(self) -> bool:
+        """
+        Returns True and counts the retry if the budget allows it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._remove_expired(now)
+            if len(self._retries) >= max(self._min_retries, self._ratio * len(self._requests)):
+                return False
+            self._retries.append(now)
+            return True
+
+    def get_ratio(self) -> float:
+        return self._ratio
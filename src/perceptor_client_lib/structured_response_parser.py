@@ -12,9 +12,10 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import json
 from json import JSONDecodeError
 
+from perceptor_client_lib.json_codec import get_json_codec
+
 _KEY_NAME_TEXT: str = "text"
 
 
@@ -26,7 +27,7 @@ def _parse_structured_text(to_parse: str) -> dict:
         return create_dictionary_with_text()
 
     try:
-        result: dict = json.loads(to_parse)
+        result: dict = get_json_codec().loads(to_parse)
         if isinstance(result, dict):
             if result.get(_KEY_NAME_TEXT) is None:
                 result[_KEY_NAME_TEXT] = ""
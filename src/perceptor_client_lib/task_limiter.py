@@ -12,17 +12,260 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 import asyncio
-from typing import Coroutine
+import time
+from collections import deque, OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Coroutine, Optional, Hashable
+
+from perceptor_client_lib.external_models import RequestPriority, QueueWaitStatistics
+
+# multiplicative decrease of the adaptive limit on overload
+_DECREASE_FACTOR: float = 0.5
+# the limit is only increased while recent latencies stay below this multiple of the long-term average
+_LATENCY_TOLERANCE: float = 1.5
+_SHORT_LATENCY_SMOOTHING: float = 0.3
+_LONG_LATENCY_SMOOTHING: float = 0.05
+_DEFAULT_STARVATION_TIMEOUT: float = 10
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    priority: RequestPriority
+    flow: Hashable
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class _FairQueue:
+    """
+    Waiters of one priority, queued per flow (call or tenant). Flows take turns (deficit round-robin),
+    each turn starts up to weight waiters of the flow.
+    """
+
+    def __init__(self, flow_weights: dict[Hashable, int]):
+        self._flow_weights: dict[Hashable, int] = flow_weights
+        self._flows: OrderedDict[Hashable, deque[_Waiter]] = OrderedDict()
+        self._started_in_turn: int = 0
+        self._length: int = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(self, waiter: _Waiter) -> None:
+        self._flows.setdefault(waiter.flow, deque()).append(waiter)
+        self._length += 1
+
+    def discard(self, waiter: _Waiter) -> None:
+        """
+        Removes the waiter if it is still queued, it may have been popped in the tick it was cancelled in.
+        """
+        flow_waiters = self._flows.get(waiter.flow)
+        if flow_waiters is not None and waiter in flow_waiters:
+            self.remove(waiter)
+
+    def remove(self, waiter: _Waiter) -> None:
+        flow_waiters = self._flows[waiter.flow]
+        flow_waiters.remove(waiter)
+        self._length -= 1
+        if len(flow_waiters) == 0:
+            self._remove_flow(waiter.flow)
+
+    def _remove_flow(self, flow: Hashable) -> None:
+        if flow == next(iter(self._flows)):
+            self._started_in_turn = 0
+        del self._flows[flow]
+
+    def first_waiters(self) -> list[_Waiter]:
+        return [q[0] for q in self._flows.values()]
+
+    def peek(self) -> Optional[_Waiter]:
+        if len(self._flows) == 0:
+            return None
+        return next(iter(self._flows.values()))[0]
+
+    def pop(self, waiter: _Waiter) -> None:
+        """
+        Removes the first waiter of a flow and passes the turn to the next flow once the flow's weight is used up.
+        """
+        flow = waiter.flow
+        is_current_turn = flow == next(iter(self._flows))
+        self.remove(waiter)
+        if not is_current_turn or flow not in self._flows:
+            return
+        self._started_in_turn += 1
+        if self._started_in_turn >= self._flow_weights.get(flow, 1):
+            self._started_in_turn = 0
+            self._flows.move_to_end(flow)
+
+
+@dataclass
+class _WaitTimes:
+    started_tasks: int = 0
+    total_wait_time: float = 0
+    max_wait_time: float = 0
+
+    def add(self, wait_time: float) -> None:
+        self.started_tasks += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
 
 
 class TaskLimiter:
-    def __init__(self, max_number_of_threads: int):
-        self._sem = asyncio.Semaphore(max_number_of_threads)
+    """
+    Limits the number of tasks executed concurrently. Waiting tasks are started by priority; tasks of the same
+    priority are started in turns per flow (e.g. call or tenant, weighted by flow_weights) and in order within a flow.
+    Tasks waiting longer than starvation_timeout are started first regardless of their priority.
+    In adaptive mode the limit is adjusted between min_number_of_threads and max_number_of_threads (AIMD):
+    it is increased by one per window of successful tasks while latency stays flat and halved on overload.
+    """
+
+    def __init__(self, max_number_of_threads: int,
+                 adaptive: bool = False,
+                 min_number_of_threads: int = 1,
+                 starvation_timeout: float = _DEFAULT_STARVATION_TIMEOUT,
+                 flow_weights: Optional[dict[Hashable, int]] = None):
+        if max_number_of_threads < 1:
+            raise ValueError("max_number_of_threads must be > 0")
+        if adaptive and not 1 <= min_number_of_threads <= max_number_of_threads:
+            raise ValueError("min_number_of_threads must be > 0 and <= max_number_of_threads")
         self._max_number_of_threads: int = max_number_of_threads
+        self._min_number_of_threads: int = min_number_of_threads if adaptive else max_number_of_threads
+        self._adaptive: bool = adaptive
+        self._current_limit: int = self._min_number_of_threads
+        self._active_tasks: int = 0
+        self._starvation_timeout: float = starvation_timeout
+        flow_weights = {} if flow_weights is None else flow_weights
+        if any(w < 1 for w in flow_weights.values()):
+            raise ValueError("flow weights must be > 0")
+        self._waiters: dict[RequestPriority, _FairQueue] = {p: _FairQueue(flow_weights) for p in RequestPriority}
+        self._wait_times: dict[RequestPriority, _WaitTimes] = {p: _WaitTimes() for p in RequestPriority}
 
-    async def exec_task(self, to_exec: Coroutine):
-        async with self._sem:
+        self._increase_credit: float = 0
+        self._last_decrease: float = float("-inf")
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+
+    async def _acquire(self, priority: RequestPriority, flow: Hashable) -> None:
+        if self._active_tasks < self._current_limit and self.get_queue_depth() == 0:
+            self._active_tasks += 1
+            self._wait_times[priority].add(0)
+            return
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), priority, flow)
+        self._waiters[priority].append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the slot was already handed over
+                self._release()
+            else:
+                self._waiters[priority].discard(waiter)
+            raise
+
+    def _release(self) -> None:
+        self._active_tasks -= 1
+        self._wake_waiters()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        starved_after = time.monotonic() - self._starvation_timeout
+        starved = [w for q in self._waiters.values() for w in q.first_waiters() if w.enqueued <= starved_after]
+        if len(starved) > 0:
+            return min(starved, key=lambda w: w.enqueued)
+        for priority in sorted(RequestPriority, key=lambda p: p.value):
+            waiter = self._waiters[priority].peek()
+            if waiter is not None:
+                return waiter
+        return None
+
+    def _wake_waiters(self) -> None:
+        while self._active_tasks < self._current_limit:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._waiters[waiter.priority].pop(waiter)
+            if not waiter.future.done():
+                self._active_tasks += 1
+                self._wait_times[waiter.priority].add(time.monotonic() - waiter.enqueued)
+                waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def limit(self, priority: RequestPriority = RequestPriority.NORMAL, flow: Hashable = None):
+        await self._acquire(priority, flow)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def exec_task(self, to_exec: Coroutine, priority: RequestPriority = RequestPriority.NORMAL,
+                        flow: Hashable = None):
+        async with self.limit(priority, flow):
             return await to_exec
 
+    def record_result(self, started: float, is_overloaded: bool) -> None:
+        """
+        Feeds the outcome of a task into the adaptive limit, has no effect if the limiter is not adaptive.
+        :param started: time.monotonic() at the start of the task
+        :param is_overloaded: whether the task failed because of overload (429/5xx, timeouts)
+        """
+        if not self._adaptive:
+            return
+
+        now = time.monotonic()
+        if is_overloaded:
+            # tasks started before the last decrease were sent with the old limit
+            if started >= self._last_decrease:
+                self._current_limit = max(self._min_number_of_threads,
+                                          int(self._current_limit * _DECREASE_FACTOR))
+                self._last_decrease = now
+                self._increase_credit = 0
+            return
+
+        latency = now - started
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+        else:
+            self._short_latency += _SHORT_LATENCY_SMOOTHING * (latency - self._short_latency)
+            self._long_latency += _LONG_LATENCY_SMOOTHING * (latency - self._long_latency)
+
+        limit_reached = self._active_tasks >= self._current_limit or self.get_queue_depth() > 0
+        latency_is_flat = self._short_latency <= self._long_latency * _LATENCY_TOLERANCE
+        if not limit_reached or not latency_is_flat or self._current_limit >= self._max_number_of_threads:
+            return
+
+        self._increase_credit += 1 / self._current_limit
+        if self._increase_credit >= 1:
+            self._increase_credit = 0
+            self._current_limit += 1
+            self._wake_waiters()
+
     def get_max_number_of_threads(self) -> int:
         return self._max_number_of_threads
+
+    def get_min_number_of_threads(self) -> int:
+        return self._min_number_of_threads
+
+    def is_adaptive(self) -> bool:
+        return self._adaptive
+
+    def get_current_limit(self) -> int:
+        return self._current_limit
+
+    def get_number_of_active_tasks(self) -> int:
+        return self._active_tasks
+
+    def get_queue_depth(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    def get_wait_statistics(self) -> dict[RequestPriority, QueueWaitStatistics]:
+        def to_statistics(priority: RequestPriority) -> QueueWaitStatistics:
+            wait_times = self._wait_times[priority]
+            average_wait_time = wait_times.total_wait_time / wait_times.started_tasks \
+                if wait_times.started_tasks > 0 else 0
+            return QueueWaitStatistics(started_tasks=wait_times.started_tasks,
+                                       queue_depth=len(self._waiters[priority]),
+                                       average_wait_time=average_wait_time,
+                                       max_wait_time=wait_times.max_wait_time)
+
+        return {p: to_statistics(p) for p in RequestPriority}
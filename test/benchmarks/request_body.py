@@ -0,0 +1,77 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+# Compares serializing the whole request body per instruction with appending the instruction
+# to the body template serialized once per content session.
+# Run from the repository root (the test package puts src on the path): python -m test.benchmarks.request_body
+
+import base64
+import json
+import os
+import time
+import tracemalloc
+
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, ImageContextData
+from perceptor_client_lib.perceptor_repository import _PerceptorRepositoryHttpClient, \
+    PerceptorRepositoryHttpClientSettings
+
+NUMBER_OF_INSTRUCTIONS = 20
+CONTEXT_SIZE = 5 * 1024 * 1024
+
+repository = _PerceptorRepositoryHttpClient(PerceptorRepositoryHttpClientSettings(
+    api_key="api_key", request_url="http://api_url/", wait_timeout=60))
+
+
+def create_request() -> PerceptorRepositoryRequest:
+    image_data = base64.b64encode(os.urandom(CONTEXT_SIZE * 3 // 4)).decode('utf-8')
+    return PerceptorRepositoryRequest(flavor="original",
+                                      params={"temperature": 0.01, "topK": 10},
+                                      context_data=ImageContextData(f"data:image/png;base64,{image_data}"))
+
+
+def serialize_per_instruction(request: PerceptorRepositoryRequest, i: int):
+    # what requests/httpx did with the json= argument before
+    json.dumps({
+        "flavor": request.flavor,
+        "contextType": request.context_data.context_type,
+        "context": request.context_data.content,
+        "params": request.params,
+        "waitTimeout": 60,
+        "instruction": f"instruction {i}"
+    }).encode("utf-8")
+
+
+def serialize_with_template(request: PerceptorRepositoryRequest, i: int):
+    repository._get_body(request, f"instruction {i}", [])
+
+
+def measure(name: str, to_call):
+    request = create_request()
+    tracemalloc.start()
+    allocated_bytes = 0
+    start = time.process_time()
+    for i in range(NUMBER_OF_INSTRUCTIONS):
+        tracemalloc.reset_peak()
+        current_before, _ = tracemalloc.get_traced_memory()
+        to_call(request, i)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated_bytes += peak - current_before
+    cpu_time = time.process_time() - start
+    tracemalloc.stop()
+    print(f"{name}: cpu {cpu_time * 1000:.1f} ms, allocated {allocated_bytes / 1024 / 1024:.1f} MB "
+          f"({NUMBER_OF_INSTRUCTIONS} instructions, {CONTEXT_SIZE // 1024 // 1024} MB context)")
+
+
+measure("serialized per instruction", serialize_per_instruction)
+measure("body template", serialize_with_template)
@@ -11,15 +11,24 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import asyncio
 import os
+import tempfile
 import unittest
+from typing import AsyncIterator
 
-from perceptor_client_lib.external_models import PerceptorRequest
+from perceptor_client_lib.external_models import PerceptorRequest, InstructionWithResult, RequestPriority
 # noinspection PyProtectedMember
-from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, ClassifyEntry
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, _InstructionResult, ClassifyEntry, \
+    InstructionPartialResult, _InstructionStreamItem, InstructionMethod
 from perceptor_client_lib.perceptor import Client
+from perceptor_client_lib.perceptor_repository_cachedecorator import ResponseCacheSettings
 # noinspection PyProtectedMember
 from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_concurrencydecorator import _PerceptorRepositoryConcurrencyDecorator
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_ratelimitdecorator import _PerceptorRepositoryRateLimitDecorator
 
 _image_path = os.path.join(os.path.dirname(__file__), "test_files", "binary_file.png")
 _invoice_path = os.path.join(os.path.dirname(__file__), "test_files", "image_with_invoice_table.png")
@@ -34,12 +43,31 @@ class RepositoryMock(_PerceptorRepository):
         return f"{instruction}  :: ok"
 
 
-def _create_client_with_mock_repository():
-    client = Client("api_key", "api_url", max_level_of_parallelization=2)
-    client._repository = RepositoryMock()
+class StreamingRepositoryMock(_PerceptorRepository):
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        return f"{instruction}  :: ok"
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        yield InstructionPartialResult(text=instruction)
+        yield InstructionPartialResult(text="  :: ")
+        yield f"{instruction}  :: ok"
+
+
+def _use_mock_repository(client: Client) -> Client:
+    # keeps the task and rate limiters of the client, requests are answered by the mock instead of the http client
+    rate_limited_repository = _PerceptorRepositoryRateLimitDecorator(RepositoryMock(), client._rate_limiter,
+                                                                     client._method_rate_limiters)
+    client._repository = _PerceptorRepositoryConcurrencyDecorator(rate_limited_repository, client._task_limiter,
+                                                                  client._method_task_limiters, client._executor)
     return client
 
 
+def _create_client_with_mock_repository():
+    return _use_mock_repository(Client("api_key", "api_url", max_level_of_parallelization=2))
+
+
 _client_with_mock_repository = _create_client_with_mock_repository()
 
 
@@ -75,12 +103,92 @@ class ClientMethodsTest(unittest.IsolatedAsyncioTestCase):
         self.assertTrue("request_url" in str(ctx.exception))
         pass
 
+    def test_WHEN_more_render_workers_than_pages_rendered_ahead_THEN_exception_is_thrown(self):
+        with self.assertRaises(ValueError) as ctx:
+            Client("some_key", "some_url", render_look_ahead=1, render_workers=3)
+        self.assertTrue("render_workers" in str(ctx.exception))
+
+    def test_WHEN_render_configuration_invalid_THEN_cache_file_is_not_created(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.sqlite")
+            with self.assertRaises(ValueError):
+                Client("some_key", "some_url", render_look_ahead=0,
+                       response_cache=ResponseCacheSettings(path=path))
+            self.assertFalse(os.path.exists(path))
+
+    async def test_WHEN_client_used_as_context_manager_THEN_it_is_closed(self):
+        async with Client("api_key", "api_url") as client:
+            client._repository = RepositoryMock()
+            result = await client.ask_text("text_to_ask", instructions=["1"],
+                                           request_parameters=self.create_default_request())
+        self.assertEqual(len(result), 1)
+        self.assertEqual(client.get_connection_pool_statistics().requests, 0)
+
     async def test_ask_text(self):
         instructions = ["1", "2"]
         result = await _client_with_mock_repository.ask_text("text_to_ask", instructions=instructions,
                                                              request_parameters=self.create_default_request())
         self.assertEqual(len(result), len(instructions))
 
+    async def test_WHEN_priority_specified_THEN_it_is_reported_in_statistics(self):
+        client = _create_client_with_mock_repository()
+        await client.ask_text("text_to_ask", instructions=["1", "2"],
+                              request_parameters=self.create_default_request(), priority=RequestPriority.HIGH)
+
+        statistics = client.get_concurrency_statistics()
+        self.assertEqual(statistics.wait_statistics[RequestPriority.HIGH].started_tasks, 2)
+        self.assertEqual(statistics.wait_statistics[RequestPriority.NORMAL].started_tasks, 0)
+        self.assertEqual(statistics.active_tasks, 0)
+
+    def test_WHEN_starvation_timeout_specified_THEN_it_is_used_by_all_pools(self):
+        client = Client("api_key", "api_url", starvation_timeout=30,
+                        method_parallelization={InstructionMethod.TABLE: 1})
+
+        # noinspection PyProtectedMember
+        self.assertEqual(client._task_limiter._starvation_timeout, 30)
+        # noinspection PyProtectedMember
+        self.assertEqual(client._method_task_limiters[InstructionMethod.TABLE]._starvation_timeout, 30)
+        client.close()
+
+    async def test_WHEN_method_has_own_pool_THEN_it_is_used_for_the_method(self):
+        client = _use_mock_repository(Client("api_key", "api_url", method_parallelization={InstructionMethod.TABLE: 1}))
+        await client.ask_table_from_image(_invoice_path, instruction="GENERATE TABLE x",
+                                          request_parameters=self.create_default_request())
+        await client.ask_text("text_to_ask", instructions=["1", "2"],
+                              request_parameters=self.create_default_request())
+
+        table_statistics = client.get_concurrency_statistics(InstructionMethod.TABLE)
+        self.assertEqual(table_statistics.current_limit, 1)
+        self.assertEqual(table_statistics.wait_statistics[RequestPriority.NORMAL].started_tasks, 1)
+        self.assertEqual(client.get_concurrency_statistics().current_limit, 3)
+        self.assertEqual(client.get_concurrency_statistics().wait_statistics[RequestPriority.NORMAL].started_tasks, 2)
+
+    def test_WHEN_rate_limited_client_used_from_several_event_loops_THEN_all_instructions_succeed(self):
+        client = _use_mock_repository(Client("api_key", "api_url", requests_per_second=50))
+        results = []
+        for _ in range(2):
+            results += asyncio.run(client.ask_text("text_to_ask", instructions=["1", "2", "3", "4", "5"],
+                                                   request_parameters=self.create_default_request()))
+        client.close()
+
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(r.is_success for r in results))
+
+    async def test_stream_text(self):
+        client = Client("api_key", "api_url")
+        client._repository = StreamingRepositoryMock()
+        items = [item async for item in client.stream_text("text_to_ask", instruction="1",
+                                                           request_parameters=self.create_default_request())]
+        self.assertListEqual(items[:-1], ["1", "  :: "])
+        self.assertIsInstance(items[-1], InstructionWithResult)
+        self.assert_response_text_equals("1  :: ok", items[-1].response)
+
+    async def test_WHEN_repository_does_not_stream_THEN_only_result_is_yielded(self):
+        items = [item async for item in _client_with_mock_repository.stream_image(
+            _image_path, instruction="1", request_parameters=self.create_default_request())]
+        self.assertEqual(len(items), 1)
+        self.assert_response_text_equals("1  :: ok", items[0].response)
+
     async def test_ask_image_from_file(self):
         instructions = ["1", "2"]
         result = await _client_with_mock_repository.ask_image(_image_path, instructions=instructions,
@@ -13,18 +13,26 @@
 #  limitations under the License.
 
 import asyncio
+import gc
+import threading
+import time
 import unittest
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union
 
 # noinspection PyProtectedMember
-from perceptor_client_lib.content_session import _ContentSession, process_contents
+from perceptor_client_lib.content_session import _ContentSession, process_contents, process_content_stream, \
+    _SchedulingContext
 from perceptor_client_lib.external_models import PerceptorRequest, \
-    DocumentImageResult, InstructionWithResult
+    DocumentImageResult, InstructionWithResult, RequestPriority
 # noinspection PyProtectedMember
 from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, TextContextData, InstructionContextData, \
     ImageContextData, InstructionMethod, _InstructionResult, InstructionError, ClassifyEntry
 # noinspection PyProtectedMember
 from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_concurrencydecorator import _PerceptorRepositoryConcurrencyDecorator
 from perceptor_client_lib.task_limiter import TaskLimiter
 
 
@@ -39,24 +47,65 @@ class RepositoryMock(_PerceptorRepository):
         return InstructionError(error_text=self._error_response)
 
 
+class AsyncRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.processed_instructions: list[str] = []
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        self.processed_instructions.append(instruction)
+        return f"{instruction}  :: ok"
+
+
+class BlockingRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+        return f"{instruction}  :: ok"
+
+
+class HangingRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.cancelled = False
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return f"{instruction}  :: ok"
+
+
 _mock_repository = RepositoryMock()
 
 
 class ContentSessionTests(unittest.IsolatedAsyncioTestCase):
 
-    @staticmethod
-    def _create_task_limiter() -> TaskLimiter:
-        return TaskLimiter(max_number_of_threads=4)
-
     @staticmethod
     def _create_default_request() -> PerceptorRequest:
         return PerceptorRequest(flavor="flavour", params={})
 
     async def test_all_instructions_are_processed(self):
         content_session = _ContentSession(_mock_repository,
-                                          TextContextData("some_text"),
-                                          self._create_task_limiter(),
-                                          thread_delay_factor=0)
+                                          TextContextData("some_text"))
 
         instructions = [
             "1",
@@ -94,9 +143,7 @@ class ContentSessionTests(unittest.IsolatedAsyncioTestCase):
                                         self._create_default_request(),
                                         InstructionMethod.QUESTION,
                                         instructions,
-                                        classify_entries=[],
-                                        task_limiter=self._create_task_limiter(),
-                                        thread_delay_factor=0
+                                        classify_entries=[]
                                         )
 
         self.assertEqual(len(result), len(data_contexts))
@@ -107,9 +154,7 @@ class ContentSessionTests(unittest.IsolatedAsyncioTestCase):
     async def test_WHEN_repository_returns_error_THEN_error_in_response(self):
         repository = RepositoryMock(error_response='some error')
         content_session = _ContentSession(repository,
-                                          TextContextData("some_text"),
-                                          self._create_task_limiter(),
-                                          thread_delay_factor=0)
+                                          TextContextData("some_text"))
         instructions = [
             "1",
             "2",
@@ -124,6 +169,162 @@ class ContentSessionTests(unittest.IsolatedAsyncioTestCase):
         for item in result:
             self.assertFalse(item.is_success)
 
+    async def test_WHEN_repository_is_blocking_THEN_instructions_run_concurrently_in_executor(self):
+        repository = BlockingRepositoryMock()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            content_session = _ContentSession(repository,
+                                              TextContextData("some_text"),
+                                              _SchedulingContext(executor=executor))
+            instructions = [str(i) for i in range(10)]
+            result = await content_session.process_instructions_request(request=self._create_default_request(),
+                                                                        method=InstructionMethod.QUESTION,
+                                                                        instructions=instructions,
+                                                                        classify_entries=[])
+
+        self.assertEqual(len(result), len(instructions))
+        self.assertGreater(repository.max_in_flight, 1)
+
+    async def test_WHEN_calls_share_task_limiter_THEN_they_take_turns(self):
+        repository = AsyncRepositoryMock()
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        limited_repository = _PerceptorRepositoryConcurrencyDecorator(repository, task_limiter)
+        large_call = asyncio.create_task(process_contents(limited_repository,
+                                                          [ImageContextData(data_uri=f"uri_{i}") for i in range(10)],
+                                                          self._create_default_request(),
+                                                          InstructionMethod.QUESTION,
+                                                          ["large_1", "large_2"],
+                                                          classify_entries=[]))
+        while task_limiter.get_queue_depth() < 19:
+            await asyncio.sleep(0)
+        await process_contents(limited_repository,
+                               TextContextData("some_text"),
+                               self._create_default_request(),
+                               InstructionMethod.QUESTION,
+                               ["small"],
+                               classify_entries=[])
+        await large_call
+
+        self.assertLess(repository.processed_instructions.index("small"), 3)
+
+    async def test_WHEN_deadline_exceeded_THEN_request_is_cancelled_and_error_returned(self):
+        repository = HangingRepositoryMock()
+        content_session = _ContentSession(repository,
+                                          TextContextData("some_text"),
+                                          _SchedulingContext(deadline=time.monotonic() + 0.05))
+        result = await content_session.process_instructions_request(request=self._create_default_request(),
+                                                                    method=InstructionMethod.QUESTION,
+                                                                    instructions=["1", "2"],
+                                                                    classify_entries=[])
+
+        for item in result:
+            self.assertFalse(item.is_success)
+            self.assertEqual(item.error_text, "deadline exceeded")
+        self.assertTrue(repository.cancelled)
+
+    async def test_WHEN_contexts_are_produced_THEN_they_are_processed_before_all_are_produced(self):
+        repository = AsyncRepositoryMock()
+        processed_before_last_page: list[int] = []
+
+        async def produce_contexts():
+            for i in range(3):
+                # e.g. rendering a page
+                await asyncio.sleep(0.03)
+                processed_before_last_page.append(len(repository.processed_instructions))
+                yield i, ImageContextData(data_uri=f"some_uri_{i}")
+
+        result = await process_content_stream(repository,
+                                              produce_contexts(),
+                                              self._create_default_request(),
+                                              InstructionMethod.QUESTION,
+                                              ["1"],
+                                              classify_entries=[])
+
+        self.assertListEqual([r.page_number for r in result], [0, 1, 2])
+        self.assertGreater(processed_before_last_page[-1], 0)
+
+    async def test_WHEN_page_sent_as_text_THEN_context_type_is_reported(self):
+        async def produce_contexts():
+            yield 0, ImageContextData(data_uri="some_uri_0")
+            yield 1, TextContextData("text layer of page 1")
+
+        result = await process_content_stream(_mock_repository,
+                                              produce_contexts(),
+                                              self._create_default_request(),
+                                              InstructionMethod.QUESTION,
+                                              ["1"],
+                                              classify_entries=[])
+
+        self.assertListEqual([r.context_type for r in result], ["image", "text"])
+
+    async def test_WHEN_max_pending_contexts_reached_THEN_no_more_contexts_are_taken(self):
+        repository = AsyncRepositoryMock()
+        max_pending = 0
+
+        async def produce_contexts():
+            nonlocal max_pending
+            for i in range(6):
+                max_pending = max(max_pending, i - len(repository.processed_instructions))
+                yield i, ImageContextData(data_uri=f"some_uri_{i}")
+
+        result = await process_content_stream(repository,
+                                              produce_contexts(),
+                                              self._create_default_request(),
+                                              InstructionMethod.QUESTION,
+                                              ["1"],
+                                              classify_entries=[],
+                                              scheduling=_SchedulingContext(max_pending_contexts=2))
+
+        self.assertEqual(len(result), 6)
+        self.assertLessEqual(max_pending, 2)
+
+    async def test_WHEN_deadline_exceeded_while_queued_THEN_no_coroutine_is_left_unawaited(self):
+        content_session = _ContentSession(_PerceptorRepositoryConcurrencyDecorator(HangingRepositoryMock(),
+                                                                                   TaskLimiter(max_number_of_threads=1)),
+                                          TextContextData("some_text"),
+                                          _SchedulingContext(deadline=time.monotonic() + 0.05))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            result = await content_session.process_instructions_request(request=self._create_default_request(),
+                                                                        method=InstructionMethod.QUESTION,
+                                                                        instructions=["1", "2"],
+                                                                        classify_entries=[])
+            gc.collect()
+
+        self.assertTrue(all(not item.is_success for item in result))
+        self.assertListEqual([w for w in caught if issubclass(w.category, RuntimeWarning)], [])
+
+    async def test_WHEN_deadline_exceeded_THEN_no_more_contexts_are_taken(self):
+        produced: list[int] = []
+
+        async def produce_contexts():
+            for i in range(10):
+                # e.g. rendering a page
+                await asyncio.sleep(0.02)
+                produced.append(i)
+                yield i, ImageContextData(data_uri=f"some_uri_{i}")
+
+        result = await process_content_stream(_mock_repository,
+                                              produce_contexts(),
+                                              self._create_default_request(),
+                                              InstructionMethod.QUESTION,
+                                              ["1"],
+                                              classify_entries=[],
+                                              scheduling=_SchedulingContext(deadline=time.monotonic() + 0.05))
+
+        self.assertLess(len(produced), 10)
+        self.assertEqual(len(result), len(produced))
+
+    def test_WHEN_scheduling_context_derived_for_call_THEN_other_values_are_kept(self):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            client_scheduling = _SchedulingContext(executor=executor, max_pending_contexts=5)
+            call_scheduling = client_scheduling.for_call(123.0, RequestPriority.HIGH, "tenant")
+
+        self.assertIs(call_scheduling.executor, executor)
+        self.assertEqual(call_scheduling.max_pending_contexts, 5)
+        self.assertEqual((call_scheduling.deadline, call_scheduling.priority, call_scheduling.tenant),
+                         (123.0, RequestPriority.HIGH, "tenant"))
+        self.assertIsNone(client_scheduling.deadline)
+
     def test_WHEN_method_classify_and_number_classes_less_than_2_THEN_exception_is_raised(self):
         data_contexts = [ImageContextData(data_uri="some_uri_1")]
         instructions = ["1"]
@@ -134,9 +335,7 @@ class ContentSessionTests(unittest.IsolatedAsyncioTestCase):
                                          self._create_default_request(),
                                          InstructionMethod.CLASSIFY,
                                          instructions,
-                                         classify_entries=["x"],
-                                         task_limiter=self._create_task_limiter(),
-                                         thread_delay_factor=0
+                                         classify_entries=["x"]
                                          ))
 
         self.assertRaises(ValueError, _call_method)
@@ -0,0 +1,48 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import unittest
+
+from perceptor_client_lib.json_codec import StdlibJsonCodec, OrjsonCodec, orjson
+
+
+class StdlibJsonCodecTests(unittest.TestCase):
+    def _create_codec(self):
+        return StdlibJsonCodec()
+
+    def test_dumps_to_compact_bytes(self):
+        result = self._create_codec().dumps({"text": "ä", "values": [1, 2]})
+        self.assertIsInstance(result, bytes)
+        self.assertDictEqual(json.loads(result), {"text": "ä", "values": [1, 2]})
+        self.assertNotIn(b" ", result)
+
+    def test_loads_from_str_and_bytes(self):
+        codec = self._create_codec()
+        self.assertDictEqual(codec.loads('{"text": "a"}'), {"text": "a"})
+        self.assertDictEqual(codec.loads(b'{"text": "a"}'), {"text": "a"})
+
+    def test_invalid_input_raises_json_decode_error(self):
+        with self.assertRaises(json.JSONDecodeError):
+            self._create_codec().loads("no json")
+
+
+@unittest.skipIf(orjson is None, "orjson not installed")
+class OrjsonCodecTests(StdlibJsonCodecTests):
+    def _create_codec(self):
+        return OrjsonCodec()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,15 +13,35 @@
 #  limitations under the License.
 
 import asyncio
+import io
 import os
+import stat
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from PIL import Image
 
 import perceptor_client_lib.pdf_parsing as pdf_parsing
+from perceptor_client_lib.pdf_parsing import RenderProfile, ImageFormat, TextLayerPolicy
 
 _pdf_path = os.path.join(os.path.dirname(__file__), "test_files", "pdf_with_2_pages.pdf")
 NUMBER_OF_PAGES_IN_DOCUMENT = 2
 
 
+class ThreadRecordingReader(io.BufferedReader):
+    def __init__(self, path: str):
+        super().__init__(io.FileIO(path))
+        self.reading_threads: set[threading.Thread] = set()
+
+    def read(self, *args) -> bytes:
+        self.reading_threads.add(threading.current_thread())
+        return super().read(*args)
+
+
 class PdfParsingTests(unittest.IsolatedAsyncioTestCase):
     async def test_read_images_from_file_path(self):
         result = await asyncio.create_task(pdf_parsing.get_images_from_document_pages(_pdf_path))
@@ -43,6 +63,128 @@ class PdfParsingTests(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(len(result), NUMBER_OF_PAGES_IN_DOCUMENT)
 
+    async def test_WHEN_rendered_in_executor_THEN_pages_are_in_order(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            result = await pdf_parsing.get_images_from_document_pages(_pdf_path, executor)
+            expected = await pdf_parsing.get_images_from_document_pages(_pdf_path)
+
+        self.assertListEqual(result, expected)
+
+    async def test_WHEN_rendered_in_executor_THEN_pages_are_rendered_in_parallel(self):
+        rendering_threads: set[threading.Thread] = set()
+
+        def render_page(path, page_index, poppler_path, render_profile):
+            rendering_threads.add(threading.current_thread())
+            time.sleep(0.05)
+            return bytes([page_index])
+
+        with ThreadPoolExecutor(max_workers=4) as executor, \
+                patch.object(pdf_parsing, "_get_number_of_pages", return_value=4), \
+                patch.object(pdf_parsing, "_render_page", side_effect=render_page):
+            result = await pdf_parsing.get_images_from_document_pages(_pdf_path, executor)
+
+        self.assertListEqual(result, [bytes([0]), bytes([1]), bytes([2]), bytes([3])])
+        self.assertGreater(len(rendering_threads), 1)
+
+    async def test_iterate_images_from_bytes_in_page_order(self):
+        with open(_pdf_path, 'rb') as f:
+            file_bytes = f.read()
+        pages = [page async for page in pdf_parsing.iterate_images_from_document_pages(file_bytes, look_ahead=1)]
+
+        self.assertListEqual([page_index for page_index, _ in pages], list(range(NUMBER_OF_PAGES_IN_DOCUMENT)))
+        for _, context_data in pages:
+            self.assertEqual(context_data.context_type, "image")
+            self.assertTrue(context_data.content.startswith("data:image/png;base64,"))
+
+    def test_WHEN_render_profile_has_image_format_THEN_image_is_encoded_in_format(self):
+        image = Image.effect_noise((64, 64), 50).convert("RGB")
+        for image_format in ImageFormat:
+            encoded = pdf_parsing._get_bytes_from_image(image, RenderProfile(image_format=image_format))
+            self.assertEqual(Image.open(io.BytesIO(encoded)).format, image_format.name)
+
+    def test_WHEN_quality_is_lower_THEN_image_is_smaller(self):
+        image = Image.effect_noise((64, 64), 50).convert("RGB")
+        high = pdf_parsing._get_bytes_from_image(image, RenderProfile(image_format=ImageFormat.JPEG, quality=95))
+        low = pdf_parsing._get_bytes_from_image(image, RenderProfile(image_format=ImageFormat.JPEG, quality=30))
+
+        self.assertLess(len(low), len(high))
+
+    async def test_WHEN_rendered_with_lower_dpi_THEN_images_are_smaller(self):
+        high = await pdf_parsing.get_images_from_document_pages(_pdf_path, render_profile=RenderProfile(dpi=200))
+        low = await pdf_parsing.get_images_from_document_pages(
+            _pdf_path, render_profile=RenderProfile(dpi=72, grayscale=True))
+
+        self.assertLess(Image.open(io.BytesIO(low[0])).width, Image.open(io.BytesIO(high[0])).width)
+        self.assertEqual(Image.open(io.BytesIO(low[0])).mode, "L")
+
+    def test_WHEN_pages_selected_THEN_selected_indices_are_returned_in_order(self):
+        self.assertListEqual(pdf_parsing._select_pages(None, 3), [0, 1, 2])
+        self.assertListEqual(pdf_parsing._select_pages([0, -1], 5), [0, 4])
+        self.assertListEqual(pdf_parsing._select_pages([range(3, 10), 1, 3], 5), [1, 3, 4])
+        self.assertListEqual(pdf_parsing._select_pages(range(0, 100), 5), [0, 1, 2, 3, 4])
+        self.assertListEqual(pdf_parsing._select_pages([range(0, 100)], 5), [0, 1, 2, 3, 4])
+        self.assertListEqual(pdf_parsing._select_pages(lambda i: i % 2 == 1, 5), [1, 3])
+
+    def test_WHEN_page_index_out_of_range_THEN_exception_is_raised(self):
+        self.assertRaises(ValueError, lambda: pdf_parsing._select_pages([5], 5))
+        self.assertRaises(ValueError, lambda: pdf_parsing._select_pages([-6], 5))
+
+    async def test_WHEN_pages_selected_THEN_only_selected_pages_are_rendered_with_original_index(self):
+        pages = [page async for page in pdf_parsing.iterate_images_from_document_pages(_pdf_path, pages=[-1])]
+
+        self.assertListEqual([page_index for page_index, _ in pages], [NUMBER_OF_PAGES_IN_DOCUMENT - 1])
+
+    async def test_WHEN_document_is_in_memory_THEN_it_is_written_outside_of_the_event_loop(self):
+        with ThreadRecordingReader(_pdf_path) as reader, open(_pdf_path, 'rb') as f:
+            async with pdf_parsing._get_document_path(reader) as path:
+                with open(path, 'rb') as written:
+                    self.assertEqual(written.read(), f.read())
+
+            self.assertNotIn(threading.current_thread(), reader.reading_threads)
+        self.assertFalse(os.path.exists(path))
+
+    def test_WHEN_text_layer_has_enough_characters_THEN_it_is_usable(self):
+        policy = TextLayerPolicy(min_characters=5)
+
+        self.assertTrue(pdf_parsing._is_text_layer_usable("abc de f", policy))
+        self.assertFalse(pdf_parsing._is_text_layer_usable("ab  \n\f  c", policy))
+
+    async def test_WHEN_text_layer_too_short_THEN_pages_are_rendered(self):
+        pages = [page async for page in pdf_parsing.iterate_images_from_document_pages(
+            _pdf_path, text_layer_policy=TextLayerPolicy(min_characters=1_000_000))]
+
+        self.assertTrue(all(page.context_type == "image" for _, page in pages))
+
+    def test_WHEN_text_layer_is_usable_THEN_text_context_is_returned(self):
+        with patch.object(pdf_parsing, "_extract_page_text", return_value="some text of the page"):
+            content = pdf_parsing._get_page_content(_pdf_path, 0, None, RenderProfile(),
+                                                    TextLayerPolicy(min_characters=5))
+
+        self.assertEqual(content.context_type, "text")
+        self.assertEqual(content.content, "some text of the page")
+
+    def test_WHEN_pdftotext_is_missing_THEN_page_is_rendered(self):
+        with tempfile.TemporaryDirectory() as poppler_path, \
+                patch.object(pdf_parsing, "_render_page", return_value=b"rendered"):
+            content = pdf_parsing._get_page_content(_pdf_path, 0, poppler_path, RenderProfile(), TextLayerPolicy())
+
+        self.assertEqual(content.context_type, "image")
+        self.assertEqual(content.content, "data:image/png;base64,cmVuZGVyZWQ=")
+
+    def test_WHEN_pdftotext_fails_THEN_page_is_rendered(self):
+        with tempfile.TemporaryDirectory() as poppler_path, \
+                patch.object(pdf_parsing, "_render_page", return_value=b"rendered"):
+            pdftotext = os.path.join(poppler_path, "pdftotext")
+            with open(pdftotext, "w") as f:
+                f.write("#!/bin/sh\nexit 1\n")
+            os.chmod(pdftotext, os.stat(pdftotext).st_mode | stat.S_IEXEC)
+
+            content = pdf_parsing._get_page_content(_pdf_path, 0, poppler_path, RenderProfile(),
+                                                    TextLayerPolicy(min_characters=0))
+
+        self.assertEqual(content.context_type, "image")
+        self.assertEqual(content.content, "data:image/png;base64,cmVuZGVyZWQ=")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -12,10 +12,59 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
+import json
+import threading
+import time
 import unittest
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import httpx
 from requests import Response
+
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, InstructionError, InstructionPartialResult, ClassifyEntry
 # noinspection PyProtectedMember
-from perceptor_client_lib.perceptor_repository import _PerceptorRepositoryHttpClient
+from perceptor_client_lib.perceptor_repository import _PerceptorRepositoryHttpClient, \
+    PerceptorRepositoryHttpClientSettings
+
+_request_to_send = PerceptorRepositoryRequest(
+    flavor="some_flavor",
+    params={},
+    context_data=InstructionContextData(context_type="text", content="some content"),
+    method=InstructionMethod.QUESTION
+)
+
+
+class HttpClientWithMockTransport(_PerceptorRepositoryHttpClient):
+    def __init__(self, handler):
+        super().__init__(PerceptorRepositoryHttpClientSettings(api_key="api_key",
+                                                               request_url="http://api_url/",
+                                                               wait_timeout=10))
+        self._transport = httpx.MockTransport(handler)
+        self.created_http_clients: list[httpx.AsyncClient] = []
+
+    def _create_async_http_client(self) -> httpx.AsyncClient:
+        http_client = httpx.AsyncClient(transport=self._transport)
+        self.created_http_clients.append(http_client)
+        return http_client
+
+
+class KeepAliveSseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        content = b'event: finished\ndata: answer\n\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
 
 
 class PerceptorRepositoryHttpClientTests(unittest.TestCase):
@@ -34,6 +83,64 @@ class PerceptorRepositoryHttpClientTests(unittest.TestCase):
         res = _PerceptorRepositoryHttpClient._parse_bad_response_text(response)
         self.assertEqual(res.error_text, error_text_expected)
 
+    def test_WHEN_finished_event_received_THEN_rest_of_stream_is_not_read(self):
+        def event_stream():
+            yield b'event: progress\ndata: partial\n\n'
+            yield b'event: finished\ndata: full answer\n\n'
+            raise AssertionError("stream read after finished event")
+
+        response: Response = Response()
+        response.raw = None
+        response.iter_content = lambda chunk_size: event_stream()
+        res = _PerceptorRepositoryHttpClient(PerceptorRepositoryHttpClientSettings(api_key="api_key",
+                                                                                   request_url="http://api_url/",
+                                                                                   wait_timeout=10)) \
+            ._map_successful_response(response)
+        self.assertEqual(res, "full answer")
+
+    def test_WHEN_creating_body_THEN_it_contains_context_and_instruction(self):
+        request = PerceptorRepositoryRequest(flavor="some_flavor",
+                                             params={"topK": 10},
+                                             context_data=InstructionContextData(context_type="text",
+                                                                                 content='some "quoted" content'),
+                                             method=InstructionMethod.CLASSIFY)
+        repository = _PerceptorRepositoryHttpClient(PerceptorRepositoryHttpClientSettings(
+            api_key="api_key", request_url="http://api_url/", wait_timeout=10))
+
+        body = repository._get_body(request, "some_instruction", [ClassifyEntry("a"), ClassifyEntry("b")])
+
+        self.assertDictEqual(json.loads(body), {
+            "flavor": "some_flavor",
+            "contextType": "text",
+            "context": 'some "quoted" content',
+            "params": {"topK": 10},
+            "waitTimeout": 10,
+            "instruction": "some_instruction",
+            "classes": ["a", "b"]
+        })
+
+    def test_WHEN_request_has_deadline_THEN_wait_timeout_is_limited_to_remaining_time(self):
+        request = PerceptorRepositoryRequest(flavor="some_flavor",
+                                             params={},
+                                             context_data=InstructionContextData(context_type="text",
+                                                                                 content="some content"),
+                                             deadline=time.monotonic() + 5.5)
+        repository = _PerceptorRepositoryHttpClient(PerceptorRepositoryHttpClientSettings(
+            api_key="api_key", request_url="http://api_url/", wait_timeout=10))
+
+        body = repository._get_body(request, "some_instruction", [])
+
+        self.assertEqual(json.loads(body)["waitTimeout"], 5)
+
+    def test_WHEN_creating_bodies_for_same_request_THEN_context_is_serialized_once(self):
+        repository = _PerceptorRepositoryHttpClient(PerceptorRepositoryHttpClientSettings(
+            api_key="api_key", request_url="http://api_url/", wait_timeout=10))
+
+        first_template = repository._get_body_template(_request_to_send)
+        repository._get_body(_request_to_send, "other_instruction", [])
+
+        self.assertIs(repository._get_body_template(_request_to_send), first_template)
+
     def test_parse_response_text(self):
         error_text_expected = "Wrong instruction format"
 
@@ -42,6 +149,170 @@ class PerceptorRepositoryHttpClientTests(unittest.TestCase):
         res = _PerceptorRepositoryHttpClient._parse_bad_response_text(response)
         self.assertEqual(res.error_text, error_text_expected)
 
+    def test_WHEN_used_from_another_event_loop_THEN_client_of_previous_loop_is_closed(self):
+        repository = HttpClientWithMockTransport(lambda r: httpx.Response(200, content=b'event: finished\ndata: a\n\n'))
+
+        for _ in range(2):
+            result = asyncio.run(repository.send_instruction_async(_request_to_send, "some_instruction", []))
+            self.assertEqual(result, "a")
+
+        self.assertEqual(len(repository.created_http_clients), 2)
+        self.assertTrue(all(http_client.is_closed for http_client in repository.created_http_clients))
+
+    def test_WHEN_closing_after_loop_has_stopped_THEN_client_is_closed(self):
+        repository = HttpClientWithMockTransport(lambda r: httpx.Response(200, content=b'event: finished\ndata: a\n\n'))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(repository.send_instruction_async(_request_to_send, "some_instruction", []))
+            repository.close()
+            self.assertTrue(repository.created_http_clients[0].is_closed)
+        finally:
+            loop.close()
+
+
+class PerceptorRepositoryHttpClientAsyncTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_WHEN_finished_event_received_THEN_its_data_is_returned(self):
+        def handler(request: httpx.Request):
+            self.assertEqual(str(request.url), "http://api_url/generate")
+            return httpx.Response(200, content=b'event: progress\ndata: partial\n\n'
+                                               b'event: finished\ndata: full answer\n\n')
+
+        result = await HttpClientWithMockTransport(handler).send_instruction_async(_request_to_send,
+                                                                                   "some_instruction", [])
+        self.assertEqual(result, "full answer")
+
+    async def test_WHEN_finished_event_received_THEN_end_of_stream_is_not_awaited(self):
+        async def event_stream():
+            yield b'event: finished\ndata: full answer\n\n'
+            await asyncio.sleep(3600)
+            yield b'event: progress\ndata: never sent\n\n'
+
+        result = await asyncio.wait_for(
+            HttpClientWithMockTransport(lambda r: httpx.Response(200, content=event_stream()))
+            .send_instruction_async(_request_to_send, "some_instruction", []),
+            timeout=1)
+        self.assertEqual(result, "full answer")
+
+    async def test_WHEN_streaming_THEN_intermediate_events_are_yielded_before_result(self):
+        def handler(request: httpx.Request):
+            return httpx.Response(200, content=b'event: progress\ndata: full\n\n'
+                                               b'event: progress\ndata:  answer\n\n'
+                                               b'event: finished\ndata: full answer\n\n')
+
+        items = [item async for item in HttpClientWithMockTransport(handler).stream_instruction(_request_to_send,
+                                                                                                "some_instruction",
+                                                                                                [])]
+        self.assertListEqual(items, [InstructionPartialResult(text="full"),
+                                     InstructionPartialResult(text=" answer"),
+                                     "full answer"])
+
+    async def test_WHEN_caller_is_cancelled_THEN_response_stream_is_closed(self):
+        stream_closed = asyncio.Event()
+
+        async def event_stream():
+            try:
+                yield b'event: progress\ndata: partial\n\n'
+                await asyncio.sleep(3600)
+            finally:
+                stream_closed.set()
+
+        task = asyncio.create_task(
+            HttpClientWithMockTransport(lambda r: httpx.Response(200, content=event_stream()))
+            .send_instruction_async(_request_to_send, "some_instruction", []))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await asyncio.wait_for(stream_closed.wait(), timeout=1)
+
+    async def test_WHEN_status_403_THEN_unrecoverable_error_is_returned(self):
+        result = await HttpClientWithMockTransport(lambda r: httpx.Response(403)).send_instruction_async(
+            _request_to_send, "some_instruction", [])
+
+        self.assertIsInstance(result, InstructionError)
+        self.assertFalse(result.is_retryable)
+
+    async def test_WHEN_status_429_with_retry_after_THEN_it_is_returned(self):
+        result = await HttpClientWithMockTransport(
+            lambda r: httpx.Response(429, headers={"Retry-After": "2"})).send_instruction_async(
+            _request_to_send, "some_instruction", [])
+
+        self.assertTrue(result.is_retryable)
+        self.assertEqual(result.retry_after, 2)
+
+    async def test_WHEN_retry_after_is_http_date_THEN_it_is_converted_to_seconds(self):
+        retry_at = formatdate(time.time() + 30, usegmt=True)
+        result = await HttpClientWithMockTransport(
+            lambda r: httpx.Response(503, headers={"Retry-After": retry_at})).send_instruction_async(
+            _request_to_send, "some_instruction", [])
+
+        self.assertAlmostEqual(result.retry_after, 30, delta=2)
+
+    async def test_WHEN_rate_limit_is_used_up_THEN_reset_is_returned(self):
+        result = await HttpClientWithMockTransport(
+            lambda r: httpx.Response(503, headers={"X-RateLimit-Remaining": "0",
+                                                   "X-RateLimit-Reset": "5"})).send_instruction_async(
+            _request_to_send, "some_instruction", [])
+
+        self.assertEqual(result.retry_after, 5)
+
+    async def test_WHEN_status_500_THEN_no_retry_after_is_returned(self):
+        result = await HttpClientWithMockTransport(
+            lambda r: httpx.Response(500, headers={"Retry-After": "2"})).send_instruction_async(
+            _request_to_send, "some_instruction", [])
+
+        self.assertTrue(result.is_retryable)
+        self.assertIsNone(result.retry_after)
+
+    async def test_WHEN_transport_fails_THEN_retryable_error_is_returned(self):
+        def handler(request: httpx.Request):
+            raise httpx.ConnectError("connection refused")
+
+        result = await HttpClientWithMockTransport(handler).send_instruction_async(_request_to_send,
+                                                                                   "some_instruction", [])
+        self.assertIsInstance(result, InstructionError)
+        self.assertTrue(result.is_retryable)
+
+
+class PerceptorRepositoryHttpClientConnectionPoolTests(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveSseHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._repository = _PerceptorRepositoryHttpClient(PerceptorRepositoryHttpClientSettings(
+            api_key="api_key",
+            request_url=f"http://127.0.0.1:{self._server.server_port}/",
+            wait_timeout=10,
+            max_connections=1))
+
+    async def asyncTearDown(self):
+        await self._repository.aclose()
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    async def test_WHEN_sending_sequential_requests_THEN_connection_is_reused(self):
+        for _ in range(3):
+            result = await self._repository.send_instruction_async(_request_to_send, "some_instruction", [])
+            self.assertEqual(result, "answer")
+
+        statistics = self._repository.get_connection_pool_statistics()
+        self.assertEqual(statistics.requests, 3)
+        self.assertEqual(statistics.new_connections, 1)
+        self.assertEqual(statistics.reused_connections, 2)
+
+    def test_WHEN_sending_sequential_sync_requests_THEN_connection_is_reused(self):
+        for _ in range(3):
+            result = self._repository.send_instruction(_request_to_send, "some_instruction", [])
+            self.assertEqual(result, "answer")
+
+        statistics = self._repository.get_connection_pool_statistics()
+        self.assertEqual(statistics.new_connections, 1)
+        self.assertEqual(statistics.reused_connections, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from perceptor_client_lib.rate_limiter import RateLimiter
+
+
+class RateLimiterTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_burst_is_not_delayed(self):
+        rate_limiter = RateLimiter(requests_per_second=1, burst_size=3)
+        start = time.monotonic()
+        for _ in range(3):
+            await rate_limiter.acquire()
+
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    async def test_requests_are_paced(self):
+        rate_limiter = RateLimiter(requests_per_second=20)
+        start = time.monotonic()
+        for _ in range(5):
+            await rate_limiter.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_waiting_does_not_block_event_loop(self):
+        rate_limiter = RateLimiter(requests_per_second=5)
+        await rate_limiter.acquire()
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await rate_limiter.acquire()
+        ticker.cancel()
+
+        self.assertGreater(ticks, 5)
+
+    def test_WHEN_used_from_several_event_loops_THEN_requests_are_paced(self):
+        rate_limiter = RateLimiter(requests_per_second=20)
+
+        async def acquire_concurrently():
+            await asyncio.gather(*[rate_limiter.acquire() for _ in range(3)])
+
+        start = time.monotonic()
+        asyncio.run(acquire_concurrently())
+        asyncio.run(acquire_concurrently())
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.24)
+
+    def test_WHEN_acquired_from_threads_THEN_requests_are_paced(self):
+        rate_limiter = RateLimiter(requests_per_second=20)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda _: rate_limiter.acquire_sync(), range(5)))
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_WHEN_waiting_caller_cancelled_THEN_token_is_returned(self):
+        rate_limiter = RateLimiter(requests_per_second=10)
+        await rate_limiter.acquire()
+        waiting = asyncio.create_task(rate_limiter.acquire())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+        start = time.monotonic()
+        await rate_limiter.acquire()
+
+        self.assertLess(time.monotonic() - start, 0.15)
+
+    def test_invalid_arguments_rejected(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(requests_per_second=0)
+        with self.assertRaises(ValueError):
+            RateLimiter(requests_per_second=1, burst_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from typing import AsyncIterator
+
+# noinspection PyProtectedMember
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, _InstructionResult, InstructionError, ClassifyEntry, InstructionPartialResult, \
+    _InstructionStreamItem
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_cachedecorator import _PerceptorRepositoryCacheDecorator, \
+    ResponseCacheSettings, _MemoryCacheStorage, _SqliteCacheStorage
+
+
+class CountingRepositoryMock(_PerceptorRepository):
+    def __init__(self, result: _InstructionResult = None):
+        self.number_of_calls = 0
+        self._result = result
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.number_of_calls += 1
+        if self._result is not None:
+            return self._result
+        return f"{instruction}  :: ok"
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        return self.send_instruction(request, instruction, classify_entries)
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        yield InstructionPartialResult(text=instruction)
+        yield self.send_instruction(request, instruction, classify_entries)
+
+
+class TruncatedStreamRepositoryMock(CountingRepositoryMock):
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        self.number_of_calls += 1
+        yield InstructionPartialResult(text=instruction)
+        # like the http client, if the stream ends without a "finished" event
+        yield ""
+
+
+def _create_request(content: str = "some content", params: dict = None) -> PerceptorRepositoryRequest:
+    return PerceptorRepositoryRequest(
+        flavor="some_flavor",
+        params={"a": 1, "b": 2} if params is None else params,
+        context_data=InstructionContextData(context_type="text", content=content),
+        method=InstructionMethod.QUESTION
+    )
+
+
+class PerceptorRepositoryCacheDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    @staticmethod
+    def _create_decorator(mock_repository: _PerceptorRepository, **settings):
+        return _PerceptorRepositoryCacheDecorator(mock_repository,
+                                                  _MemoryCacheStorage(ResponseCacheSettings(**settings)))
+
+    async def test_WHEN_same_instruction_sent_again_THEN_cached_response_is_returned(self):
+        mock_repository = CountingRepositoryMock()
+        cache = self._create_decorator(mock_repository)
+
+        first = await cache.send_instruction_async(_create_request(), "instruction", [])
+        # a new request for the same content and params in different order
+        second = await cache.send_instruction_async(_create_request(params={"b": 2, "a": 1}), "instruction", [])
+
+        self.assertEqual(first, second)
+        self.assertEqual(mock_repository.number_of_calls, 1)
+        statistics = cache.get_statistics()
+        self.assertEqual(statistics.hits, 1)
+        self.assertEqual(statistics.misses, 1)
+        self.assertEqual(statistics.entries, 1)
+
+    async def test_WHEN_key_parts_differ_THEN_request_is_sent(self):
+        mock_repository = CountingRepositoryMock()
+        cache = self._create_decorator(mock_repository)
+
+        await cache.send_instruction_async(_create_request(), "instruction", [])
+        await cache.send_instruction_async(_create_request(content="other content"), "instruction", [])
+        await cache.send_instruction_async(_create_request(params={"a": 2}), "instruction", [])
+        await cache.send_instruction_async(_create_request(), "other instruction", [])
+        await cache.send_instruction_async(_create_request(), "instruction", [ClassifyEntry("x")])
+
+        self.assertEqual(mock_repository.number_of_calls, 5)
+
+    async def test_WHEN_request_fails_THEN_error_is_not_cached(self):
+        mock_repository = CountingRepositoryMock(InstructionError(error_text="some error"))
+        cache = self._create_decorator(mock_repository)
+
+        await cache.send_instruction_async(_create_request(), "instruction", [])
+        await cache.send_instruction_async(_create_request(), "instruction", [])
+
+        self.assertEqual(mock_repository.number_of_calls, 2)
+
+    def test_WHEN_max_entries_exceeded_THEN_least_recently_used_entry_is_evicted(self):
+        mock_repository = CountingRepositoryMock()
+        cache = self._create_decorator(mock_repository, max_entries=2)
+        request = _create_request()
+
+        cache.send_instruction(request, "1", [])
+        cache.send_instruction(request, "2", [])
+        cache.send_instruction(request, "1", [])
+        cache.send_instruction(request, "3", [])
+
+        cache.send_instruction(request, "1", [])
+        self.assertEqual(mock_repository.number_of_calls, 3)
+        cache.send_instruction(request, "2", [])
+        self.assertEqual(mock_repository.number_of_calls, 4)
+
+    def test_WHEN_max_bytes_exceeded_THEN_entries_are_evicted(self):
+        cache = self._create_decorator(CountingRepositoryMock(), max_bytes=200)
+        request = _create_request()
+        for i in range(5):
+            cache.send_instruction(request, str(i), [])
+
+        statistics = cache.get_statistics()
+        self.assertLessEqual(statistics.size_bytes, 200)
+        self.assertLess(statistics.entries, 5)
+
+    def test_WHEN_entry_expired_THEN_request_is_sent(self):
+        mock_repository = CountingRepositoryMock()
+        cache = self._create_decorator(mock_repository, ttl=0.01)
+
+        cache.send_instruction(_create_request(), "instruction", [])
+        time.sleep(0.02)
+        cache.send_instruction(_create_request(), "instruction", [])
+
+        self.assertEqual(mock_repository.number_of_calls, 2)
+
+    async def test_WHEN_streamed_response_cached_THEN_only_result_is_yielded(self):
+        mock_repository = CountingRepositoryMock()
+        cache = self._create_decorator(mock_repository)
+
+        first = [item async for item in cache.stream_instruction(_create_request(), "instruction", [])]
+        second = [item async for item in cache.stream_instruction(_create_request(), "instruction", [])]
+
+        self.assertEqual(len(first), 2)
+        self.assertListEqual(second, ["instruction  :: ok"])
+        self.assertEqual(mock_repository.number_of_calls, 1)
+
+    async def test_WHEN_stream_ends_without_finished_event_THEN_result_is_not_cached(self):
+        mock_repository = TruncatedStreamRepositoryMock()
+        cache = self._create_decorator(mock_repository)
+
+        first = [item async for item in cache.stream_instruction(_create_request(), "instruction", [])]
+        second = [item async for item in cache.stream_instruction(_create_request(), "instruction", [])]
+
+        self.assertEqual(first[-1], "")
+        self.assertEqual(len(second), 2)
+        self.assertEqual(mock_repository.number_of_calls, 2)
+        self.assertEqual(cache.get_statistics().misses, 2)
+
+    async def test_WHEN_cache_only_and_not_cached_THEN_error_is_returned_without_request(self):
+        mock_repository = CountingRepositoryMock()
+        cache = _PerceptorRepositoryCacheDecorator(mock_repository,
+                                                   _MemoryCacheStorage(ResponseCacheSettings()), cache_only=True)
+
+        result = await cache.send_instruction_async(_create_request(), "instruction", [])
+        streamed = [item async for item in cache.stream_instruction(_create_request(), "instruction", [])]
+
+        self.assertIsInstance(result, InstructionError)
+        self.assertFalse(result.is_retryable)
+        self.assertIsInstance(streamed[0], InstructionError)
+        self.assertEqual(mock_repository.number_of_calls, 0)
+
+    async def test_WHEN_sqlite_file_is_locked_THEN_event_loop_is_not_blocked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.sqlite")
+            cache = _PerceptorRepositoryCacheDecorator(CountingRepositoryMock(),
+                                                       _SqliteCacheStorage(path, ResponseCacheSettings()))
+            # e.g. another process writing to the same file
+            other_connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            other_connection.execute("BEGIN IMMEDIATE")
+            threading.Timer(0.2, other_connection.commit).start()
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            ticker = asyncio.create_task(tick())
+            result = await cache.send_instruction_async(_create_request(), "instruction", [])
+            ticker.cancel()
+            await cache.aclose()
+            other_connection.close()
+
+        self.assertEqual(result, "instruction  :: ok")
+        self.assertGreater(ticks, 5)
+
+
+class SqliteCacheStorageTests(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._directory.name, "cache.sqlite")
+        self._storages: list[_SqliteCacheStorage] = []
+
+    def tearDown(self):
+        for storage in self._storages:
+            storage.close()
+        self._directory.cleanup()
+
+    def _create_storage(self, **settings) -> _SqliteCacheStorage:
+        storage = _SqliteCacheStorage(self._path, ResponseCacheSettings(**settings))
+        self._storages.append(storage)
+        return storage
+
+    def test_WHEN_stored_THEN_response_is_shared_with_other_connections(self):
+        self._create_storage().set("key", "value")
+
+        # e.g. another process, or the same process after a restart
+        other = self._create_storage()
+
+        self.assertEqual(other.get("key"), "value")
+        self.assertIsNone(other.get("other key"))
+        self.assertEqual(other.get_number_of_entries(), 1)
+        self.assertEqual(other.get_size(), len("key") + len("value"))
+
+    def test_WHEN_max_entries_exceeded_THEN_least_recently_used_entry_is_evicted(self):
+        storage = self._create_storage(max_entries=2)
+        storage.set("1", "a")
+        time.sleep(0.01)
+        storage.set("2", "b")
+        time.sleep(0.01)
+        storage.get("1")
+        time.sleep(0.01)
+        storage.set("3", "c")
+
+        self.assertEqual(storage.get("1"), "a")
+        self.assertIsNone(storage.get("2"))
+        self.assertEqual(storage.get("3"), "c")
+
+    def test_WHEN_max_bytes_exceeded_THEN_entries_are_evicted(self):
+        storage = self._create_storage(max_bytes=25)
+        for i in range(5):
+            storage.set(str(i), "0123456789")
+
+        self.assertLessEqual(storage.get_size(), 25)
+        self.assertEqual(storage.get_number_of_entries(), 2)
+
+    def test_WHEN_entry_expired_THEN_none_is_returned(self):
+        storage = self._create_storage(ttl=0.01)
+        storage.set("key", "value")
+        time.sleep(0.02)
+
+        self.assertIsNone(storage.get("key"))
+        self.assertEqual(storage.get_number_of_entries(), 0)
+
+    def test_WHEN_used_by_decorator_THEN_cached_response_is_returned(self):
+        mock_repository = CountingRepositoryMock()
+        cache = _PerceptorRepositoryCacheDecorator(mock_repository, self._create_storage())
+
+        cache.send_instruction(_create_request(), "instruction", [])
+        result = _PerceptorRepositoryCacheDecorator(mock_repository, self._create_storage()) \
+            .send_instruction(_create_request(), "instruction", [])
+
+        self.assertEqual(result, "instruction  :: ok")
+        self.assertEqual(mock_repository.number_of_calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import time
+import unittest
+
+# noinspection PyProtectedMember
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, _InstructionResult, InstructionError, ClassifyEntry
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_circuitbreakerdecorator import \
+    _PerceptorRepositoryCircuitBreakerDecorator, CircuitBreakerSettings, CircuitState
+
+
+class SwitchableRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.number_of_calls = 0
+        self.result: _InstructionResult = InstructionError(error_text="some error", is_retryable=True)
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.number_of_calls += 1
+        return self.result
+
+
+class HangingRepositoryMock(_PerceptorRepository):
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        await asyncio.sleep(3600)
+        return "ok"
+
+
+request_to_send = PerceptorRepositoryRequest(
+    flavor="some_flavor",
+    params={},
+    context_data=InstructionContextData(context_type="text", content="some content"),
+    method=InstructionMethod.QUESTION
+)
+
+_settings = CircuitBreakerSettings(failure_rate_threshold=0.5, window_size=4, minimum_number_of_calls=4,
+                                   open_duration=0.05, half_open_max_calls=1)
+
+
+class PerceptorRepositoryCircuitBreakerDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def _send(self, repository: _PerceptorRepository, times: int = 1) -> _InstructionResult:
+        result = None
+        for _ in range(times):
+            result = await repository.send_instruction_async(request_to_send, "some_instruction", [])
+        return result
+
+    async def test_WHEN_failure_rate_exceeded_THEN_requests_fail_fast(self):
+        mock_repository = SwitchableRepositoryMock()
+        circuit_breaker = _PerceptorRepositoryCircuitBreakerDecorator(mock_repository, _settings)
+        await self._send(circuit_breaker, times=4)
+
+        result = await self._send(circuit_breaker)
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.OPEN)
+        self.assertEqual(mock_repository.number_of_calls, 4)
+        self.assertTrue(result.is_retryable)
+        self.assertEqual(result.error_text, "circuit breaker is open")
+
+    async def test_WHEN_failures_are_not_retryable_THEN_circuit_stays_closed(self):
+        mock_repository = SwitchableRepositoryMock()
+        mock_repository.result = InstructionError(error_text="bad request", is_retryable=False)
+        circuit_breaker = _PerceptorRepositoryCircuitBreakerDecorator(mock_repository, _settings)
+        await self._send(circuit_breaker, times=5)
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.CLOSED)
+        self.assertEqual(mock_repository.number_of_calls, 5)
+
+    async def test_WHEN_probe_succeeds_THEN_circuit_closes(self):
+        mock_repository = SwitchableRepositoryMock()
+        circuit_breaker = _PerceptorRepositoryCircuitBreakerDecorator(mock_repository, _settings)
+        await self._send(circuit_breaker, times=4)
+        time.sleep(0.06)
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.HALF_OPEN)
+
+        mock_repository.result = "ok"
+        result = await self._send(circuit_breaker)
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.CLOSED)
+
+    async def test_WHEN_probe_fails_THEN_circuit_opens_again(self):
+        mock_repository = SwitchableRepositoryMock()
+        circuit_breaker = _PerceptorRepositoryCircuitBreakerDecorator(mock_repository, _settings)
+        await self._send(circuit_breaker, times=4)
+        time.sleep(0.06)
+
+        await self._send(circuit_breaker)
+
+        self.assertEqual(circuit_breaker.get_state(), CircuitState.OPEN)
+        self.assertEqual(mock_repository.number_of_calls, 5)
+
+    async def test_WHEN_probe_is_cancelled_THEN_next_request_may_probe(self):
+        circuit_breaker = _PerceptorRepositoryCircuitBreakerDecorator(SwitchableRepositoryMock(), _settings)
+        await self._send(circuit_breaker, times=4)
+        time.sleep(0.06)
+        circuit_breaker._decoree = HangingRepositoryMock()
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self._send(circuit_breaker), timeout=0.01)
+        circuit_breaker._decoree = SwitchableRepositoryMock()
+        circuit_breaker._decoree.result = "ok"
+
+        self.assertEqual(await self._send(circuit_breaker), "ok")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+
+# noinspection PyProtectedMember
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, _InstructionResult, ClassifyEntry, _InstructionStreamItem
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_coalescingdecorator import _PerceptorRepositoryCoalescingDecorator
+
+
+class SlowRepositoryMock(_PerceptorRepository):
+    def __init__(self, delay: float = 0.05):
+        self.number_of_calls = 0
+        self._delay = delay
+        self._lock = threading.Lock()
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        with self._lock:
+            self.number_of_calls += 1
+        time.sleep(self._delay)
+        return f"{instruction}  :: {self.number_of_calls}"
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.number_of_calls += 1
+        await asyncio.sleep(self._delay)
+        return f"{instruction}  :: {self.number_of_calls}"
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        yield await self.send_instruction_async(request, instruction, classify_entries)
+
+
+def _create_request(content: str = "some content") -> PerceptorRepositoryRequest:
+    return PerceptorRepositoryRequest(
+        flavor="some_flavor",
+        params={},
+        context_data=InstructionContextData(context_type="image", content=content),
+        method=InstructionMethod.QUESTION
+    )
+
+
+class PerceptorRepositoryCoalescingDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_WHEN_identical_requests_in_flight_THEN_one_request_is_sent(self):
+        mock_repository = SlowRepositoryMock()
+        coalescing = _PerceptorRepositoryCoalescingDecorator(mock_repository)
+
+        results = await asyncio.gather(
+            *[coalescing.send_instruction_async(_create_request(), "instruction", []) for _ in range(5)])
+
+        self.assertEqual(mock_repository.number_of_calls, 1)
+        self.assertListEqual(results, ["instruction  :: 1"] * 5)
+        statistics = coalescing.get_statistics()
+        self.assertEqual(statistics.requests, 5)
+        self.assertEqual(statistics.coalesced_requests, 4)
+
+    async def test_WHEN_requests_differ_THEN_all_are_sent(self):
+        mock_repository = SlowRepositoryMock()
+        coalescing = _PerceptorRepositoryCoalescingDecorator(mock_repository)
+
+        await asyncio.gather(coalescing.send_instruction_async(_create_request(), "instruction", []),
+                             coalescing.send_instruction_async(_create_request("other"), "instruction", []),
+                             coalescing.send_instruction_async(_create_request(), "other instruction", []))
+
+        self.assertEqual(mock_repository.number_of_calls, 3)
+        self.assertEqual(coalescing.get_statistics().coalesced_requests, 0)
+
+    async def test_WHEN_first_request_finished_THEN_identical_request_is_sent_again(self):
+        mock_repository = SlowRepositoryMock(delay=0)
+        coalescing = _PerceptorRepositoryCoalescingDecorator(mock_repository)
+
+        await coalescing.send_instruction_async(_create_request(), "instruction", [])
+        await coalescing.send_instruction_async(_create_request(), "instruction", [])
+
+        self.assertEqual(mock_repository.number_of_calls, 2)
+
+    async def test_WHEN_one_caller_cancelled_THEN_others_receive_result(self):
+        mock_repository = SlowRepositoryMock()
+        coalescing = _PerceptorRepositoryCoalescingDecorator(mock_repository)
+
+        first = asyncio.ensure_future(coalescing.send_instruction_async(_create_request(), "instruction", []))
+        second = asyncio.ensure_future(coalescing.send_instruction_async(_create_request(), "instruction", []))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        self.assertEqual(await second, "instruction  :: 1")
+        self.assertTrue(first.cancelled())
+
+    def test_WHEN_identical_sync_requests_in_flight_THEN_one_request_is_sent(self):
+        mock_repository = SlowRepositoryMock()
+        coalescing = _PerceptorRepositoryCoalescingDecorator(mock_repository)
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(
+                lambda _: coalescing.send_instruction(_create_request(), "instruction", []), range(3)))
+
+        self.assertEqual(mock_repository.number_of_calls, 1)
+        self.assertListEqual(results, ["instruction  :: 1"] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator
+
+from perceptor_client_lib.external_models import RequestPriority
+# noinspection PyProtectedMember
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, _InstructionResult, InstructionError, ClassifyEntry, InstructionPartialResult, \
+    _InstructionStreamItem
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_cachedecorator import _PerceptorRepositoryCacheDecorator, \
+    _MemoryCacheStorage, ResponseCacheSettings
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_concurrencydecorator import _PerceptorRepositoryConcurrencyDecorator, \
+    _PerceptorRepositoryLoadFeedbackDecorator
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_retrydecorator import _PerceptorRepositoryRetryDecorator
+from perceptor_client_lib.task_limiter import TaskLimiter
+
+
+class AsyncRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return f"{instruction}  :: ok"
+
+    async def stream_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                                 classify_entries: list[ClassifyEntry]) -> AsyncIterator[_InstructionStreamItem]:
+        yield InstructionPartialResult(text=instruction)
+        yield await self.send_instruction_async(request, instruction, classify_entries)
+
+
+class BlockingRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.thread_names: set[str] = set()
+        self._lock = threading.Lock()
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        with self._lock:
+            self.thread_names.add(threading.current_thread().name)
+        time.sleep(0.01)
+        return f"{instruction}  :: ok"
+
+
+class FailingTwiceRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.number_of_calls = 0
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.number_of_calls += 1
+        if self.number_of_calls <= 2:
+            return InstructionError(error_text="too many requests", is_retryable=True)
+        return f"{instruction}  :: ok"
+
+
+class RecordingTaskLimiter(TaskLimiter):
+    def __init__(self):
+        super().__init__(max_number_of_threads=2)
+        self.recorded_overloads: list[bool] = []
+
+    def record_result(self, started: float, is_overloaded: bool) -> None:
+        self.recorded_overloads.append(is_overloaded)
+        super().record_result(started, is_overloaded)
+
+
+def _create_request(method: InstructionMethod = InstructionMethod.QUESTION,
+                    priority: RequestPriority = RequestPriority.NORMAL) -> PerceptorRepositoryRequest:
+    return PerceptorRepositoryRequest(
+        flavor="some_flavor",
+        params={},
+        context_data=InstructionContextData(context_type="text", content="some content"),
+        method=method,
+        priority=priority
+    )
+
+
+class PerceptorRepositoryConcurrencyDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_WHEN_sending_concurrently_THEN_limit_is_not_exceeded(self):
+        repository = AsyncRepositoryMock()
+        decorator = _PerceptorRepositoryConcurrencyDecorator(repository, TaskLimiter(max_number_of_threads=2))
+
+        results = await asyncio.gather(*[decorator.send_instruction_async(_create_request(), str(i), [])
+                                         for i in range(6)])
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(repository.max_in_flight, 2)
+
+    async def test_WHEN_request_has_priority_THEN_it_is_reported_for_the_priority(self):
+        task_limiter = TaskLimiter(max_number_of_threads=2)
+        decorator = _PerceptorRepositoryConcurrencyDecorator(AsyncRepositoryMock(), task_limiter)
+
+        await decorator.send_instruction_async(_create_request(priority=RequestPriority.HIGH), "1", [])
+
+        self.assertEqual(task_limiter.get_wait_statistics()[RequestPriority.HIGH].started_tasks, 1)
+        self.assertEqual(task_limiter.get_wait_statistics()[RequestPriority.NORMAL].started_tasks, 0)
+
+    async def test_WHEN_method_has_own_limiter_THEN_it_is_used(self):
+        task_limiter = TaskLimiter(max_number_of_threads=2)
+        table_task_limiter = TaskLimiter(max_number_of_threads=1)
+        decorator = _PerceptorRepositoryConcurrencyDecorator(AsyncRepositoryMock(), task_limiter,
+                                                             {InstructionMethod.TABLE: table_task_limiter})
+
+        await decorator.send_instruction_async(_create_request(InstructionMethod.TABLE), "1", [])
+
+        self.assertEqual(table_task_limiter.get_wait_statistics()[RequestPriority.NORMAL].started_tasks, 1)
+        self.assertEqual(task_limiter.get_wait_statistics()[RequestPriority.NORMAL].started_tasks, 0)
+
+    async def test_WHEN_decoree_is_blocking_THEN_it_runs_in_executor(self):
+        repository = BlockingRepositoryMock()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="worker") as executor:
+            decorator = _PerceptorRepositoryConcurrencyDecorator(repository, TaskLimiter(max_number_of_threads=2),
+                                                                 executor=executor)
+            result = await decorator.send_instruction_async(_create_request(), "1", [])
+
+        self.assertEqual(result, "1  :: ok")
+        self.assertTrue(all(name.startswith("worker") for name in repository.thread_names))
+
+    async def test_WHEN_streaming_THEN_slot_is_held_until_stream_is_closed(self):
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        decorator = _PerceptorRepositoryConcurrencyDecorator(AsyncRepositoryMock(), task_limiter)
+
+        items = decorator.stream_instruction(_create_request(), "1", [])
+        await items.__anext__()
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 1)
+        await items.aclose()
+
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 0)
+
+    async def test_WHEN_response_is_cached_THEN_no_slot_is_taken(self):
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        cache = _PerceptorRepositoryCacheDecorator(
+            _PerceptorRepositoryConcurrencyDecorator(AsyncRepositoryMock(), task_limiter),
+            _MemoryCacheStorage(ResponseCacheSettings()))
+
+        for _ in range(3):
+            await cache.send_instruction_async(_create_request(), "1", [])
+
+        self.assertEqual(task_limiter.get_wait_statistics()[RequestPriority.NORMAL].started_tasks, 1)
+
+
+class PerceptorRepositoryLoadFeedbackDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_WHEN_request_is_retried_THEN_every_attempt_is_recorded(self):
+        task_limiter = RecordingTaskLimiter()
+        decorator = _PerceptorRepositoryRetryDecorator(
+            _PerceptorRepositoryLoadFeedbackDecorator(FailingTwiceRepositoryMock(), task_limiter), max_retries=3)
+
+        result = await decorator.send_instruction_async(_create_request(), "1", [])
+
+        self.assertEqual(result, "1  :: ok")
+        self.assertListEqual(task_limiter.recorded_overloads, [True, True, False])
+
+    async def test_WHEN_method_has_own_limiter_THEN_result_is_recorded_there(self):
+        task_limiter = RecordingTaskLimiter()
+        table_task_limiter = RecordingTaskLimiter()
+        decorator = _PerceptorRepositoryLoadFeedbackDecorator(AsyncRepositoryMock(), task_limiter,
+                                                              {InstructionMethod.TABLE: table_task_limiter})
+
+        items = [item async for item in decorator.stream_instruction(_create_request(InstructionMethod.TABLE),
+                                                                     "1", [])]
+
+        self.assertEqual(items[-1], "1  :: ok")
+        self.assertListEqual(table_task_limiter.recorded_overloads, [False])
+        self.assertListEqual(task_limiter.recorded_overloads, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
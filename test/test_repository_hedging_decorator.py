@@ -0,0 +1,103 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import unittest
+
+# noinspection PyProtectedMember
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, _InstructionResult, ClassifyEntry
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_hedgingdecorator import _PerceptorRepositoryHedgingDecorator, \
+    HedgingSettings
+
+
+class DelayedRepositoryMock(_PerceptorRepository):
+    def __init__(self, delays: list[float]):
+        self._delays = delays
+        self.number_of_calls = 0
+        self.cancelled_calls = 0
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        call_number = self.number_of_calls
+        self.number_of_calls += 1
+        try:
+            await asyncio.sleep(self._delays[call_number])
+        except asyncio.CancelledError:
+            self.cancelled_calls += 1
+            raise
+        return f"response {call_number}"
+
+
+request_to_send = PerceptorRepositoryRequest(
+    flavor="some_flavor",
+    params={},
+    context_data=InstructionContextData(context_type="text", content="some content"),
+    method=InstructionMethod.QUESTION
+)
+
+
+class PerceptorRepositoryHedgingDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    @staticmethod
+    def _create_decorator(mock_repository: _PerceptorRepository, max_hedge_ratio: float = 1):
+        return _PerceptorRepositoryHedgingDecorator(mock_repository,
+                                                    HedgingSettings(percentile=0.9, min_samples=3,
+                                                                    max_hedge_ratio=max_hedge_ratio))
+
+    async def _send(self, repository: _PerceptorRepository, times: int = 1) -> _InstructionResult:
+        result = None
+        for _ in range(times):
+            result = await repository.send_instruction_async(request_to_send, "some_instruction", [])
+        return result
+
+    async def test_WHEN_not_enough_latencies_recorded_THEN_requests_are_not_hedged(self):
+        mock_repository = DelayedRepositoryMock([0.01, 0.01, 0.05])
+        hedging_decorator = self._create_decorator(mock_repository)
+        await self._send(hedging_decorator, times=3)
+
+        self.assertEqual(mock_repository.number_of_calls, 3)
+        self.assertEqual(hedging_decorator.get_statistics().hedged_requests, 0)
+
+    async def test_WHEN_request_is_slow_THEN_duplicate_wins_and_request_is_cancelled(self):
+        mock_repository = DelayedRepositoryMock([0.01, 0.01, 0.01, 10, 0.01])
+        hedging_decorator = self._create_decorator(mock_repository)
+        await self._send(hedging_decorator, times=3)
+
+        result = await asyncio.wait_for(self._send(hedging_decorator), timeout=1)
+
+        self.assertEqual(result, "response 4")
+        self.assertEqual(mock_repository.cancelled_calls, 1)
+        statistics = hedging_decorator.get_statistics()
+        self.assertEqual(statistics.requests, 4)
+        self.assertEqual(statistics.hedged_requests, 1)
+        self.assertEqual(statistics.hedges_won, 1)
+
+    async def test_WHEN_hedge_budget_exhausted_THEN_request_is_not_hedged(self):
+        mock_repository = DelayedRepositoryMock([0.01, 0.01, 0.01, 0.1])
+        hedging_decorator = self._create_decorator(mock_repository, max_hedge_ratio=0)
+        await self._send(hedging_decorator, times=3)
+
+        result = await self._send(hedging_decorator)
+
+        self.assertEqual(result, "response 3")
+        self.assertEqual(mock_repository.number_of_calls, 4)
+        self.assertEqual(hedging_decorator.get_statistics().hedged_requests, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import time
+import unittest
+
+# noinspection PyProtectedMember
+from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, InstructionContextData, \
+    InstructionMethod, _InstructionResult, InstructionError, ClassifyEntry
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository import _PerceptorRepository
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_ratelimitdecorator import _PerceptorRepositoryRateLimitDecorator
+# noinspection PyProtectedMember
+from perceptor_client_lib.perceptor_repository_retrydecorator import _PerceptorRepositoryRetryDecorator
+from perceptor_client_lib.rate_limiter import RateLimiter
+
+
+class FailingRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.call_times: list[float] = []
+
+    def send_instruction(self, request: PerceptorRepositoryRequest, instruction: str,
+                         classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.call_times.append(time.monotonic())
+        return InstructionError(error_text="some error", is_retryable=True)
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        return self.send_instruction(request, instruction, classify_entries)
+
+
+def _create_request(method: InstructionMethod = InstructionMethod.QUESTION) -> PerceptorRepositoryRequest:
+    return PerceptorRepositoryRequest(
+        flavor="some_flavor",
+        params={},
+        context_data=InstructionContextData(context_type="text", content="some content"),
+        method=method
+    )
+
+
+def _get_min_gap(call_times: list[float]) -> float:
+    return min(later - earlier for earlier, later in zip(call_times, call_times[1:]))
+
+
+class PerceptorRepositoryRateLimitDecoratorTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_WHEN_request_is_retried_THEN_every_attempt_is_paced(self):
+        repository = FailingRepositoryMock()
+        decorator = _PerceptorRepositoryRetryDecorator(
+            _PerceptorRepositoryRateLimitDecorator(repository, RateLimiter(requests_per_second=20)),
+            max_retries=3)
+
+        await decorator.send_instruction_async(_create_request(), "1", [])
+
+        self.assertEqual(len(repository.call_times), 3)
+        self.assertGreaterEqual(_get_min_gap(repository.call_times), 0.04)
+
+    async def test_WHEN_method_has_own_limit_THEN_it_applies_in_addition(self):
+        repository = FailingRepositoryMock()
+        decorator = _PerceptorRepositoryRateLimitDecorator(repository, RateLimiter(requests_per_second=1000),
+                                                           {InstructionMethod.TABLE: RateLimiter(20)})
+
+        for _ in range(3):
+            await decorator.send_instruction_async(_create_request(InstructionMethod.TABLE), "1", [])
+        for _ in range(3):
+            await decorator.send_instruction_async(_create_request(), "1", [])
+
+        self.assertGreaterEqual(_get_min_gap(repository.call_times[:3]), 0.04)
+        self.assertLess(repository.call_times[-1] - repository.call_times[3], 0.04)
+
+    async def test_WHEN_cancelled_while_waiting_for_method_limit_THEN_client_wide_token_is_returned(self):
+        rate_limiter = RateLimiter(requests_per_second=10)
+        decorator = _PerceptorRepositoryRateLimitDecorator(FailingRepositoryMock(), rate_limiter,
+                                                           {InstructionMethod.TABLE: RateLimiter(1)})
+        await decorator.send_instruction_async(_create_request(InstructionMethod.TABLE), "1", [])
+        await asyncio.sleep(0.1)
+
+        # takes the client-wide token at once and waits for the token of the method
+        waiting = asyncio.create_task(decorator.send_instruction_async(_create_request(InstructionMethod.TABLE),
+                                                                       "1", []))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+        start = time.monotonic()
+        await rate_limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_WHEN_sending_sync_THEN_requests_are_paced(self):
+        repository = FailingRepositoryMock()
+        decorator = _PerceptorRepositoryRateLimitDecorator(repository, RateLimiter(requests_per_second=20))
+
+        for _ in range(3):
+            decorator.send_instruction(_create_request(), "1", [])
+
+        self.assertGreaterEqual(_get_min_gap(repository.call_times), 0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,7 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import time
 import unittest
 
 # noinspection PyProtectedMember
@@ -21,6 +22,7 @@ from perceptor_client_lib.internal_models import PerceptorRepositoryRequest, Ins
 from perceptor_client_lib.perceptor_repository import _PerceptorRepository
 # noinspection PyProtectedMember
 from perceptor_client_lib.perceptor_repository_retrydecorator import _PerceptorRepositoryRetryDecorator
+from perceptor_client_lib.retry_budget import RetryBudget
 
 
 class RepositoryMock(_PerceptorRepository):
@@ -32,6 +34,31 @@ class RepositoryMock(_PerceptorRepository):
         return self._to_return
 
 
+class FailingRepositoryMock(_PerceptorRepository):
+    def __init__(self):
+        self.number_of_calls = 0
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.number_of_calls += 1
+        return InstructionError(error_text="some error", is_retryable=True)
+
+
+class FailingOnceRepositoryMock(_PerceptorRepository):
+    def __init__(self, retry_after: float = None):
+        self.number_of_calls = 0
+        self.call_times: list[float] = []
+        self._retry_after = retry_after
+
+    async def send_instruction_async(self, request: PerceptorRepositoryRequest, instruction: str,
+                                     classify_entries: list[ClassifyEntry]) -> _InstructionResult:
+        self.number_of_calls += 1
+        self.call_times.append(time.monotonic())
+        if self.number_of_calls == 1:
+            return InstructionError(error_text="some error", is_retryable=True, retry_after=self._retry_after)
+        return "ok"
+
+
 request_to_send = PerceptorRepositoryRequest(
     flavor="some_flavor",
     params={},
@@ -61,5 +88,54 @@ class PerceptorRepositoryRetryDecoratorTests(unittest.TestCase):
         self.assertIs(result, repository_error)
 
 
+class PerceptorRepositoryRetryDecoratorAsyncTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_retryable_error_is_retried(self):
+        mock_repository = FailingOnceRepositoryMock()
+        result = await _PerceptorRepositoryRetryDecorator(mock_repository).send_instruction_async(
+            request_to_send, "some_instruction", [])
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(mock_repository.number_of_calls, 2)
+
+    async def test_WHEN_retry_after_received_THEN_retry_waits_for_it(self):
+        mock_repository = FailingOnceRepositoryMock(retry_after=0.1)
+        result = await _PerceptorRepositoryRetryDecorator(mock_repository).send_instruction_async(
+            request_to_send, "some_instruction", [])
+
+        self.assertEqual(result, "ok")
+        self.assertGreaterEqual(mock_repository.call_times[1] - mock_repository.call_times[0], 0.1)
+
+    async def test_WHEN_retry_after_received_THEN_other_requests_wait_as_well(self):
+        decorated_repository = _PerceptorRepositoryRetryDecorator(FailingOnceRepositoryMock(retry_after=0.1),
+                                                                  max_retries=1)
+        await decorated_repository.send_instruction_async(request_to_send, "some_instruction", [])
+        start = time.monotonic()
+        result = await decorated_repository.send_instruction_async(request_to_send, "some_instruction", [])
+
+        self.assertEqual(result, "ok")
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    async def test_WHEN_retry_after_exceeds_deadline_THEN_error_is_returned(self):
+        mock_repository = FailingOnceRepositoryMock(retry_after=10)
+        request = request_to_send.model_copy(update={"deadline": time.monotonic() + 1})
+        result = await _PerceptorRepositoryRetryDecorator(mock_repository).send_instruction_async(
+            request, "some_instruction", [])
+
+        self.assertIsInstance(result, InstructionError)
+        self.assertEqual(mock_repository.number_of_calls, 1)
+
+    async def test_WHEN_retry_budget_exhausted_THEN_error_is_not_retried(self):
+        mock_repository = FailingRepositoryMock()
+        decorated_repository = _PerceptorRepositoryRetryDecorator(mock_repository, max_retries=3,
+                                                                  retry_budget=RetryBudget(ratio=0, min_retries=2))
+        for _ in range(3):
+            result = await decorated_repository.send_instruction_async(request_to_send, "some_instruction", [])
+            self.assertIsInstance(result, InstructionError)
+
+        # 3 first attempts and 2 retries allowed by the budget
+        self.assertEqual(mock_repository.number_of_calls, 5)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,49 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+import unittest
+
+from perceptor_client_lib.retry_budget import RetryBudget
+
+
+class RetryBudgetTests(unittest.TestCase):
+
+    def test_min_retries_are_allowed_without_requests(self):
+        retry_budget = RetryBudget(ratio=0.1, min_retries=2)
+
+        self.assertTrue(retry_budget.try_acquire_retry())
+        self.assertTrue(retry_budget.try_acquire_retry())
+        self.assertFalse(retry_budget.try_acquire_retry())
+
+    def test_retries_are_limited_to_ratio_of_requests(self):
+        retry_budget = RetryBudget(ratio=0.1, min_retries=0)
+        for _ in range(30):
+            retry_budget.record_request()
+
+        allowed_retries = sum(1 for _ in range(10) if retry_budget.try_acquire_retry())
+
+        self.assertEqual(allowed_retries, 3)
+
+    def test_budget_is_restored_after_window(self):
+        retry_budget = RetryBudget(ratio=0, window=0.05, min_retries=1)
+        self.assertTrue(retry_budget.try_acquire_retry())
+        self.assertFalse(retry_budget.try_acquire_retry())
+
+        time.sleep(0.06)
+        self.assertTrue(retry_budget.try_acquire_retry())
+
+
+if __name__ == '__main__':
+    unittest.main()
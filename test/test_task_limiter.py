@@ -0,0 +1,194 @@
+#  Copyright 2023 TamedAI GmbH
+#  #
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#  #
+#      http://www.apache.org/licenses/LICENSE-2.0
+#  #
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import time
+import unittest
+from typing import Optional
+
+from perceptor_client_lib.external_models import RequestPriority
+from perceptor_client_lib.task_limiter import TaskLimiter
+
+
+class TaskLimiterTests(unittest.IsolatedAsyncioTestCase):
+
+    async def test_number_of_concurrent_tasks_is_limited(self):
+        task_limiter = TaskLimiter(max_number_of_threads=2)
+        max_active = 0
+
+        async def task():
+            nonlocal max_active
+            max_active = max(max_active, task_limiter.get_number_of_active_tasks())
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[task_limiter.exec_task(task()) for _ in range(6)])
+
+        self.assertEqual(max_active, 2)
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 0)
+
+    async def test_queue_depth_is_reported(self):
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        release = asyncio.Event()
+
+        tasks = [asyncio.create_task(task_limiter.exec_task(release.wait())) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 1)
+        self.assertEqual(task_limiter.get_queue_depth(), 2)
+        release.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(task_limiter.get_queue_depth(), 0)
+
+    async def test_cancelled_waiter_does_not_keep_slot(self):
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(task_limiter.exec_task(release.wait()))
+        not_started = asyncio.sleep(0)
+        waiting = asyncio.create_task(task_limiter.exec_task(not_started))
+        await asyncio.sleep(0)
+
+        waiting.cancel()
+        release.set()
+        await running
+        await asyncio.gather(waiting, return_exceptions=True)
+        not_started.close()
+
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 0)
+        self.assertEqual(task_limiter.get_queue_depth(), 0)
+
+    async def test_WHEN_waiter_cancelled_in_same_tick_as_release_THEN_cancellation_is_propagated(self):
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        release = asyncio.Event()
+        running = asyncio.create_task(task_limiter.exec_task(release.wait()))
+        not_started = asyncio.sleep(0)
+        waiting = asyncio.create_task(task_limiter.exec_task(not_started))
+        await asyncio.sleep(0)
+
+        release.set()
+        waiting.cancel()
+        results = await asyncio.gather(running, waiting, return_exceptions=True)
+        not_started.close()
+
+        self.assertTrue(results[0])
+        self.assertIsInstance(results[1], asyncio.CancelledError)
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 0)
+        self.assertEqual(task_limiter.get_queue_depth(), 0)
+
+    async def test_fixed_limit_ignores_results(self):
+        task_limiter = TaskLimiter(max_number_of_threads=3)
+        task_limiter.record_result(time.monotonic(), is_overloaded=True)
+
+        self.assertEqual(task_limiter.get_current_limit(), 3)
+
+    async def test_adaptive_limit_increases_while_saturated(self):
+        task_limiter = TaskLimiter(max_number_of_threads=4, adaptive=True, min_number_of_threads=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(task_limiter.exec_task(release.wait())) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        task_limiter.record_result(time.monotonic(), is_overloaded=False)
+
+        self.assertEqual(task_limiter.get_current_limit(), 2)
+        await asyncio.sleep(0)
+        self.assertEqual(task_limiter.get_number_of_active_tasks(), 2)
+        release.set()
+        await asyncio.gather(*tasks)
+
+    async def test_adaptive_limit_is_not_increased_when_idle(self):
+        task_limiter = TaskLimiter(max_number_of_threads=4, adaptive=True, min_number_of_threads=1)
+        task_limiter.record_result(time.monotonic(), is_overloaded=False)
+
+        self.assertEqual(task_limiter.get_current_limit(), 1)
+
+    async def test_adaptive_limit_is_halved_once_on_overload(self):
+        task_limiter = TaskLimiter(max_number_of_threads=8, adaptive=True, min_number_of_threads=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(task_limiter.exec_task(release.wait())) for _ in range(10)]
+        await asyncio.sleep(0)
+        for _ in range(6):
+            # latency large enough that scheduling jitter does not look like rising latency
+            task_limiter.record_result(time.monotonic() - 0.1, is_overloaded=False)
+        self.assertEqual(task_limiter.get_current_limit(), 4)
+
+        started = time.monotonic()
+        task_limiter.record_result(started, is_overloaded=True)
+        task_limiter.record_result(started - 1, is_overloaded=True)
+
+        self.assertEqual(task_limiter.get_current_limit(), 2)
+        release.set()
+        await asyncio.gather(*tasks)
+
+    async def _run_queued(self, task_limiter: TaskLimiter, priorities: list[RequestPriority],
+                          flows: Optional[list[str]] = None) -> list[int]:
+        release = asyncio.Event()
+        started: list[int] = []
+        flows = [None] * len(priorities) if flows is None else flows
+
+        async def task(index: int):
+            started.append(index)
+
+        blocking = asyncio.create_task(task_limiter.exec_task(release.wait()))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(task_limiter.exec_task(task(i), p, f))
+                  for i, (p, f) in enumerate(zip(priorities, flows))]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(blocking, *queued)
+        return started
+
+    async def test_queued_tasks_are_started_by_priority(self):
+        started = await self._run_queued(TaskLimiter(max_number_of_threads=1),
+                                         [RequestPriority.LOW, RequestPriority.NORMAL,
+                                          RequestPriority.HIGH, RequestPriority.HIGH])
+
+        self.assertListEqual(started, [2, 3, 1, 0])
+
+    async def test_starved_tasks_are_started_first(self):
+        started = await self._run_queued(TaskLimiter(max_number_of_threads=1, starvation_timeout=0),
+                                         [RequestPriority.LOW, RequestPriority.HIGH])
+
+        self.assertListEqual(started, [0, 1])
+
+    async def test_flows_take_turns(self):
+        started = await self._run_queued(TaskLimiter(max_number_of_threads=1),
+                                         [RequestPriority.NORMAL] * 6,
+                                         ["a", "a", "a", "a", "b", "b"])
+
+        self.assertListEqual(started, [0, 4, 1, 5, 2, 3])
+
+    async def test_flows_take_turns_by_weight(self):
+        started = await self._run_queued(TaskLimiter(max_number_of_threads=1, flow_weights={"a": 2}),
+                                         [RequestPriority.NORMAL] * 6,
+                                         ["a", "a", "a", "a", "b", "b"])
+
+        self.assertListEqual(started, [0, 1, 4, 2, 3, 5])
+
+    async def test_wait_statistics_are_reported_per_priority(self):
+        task_limiter = TaskLimiter(max_number_of_threads=1)
+        await self._run_queued(task_limiter, [RequestPriority.LOW, RequestPriority.HIGH])
+
+        statistics = task_limiter.get_wait_statistics()
+        self.assertEqual(statistics[RequestPriority.HIGH].started_tasks, 1)
+        self.assertEqual(statistics[RequestPriority.LOW].started_tasks, 1)
+        self.assertEqual(statistics[RequestPriority.NORMAL].started_tasks, 1)
+        self.assertGreater(statistics[RequestPriority.LOW].max_wait_time, 0)
+        self.assertEqual(statistics[RequestPriority.LOW].queue_depth, 0)
+
+    def test_invalid_bounds_rejected(self):
+        with self.assertRaises(ValueError):
+            TaskLimiter(max_number_of_threads=2, adaptive=True, min_number_of_threads=3)
+
+
+if __name__ == '__main__':
+    unittest.main()